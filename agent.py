@@ -1,17 +1,25 @@
 import os
 import asyncio
 import json
-from typing import Annotated, List, TypedDict, Literal, Optional
+import threading
+import time
+from typing import Annotated, Any, Dict, List, TypedDict, Literal, Optional
 from dotenv import load_dotenv
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, RemoveMessage
 from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
 from langgraph.checkpoint.memory import MemorySaver
 from disk_checkpointer import DiskBackedSaver
-from memory import load_memory, append_memory, save_thread_messages
+from memory import export_turn
+from context import (
+    CLASSIFY_TOKEN_BUDGET, CONTEXT_TOKEN_BUDGET, context_stats, messages_to_fold, render_context, summary_prompt
+)
 from pydantic import BaseModel, Field
-from langchain_mcp_adapters.tools import load_mcp_tools
+from tool_client import format_tool_output, make_tool_client
+from intent import RULE_CONFIDENCE_THRESHOLD, classifier_stats, classify_rules
+from response_cache import response_cache
 
 import logging
 
@@ -21,22 +29,38 @@ logger = logging.getLogger("agent")
 load_dotenv()
 
 # --- Models for Structured Output ---
-class IntentClassification(BaseModel):
+class IntentRequest(BaseModel):
     intent: Literal["product_inquiry", "order_status", "returns", "customer_history", "general_chat"] = Field(
-        description="The classified intent of the user query."
+        description="The classified intent of this part of the user query."
     )
     extracted_id: Optional[str] = Field(
-        description="The extracted ID (product_id, order_id, or customer_id) if present."
+        description="The extracted ID (product_id, order_id, or customer_id) this part refers to, if present."
+    )
+
+class IntentClassification(BaseModel):
+    requests: List[IntentRequest] = Field(
+        description="Every separate request in the user query, in order: one entry per intent and ID. "
+                    "Most queries contain exactly one."
     )
 
 # --- State Definition ---
 class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], "The conversation history"]
+    # Nodes return only new messages; the checkpointer holds the history.
+    messages: Annotated[List[BaseMessage], add_messages]
+    # Rolling summary of the messages folded out of `messages`.
+    summary: Optional[str]
+    # Every (intent, ID) pair in the message; `intent`/`extracted_id` hold the primary one.
+    requests: List[Dict[str, Optional[str]]]
     intent: Optional[str]
     extracted_id: Optional[str]
     tool_result: Optional[str]
+    tool_result_raw: Optional[Any]
     needs_more_info: bool
     final_response: Optional[str]
+    # LLM calls made during the current turn, not counting summary updates.
+    llm_calls: int
+    # Whether the current turn's message was classified by the LLM rather than the rules.
+    llm_classified: bool
 
 # Initialize LLM
 llm = ChatGoogleGenerativeAI(model="gemini-flash-latest", google_api_key=os.getenv("GEMINI_API_KEY"))
@@ -47,90 +71,179 @@ mcp_connection = {
     "transport": "sse",
     "url": "http://127.0.0.1:8000/sse"
 }
+# "mcp" calls mcp_server.py over SSE; "local" calls tools.py in-process.
+TOOL_TRANSPORT = os.getenv("TOOL_TRANSPORT", "mcp")
+# One client per process, shared by every graph run.
+tool_client = make_tool_client(TOOL_TRANSPORT, mcp_connection)
+
+# --- Turn Accounting ---
+class TurnStats:
+    """LLM calls per turn, split by how many requests (intent and ID pairs) a message held.
+
+    Only the calls that answer the message (classify and respond) are
+    counted, not summary updates. A message with several requests used to
+    take one turn per request; the calls those turns would have made are
+    estimated from the average of single-request turns the LLM classified,
+    since the classifier only returns several requests from the LLM.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._single = {"turns": 0, "llm_calls": 0}
+        self._llm_single = {"turns": 0, "llm_calls": 0}
+        self._multi = {"turns": 0, "requests": 0, "llm_calls": 0}
+
+    def record(self, requests: int, llm_calls: int, llm_classified: bool) -> None:
+        with self._lock:
+            if requests > 1:
+                self._multi["turns"] += 1
+                self._multi["requests"] += requests
+                self._multi["llm_calls"] += llm_calls
+                return
+            self._single["turns"] += 1
+            self._single["llm_calls"] += llm_calls
+            if llm_classified:
+                self._llm_single["turns"] += 1
+                self._llm_single["llm_calls"] += llm_calls
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            single, llm_single, multi = dict(self._single), dict(self._llm_single), dict(self._multi)
+        per_llm_single = llm_single["llm_calls"] / llm_single["turns"] if llm_single["turns"] else 0.0
+        stats: Dict[str, Any] = {
+            "single_request_turns": single["turns"],
+            "llm_calls_per_single_request_turn": single["llm_calls"] / single["turns"] if single["turns"] else 0.0,
+            "llm_classified_single_request_turns": llm_single["turns"],
+            "llm_calls_per_llm_classified_single_request_turn": per_llm_single,
+            "multi_request_turns": multi["turns"],
+            "requests_per_multi_request_turn": multi["requests"] / multi["turns"] if multi["turns"] else 0.0,
+            "llm_calls_per_multi_request_turn": multi["llm_calls"] / multi["turns"] if multi["turns"] else 0.0,
+        }
+        if llm_single["turns"] and multi["turns"]:
+            stats["llm_calls_saved_estimate"] = round(multi["requests"] * per_llm_single - multi["llm_calls"], 1)
+        return stats
+
+
+turn_stats = TurnStats()
 
 # --- Nodes ---
 
 async def initial_parse(state: AgentState):
     logger.info("--- Entering Graph: Initial Parse ---")
-    return {"needs_more_info": False, "intent": None, "extracted_id": None, "tool_result": None}
+    return {
+        "needs_more_info": False, "requests": [], "intent": None, "extracted_id": None,
+        "tool_result": None, "tool_result_raw": None, "llm_calls": 0, "llm_classified": False
+    }
+
+async def resolve_id_types(entity_id: str) -> List[str]:
+    """Tables ("product", "order", "customer") an ID exists in, via the resolve_entity tool."""
+    try:
+        output, tool = await tool_client.call("resolve_entity", {"entity_id": entity_id})
+    except Exception as e:
+        logger.warning(f"resolve_entity failed: {e}")
+        return []
+    if not tool:
+        return []
+    text, raw = format_tool_output(output)
+    try:
+        data = raw if isinstance(raw, dict) else json.loads(text)
+    except ValueError:
+        return []
+    return data.get("types", [])
+
+def _classification(requests: List[Dict[str, Optional[str]]]) -> Dict[str, Any]:
+    """State update for the classified requests; the first one with a tool and an ID leads."""
+    requests = [dict(r) for r in {(r["intent"], r["extracted_id"]): r for r in requests}.values()]
+    requests = requests or [{"intent": "general_chat", "extracted_id": None}]
+    tasks = [r for r in requests if r["intent"] != "general_chat"]
+    primary = next((r for r in tasks if r["extracted_id"]), tasks[0] if tasks else requests[0])
+    return {
+        "requests": requests,
+        "intent": primary["intent"],
+        "extracted_id": primary["extracted_id"],
+        "needs_more_info": bool(tasks) and not any(r["extracted_id"] for r in tasks)
+    }
 
 async def classify_query(state: AgentState):
     logger.info("--- Node: Classify Query ---")
     messages = state["messages"]
     last_message = messages[-1].content
+    start = time.perf_counter()
     
-    # Build conversation context for better understanding
-    context = "\n".join([f"{m.__class__.__name__.replace('Message', '')}: {m.content}" for m in messages[-5:]])
+    # Fast path: obvious intents with a known ID never reach the LLM.
+    rule = await classify_rules(last_message, resolve_id_types)
+    if rule and rule.confidence >= RULE_CONFIDENCE_THRESHOLD:
+        classifier_stats.record((time.perf_counter() - start) * 1000, skipped_llm=True)
+        logger.info(f"Rule classifier: {rule.intent} ({rule.id_type or 'no id'}, confidence {rule.confidence:.2f})")
+        return _classification([{"intent": rule.intent, "extracted_id": rule.extracted_id}])
+    
+    # Summary plus the latest turns, within the classifier's token budget
+    context = render_context(state.get("summary"), messages, CLASSIFY_TOKEN_BUDGET)
     
     prompt = f"""Given this conversation context:
 {context}
 
-Analyze the current user query and extract intent and any IDs mentioned in the conversation."""
+Analyze the current user query and extract intent and any IDs mentioned in the conversation.
+If the query asks several things (e.g. the status of one order and a return for another), list each
+as its own request with its own ID."""
     
+    context_stats.record_prompt("classify", prompt)
     result = await structured_llm.ainvoke(prompt)
+    classifier_stats.record((time.perf_counter() - start) * 1000, skipped_llm=False)
     
-    return {
-        "intent": result.intent,
-        "extracted_id": result.extracted_id,
-        "needs_more_info": result.intent != "general_chat" and not result.extracted_id
-    }
-
-async def execute_mcp_tool(state: AgentState):
-    logger.info("--- Node: Execute MCP Tool ---")
-    intent = state["intent"]
-    eid = state["extracted_id"]
-    
-    if not eid:
-        return {"tool_result": "Error: Missing required ID."}
+    update = _classification([r.model_dump() for r in result.requests])
+    update["llm_calls"] = state.get("llm_calls", 0) + 1
+    update["llm_classified"] = True
+    if len(update["requests"]) > 1:
+        logger.info(f"Classified {len(update['requests'])} requests in one message")
+    return update
+
+TOOL_MAP = {
+    "product_inquiry": "product_info",
+    "order_status": "order_status",
+    "returns": "return_request",
+    "customer_history": "customer_history"
+}
+# Orders of a customer's history put in the prompt; the tool pages the rest.
+CUSTOMER_HISTORY_PAGE = int(os.getenv("CUSTOMER_HISTORY_PAGE", "10"))
 
+async def run_tool(intent: str, eid: str):
+    """Call the tool for one (intent, ID) request. Returns (text for the prompt, raw result)."""
     try:
-        mcp_tools = await load_mcp_tools(None, connection=mcp_connection)
-        
-        tool_map = {
-            "product_inquiry": "product_info",
-            "order_status": "order_status",
-            "returns": "return_request",
-            "customer_history": "customer_history"
-        }
-        
-        tool_name = tool_map.get(intent)
-        target_tool = next((t for t in mcp_tools if t.name == tool_name), None)
-        
-        if not target_tool:
-            return {"tool_result": f"Error: Tool {tool_name} not found on MCP server."}
-        
+        tool_name = TOOL_MAP.get(intent)
         args = {"product_id": eid} if tool_name == "product_info" else \
                {"order_id": eid} if tool_name == "order_status" else \
                {"order_id": eid, "reason": "User requested via chat"} if tool_name == "return_request" else \
-               {"customer_id": eid}
+               {"customer_id": eid, "limit": CUSTOMER_HISTORY_PAGE}
         
         logger.info(f"Executing MCP Tool: {tool_name}")
-        tool_output = await target_tool.ainvoke(args)
-
-        if isinstance(tool_output, tuple) and len(tool_output) == 2:
-            result, artifact = tool_output
-        else:
-            result = tool_output
-            artifact = None
-
-        formatted_result = ""
-        if isinstance(result, dict):
-            try:
-                formatted_result = json.dumps(result)
-            except Exception:
-                formatted_result = str(result)
-        elif isinstance(result, list):
-            for block in result:
-                if isinstance(block, dict) and block.get("type") == "text":
-                    formatted_result += block.get("text", "")
-                else:
-                    formatted_result += str(block)
-        else:
-            formatted_result = str(result)
+        tool_output, target_tool = await tool_client.call(tool_name, args)
+        
+        if not target_tool:
+            return f"Error: Tool {tool_name} not found ({TOOL_TRANSPORT} transport).", None
 
-        return {"tool_result": formatted_result, "tool_result_raw": result}
+        return format_tool_output(tool_output)
     except Exception as e:
-        return {"tool_result": f"Error connecting to MCP server: {e}"}
+        return f"Error connecting to MCP server: {e}", None
+
+async def execute_mcp_tool(state: AgentState):
+    logger.info("--- Node: Execute MCP Tool ---")
+    calls = [r for r in state.get("requests") or [] if r["intent"] in TOOL_MAP and r["extracted_id"]]
+    
+    if not calls:
+        return {"tool_result": "Error: Missing required ID."}
+
+    # Several requests in one message: run their tools concurrently.
+    results = await asyncio.gather(*(run_tool(r["intent"], r["extracted_id"]) for r in calls))
+    if len(results) == 1:
+        formatted_result, result = results[0]
+        return {"tool_result": formatted_result, "tool_result_raw": result}
+    return {
+        "tool_result": "\n\n".join(
+            f"[{r['intent']} {r['extracted_id']}]\n{text}" for r, (text, _) in zip(calls, results)
+        ),
+        "tool_result_raw": [raw for _, raw in results],
+    }
 
 def decide_next_step(state: AgentState):
     logger.info("--- Router: Deciding Next Step ---")
@@ -142,8 +255,9 @@ def decide_next_step(state: AgentState):
 
 async def ask_for_info(state: AgentState):
     logger.info("--- Node: Ask for Information ---")
-    intent = state["intent"]
-    msg = f"I understand you're asking about {intent.replace('_', ' ')}, but I need an ID (like an Order ID or Product ID) to help you. Could you please provide it?"
+    intents = [r["intent"] for r in state.get("requests") or [] if r["intent"] != "general_chat"] or [state["intent"]]
+    topics = " and ".join(dict.fromkeys(i.replace('_', ' ') for i in intents))
+    msg = f"I understand you're asking about {topics}, but I need an ID (like an Order ID or Product ID) to help you. Could you please provide it?"
     return {"messages": [AIMessage(content=msg)]}
 
 async def generate_final_response(state: AgentState):
@@ -152,11 +266,8 @@ async def generate_final_response(state: AgentState):
     tool_raw = state.get("tool_result_raw")
     history = state["messages"]
     
-    # Build full conversation context
-    conversation_context = "\n".join([
-        f"{m.__class__.__name__.replace('Message', '')}: {m.content}" 
-        for m in history[-10:]
-    ])
+    # Rolling summary plus as many recent messages as the token budget allows
+    conversation_context = render_context(state.get("summary"), history, CONTEXT_TOKEN_BUDGET)
     
     if isinstance(tool_raw, dict) and tool_raw.get("status") == "error":
         msg = (
@@ -165,6 +276,19 @@ async def generate_final_response(state: AgentState):
         )
         return {"messages": [AIMessage(content=msg)]}
 
+    requests = state.get("requests") or []
+    # Same question about the same data: reuse the earlier answer, no LLM call.
+    cache_key = None
+    if tool_result and len(requests) <= 1 and response_cache.cacheable(state.get("intent")):
+        cache_key = response_cache.make_key(state["intent"], state.get("extracted_id"), tool_result, conversation_context)
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            logger.info("Response cache hit")
+            return {"messages": [AIMessage(content=cached)]}
+        if not response_cache.use_context:
+            # Shared across conversations: write it from the question alone.
+            conversation_context = render_context(None, history[-1:], CONTEXT_TOKEN_BUDGET)
+
     if tool_result:
         prompt = f"""Based on the conversation history and system data, provide a helpful response:
 
@@ -175,6 +299,11 @@ SYSTEM DATA FROM MCP SERVER:
 {tool_result}
 
 Provide a natural, conversational response that directly answers the user's question and refers back to the conversation context when relevant."""
+        if len(requests) > 1:
+            prompt += "\n\nThe message contains several requests; the data for each is labelled with its intent and ID. Answer every one of them in a single reply."
+            missing = [r["intent"].replace("_", " ") for r in requests if r["intent"] != "general_chat" and not r["extracted_id"]]
+            if missing:
+                prompt += f" The user also asked about {', '.join(missing)} without giving an ID; ask for it."
     else:
         prompt = f"""Based on the conversation, provide a helpful response:
 
@@ -183,12 +312,41 @@ CONVERSATION:
 
 Please provide a natural, conversational response that directly addresses the user's question and refers to previous context when relevant."""
         
+    context_stats.record_prompt("respond", prompt)
     response = await llm.ainvoke(prompt)
     final_content = response.content
     if isinstance(final_content, list):
         final_content = "".join([m.get("text", "") if isinstance(m, dict) else str(m) for m in final_content])
+
+    if cache_key and final_content:
+        await asyncio.to_thread(response_cache.put, cache_key, state["intent"], state.get("extracted_id"), final_content)
         
-    return {"messages": [AIMessage(content=final_content)]}
+    return {"messages": [AIMessage(content=final_content)], "llm_calls": state.get("llm_calls", 0) + 1}
+
+async def summarize_history(state: AgentState):
+    """Fold the oldest messages into the rolling summary once the history outgrows its budget.
+
+    Runs last in every turn, so it also records the turn's LLM call count.
+    """
+    requests = len(state.get("requests") or []) or 1
+    turn_stats.record(requests, state.get("llm_calls", 0), state.get("llm_classified", False))
+    fold = messages_to_fold(state["messages"])
+    if not fold:
+        return {}
+    logger.info(f"--- Node: Summarize History ({len(fold)} messages) ---")
+    prompt = summary_prompt(state.get("summary"), fold)
+    context_stats.record_prompt("summarize", prompt)
+    try:
+        response = await llm.ainvoke(prompt)
+    except Exception as e:
+        # Keep the messages; the next turn tries again.
+        logger.warning(f"Summary update failed: {e}")
+        return {}
+    summary = response.content
+    if isinstance(summary, list):
+        summary = "".join([m.get("text", "") if isinstance(m, dict) else str(m) for m in summary])
+    context_stats.record_summary(len(fold))
+    return {"summary": summary.strip(), "messages": [RemoveMessage(id=m.id) for m in fold]}
 
 # --- Graph Construction ---
 builder = StateGraph(AgentState)
@@ -198,6 +356,7 @@ builder.add_node("classify", classify_query)
 builder.add_node("tool_exec", execute_mcp_tool)
 builder.add_node("ask_info", ask_for_info)
 builder.add_node("respond", generate_final_response)
+builder.add_node("summarize", summarize_history)
 
 builder.set_entry_point("initial")
 builder.add_edge("initial", "classify")
@@ -213,16 +372,20 @@ builder.add_conditional_edges(
 )
 
 builder.add_edge("tool_exec", "respond")
-builder.add_edge("ask_info", END)
-builder.add_edge("respond", END)
+builder.add_edge("ask_info", "summarize")
+builder.add_edge("respond", "summarize")
+builder.add_edge("summarize", END)
 
 # Memory: use disk-backed saver for checkpoint persistence
-memory = DiskBackedSaver(filename="lg_checkpoint.pkl")
+memory = DiskBackedSaver(filename="lg_checkpoint.db")
 app = builder.compile(checkpointer=memory)
+# Checkpoint once, when the run finishes ("exit"). Each intermediate step would
+# otherwise store another copy of the message list; "async" restores that.
+GRAPH_DURABILITY = os.getenv("GRAPH_DURABILITY", "exit")
 
 # --- Execution Helper ---
 async def run_bot():
-    """Interactive chat loop that maintains conversation history and invokes the agent graph."""
+    """Interactive chat loop; the graph's checkpointer keeps the conversation history."""
     print("--- E-commerce Agent (LangGraph + MCP) ---")
     thread_id = "user_456"
     config = {"configurable": {"thread_id": thread_id}}
@@ -233,38 +396,16 @@ async def run_bot():
             if user_input.lower() in ['exit', 'quit']:
                 break
             
-            mem = load_memory(thread_id, limit=20)
-            messages = []
-            for m in mem:
-                role = m.get("role")
-                content = m.get("content")
-                if role == "user":
-                    messages.append(HumanMessage(content=content))
-                elif role == "assistant":
-                    messages.append(AIMessage(content=content))
-                else:
-                    messages.append(SystemMessage(content=content))
-
-            messages.append(HumanMessage(content=user_input))
-            inputs = {"messages": messages}
-            async for event in app.astream(inputs, config, stream_mode="values"):
-                pass
-                
-            final_state = app.get_state(config)
+            inputs = {"messages": [HumanMessage(content=user_input)]}
+            # The API's workers may be serving this thread from the same checkpoint file.
+            async with memory.alease(thread_id):
+                async for event in app.astream(inputs, config, stream_mode="values", durability=GRAPH_DURABILITY):
+                    pass
+
+                final_state = await app.aget_state(config)
             last_msg = final_state.values["messages"][-1].content
             print(f"Assistant: {last_msg}")
-
-            append_memory(thread_id, "user", user_input)
-            append_memory(thread_id, "assistant", last_msg)
-
-            try:
-                lg_messages = []
-                for m in final_state.values.get("messages", []):
-                    role = "assistant" if m.__class__.__name__ == "AIMessage" else "user" if m.__class__.__name__ == "HumanMessage" else "system"
-                    lg_messages.append({"role": role, "content": m.content})
-                save_thread_messages(thread_id, lg_messages)
-            except Exception:
-                pass
+            export_turn(thread_id, user_input, last_msg)
             
         except Exception as e:
             logger.error(f"Error: {e}")
@@ -1,11 +1,19 @@
 import os
 import asyncio
+import json
 import logging
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from agent import app as agent_graph
+from agent import GRAPH_DURABILITY, app as agent_graph, memory as checkpointer
 
 load_dotenv()
 
@@ -28,54 +36,161 @@ class MessageResponse(BaseModel):
     status: str
 
 
+class LatencyStats:
+    """Rolling p50/p95 of named latencies (milliseconds)."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._window = window
+
+    def record(self, name: str, ms: float) -> None:
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self._window)).append(ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+        return {
+            name: {
+                "count": len(ordered),
+                "p50_ms": statistics.median(ordered),
+                "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            }
+            for name, ordered in samples.items()
+        }
+
+
+latency = LatencyStats()
+
+
+class ThreadGate:
+    """Runs one turn at a time per thread and coalesces identical in-flight turns.
+
+    Turns for different threads run concurrently. Within a process each
+    thread has an asyncio.Lock; its holder then takes the thread's lease in
+    the checkpoint file, so turns of one thread are serialized across API
+    workers too. A request whose thread and message match a turn that is
+    queued or running in this worker waits for that turn's answer instead
+    of running the graph again.
+    """
+
+    def __init__(self, saver):
+        self._saver = saver
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._stats = {"turns": 0, "coalesced": 0, "waited": 0}
+
+    def inflight(self, thread_id: str, message: str) -> Optional[asyncio.Future]:
+        """Answer future of an identical turn still in flight, if any."""
+        future = self._inflight.get((thread_id, message))
+        if future is not None:
+            self._stats["coalesced"] += 1
+        return future
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str) -> AsyncIterator[None]:
+        """Hold the thread exclusively, in this worker and across workers."""
+        self._users[thread_id] = self._users.get(thread_id, 0) + 1
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        # Another turn of this thread is running here; the lease's own stats count waits for other workers.
+        self._stats["waited"] += int(lock.locked())
+        start = time.perf_counter()
+        try:
+            async with lock, self._saver.alease(thread_id):
+                latency.record("thread_lock_wait", (time.perf_counter() - start) * 1000)
+                yield
+        finally:
+            self._users[thread_id] -= 1
+            if not self._users[thread_id]:
+                del self._users[thread_id]
+                del self._locks[thread_id]
+
+    @asynccontextmanager
+    async def turn(self, thread_id: str, message: str) -> AsyncIterator[asyncio.Future]:
+        """Hold the thread for one turn; set the yielded future to the answer."""
+        key = (thread_id, message)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            async with self.hold(thread_id):
+                self._stats["turns"] += 1
+                yield future
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if not future.done():
+                future.set_exception(RuntimeError("The original request for this message failed"))
+            # Coalesced requests see the failure; if there are none, asyncio
+            # would otherwise log it as never retrieved.
+            future.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["active_threads"] = len(self._locks)
+        stats["inflight"] = len(self._inflight)
+        return stats
+
+
+gate = ThreadGate(checkpointer)
+
+
+def _build_inputs(message: str) -> Dict[str, Any]:
+    """Graph input: only the new user message; the checkpointer supplies the history."""
+    from langchain_core.messages import HumanMessage
+    return {"messages": [HumanMessage(content=message)]}
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _chunk_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+
 @api.post("/chat", response_model=MessageResponse)
 async def chat(request: MessageRequest):
     """Send a message to the agent and get a response.
     
-    Maintains conversation history per thread_id.
+    Maintains conversation history per thread_id. Turns of one thread run
+    one at a time; a retry of a message still in flight gets that turn's answer.
     """
     try:
         logger.info(f"Chat request - thread_id={request.thread_id}, message={request.message[:50]}...")
         
-        # Build the state input for the graph
-        from langchain_core.messages import HumanMessage
-        from memory import load_memory
-        
         thread_id = request.thread_id
-        cfg = {"configurable": {"thread_id": thread_id}}
-        
-        # Load previous messages
-        mem = load_memory(thread_id, limit=20)
-        messages = []
-        for m in mem:
-            role = m.get("role")
-            content = m.get("content")
-            if role == "user":
-                from langchain_core.messages import HumanMessage
-                messages.append(HumanMessage(content=content))
-            elif role == "assistant":
-                from langchain_core.messages import AIMessage
-                messages.append(AIMessage(content=content))
-            else:
-                from langchain_core.messages import SystemMessage
-                messages.append(SystemMessage(content=content))
+        pending = gate.inflight(thread_id, request.message)
+        if pending is not None:
+            logger.info(f"Coalesced with the in-flight turn - thread_id={thread_id}")
+            last_msg = await asyncio.shield(pending)
+            return MessageResponse(response=last_msg, thread_id=thread_id, status="success")
         
-        # Add current message
-        messages.append(HumanMessage(content=request.message))
-        inputs = {"messages": messages}
+        cfg = {"configurable": {"thread_id": thread_id}}
+        inputs = _build_inputs(request.message)
+        start = time.perf_counter()
         
-        # Run the agent
-        async for event in agent_graph.astream(inputs, cfg, stream_mode="values"):
-            pass
+        async with gate.turn(thread_id, request.message) as answer:
+            # Run the agent
+            async for event in agent_graph.astream(inputs, cfg, stream_mode="values", durability=GRAPH_DURABILITY):
+                pass
+            
+            # Get final response
+            final_state = await agent_graph.aget_state(cfg)
+            last_msg = final_state.values["messages"][-1].content
+            answer.set_result(last_msg)
         
-        # Get final response
-        final_state = agent_graph.get_state(cfg)
-        last_msg = final_state.values["messages"][-1].content
+        latency.record("chat_total", (time.perf_counter() - start) * 1000)
         
-        # Persist to memory
-        from memory import append_memory
-        append_memory(thread_id, "user", request.message)
-        append_memory(thread_id, "assistant", last_msg)
+        from memory import export_turn
+        export_turn(thread_id, request.message, last_msg)
         
         return MessageResponse(
             response=last_msg,
@@ -88,18 +203,165 @@ async def chat(request: MessageRequest):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@api.post("/chat/stream")
+async def chat_stream(request: MessageRequest):
+    """Send a message and stream the answer as server-sent events.
+
+    Events: `node` when a graph step finishes, `token` for each chunk of the
+    final answer as Gemini produces it, then `done` with the full response
+    and timings (or `error`). Answers that need no LLM call (cached, asking
+    for an ID) arrive only in `done`, as do answers shared with an identical
+    request already in flight (`"coalesced": true`).
+    """
+    logger.info(f"Stream request - thread_id={request.thread_id}, message={request.message[:50]}...")
+    thread_id = request.thread_id
+    cfg = {"configurable": {"thread_id": thread_id}}
+
+    async def events() -> AsyncIterator[str]:
+        start = time.perf_counter()
+        ttft_ms = None
+        try:
+            pending = gate.inflight(thread_id, request.message)
+            if pending is not None:
+                logger.info(f"Coalesced with the in-flight turn - thread_id={thread_id}")
+                last_msg = await asyncio.shield(pending)
+                total_ms = (time.perf_counter() - start) * 1000
+                yield _sse("done", {
+                    "response": last_msg,
+                    "thread_id": thread_id,
+                    "status": "success",
+                    "coalesced": True,
+                    "ttft_ms": round(total_ms, 1),
+                    "total_ms": round(total_ms, 1),
+                })
+                return
+
+            inputs = _build_inputs(request.message)
+            async with gate.turn(thread_id, request.message) as answer:
+                async for mode, chunk in agent_graph.astream(
+                    inputs, cfg, stream_mode=["updates", "messages"], durability=GRAPH_DURABILITY
+                ):
+                    if mode == "updates":
+                        for node in chunk:
+                            yield _sse("node", {"node": node})
+                        continue
+                    message, metadata = chunk
+                    # Only the answer; classify also runs the LLM (structured output).
+                    if metadata.get("langgraph_node") != "respond" or message.__class__.__name__ != "AIMessageChunk":
+                        continue
+                    text = _chunk_text(message.content)
+                    if not text:
+                        continue
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - start) * 1000
+                        latency.record("stream_ttft", ttft_ms)
+                    yield _sse("token", {"text": text})
+
+                final_state = await agent_graph.aget_state(cfg)
+                last_msg = final_state.values["messages"][-1].content
+                answer.set_result(last_msg)
+            total_ms = (time.perf_counter() - start) * 1000
+            if ttft_ms is None:
+                ttft_ms = total_ms
+                latency.record("stream_ttft", ttft_ms)
+            latency.record("stream_total", total_ms)
+
+            from memory import export_turn
+            export_turn(thread_id, request.message, last_msg)
+
+            yield _sse("done", {
+                "response": last_msg,
+                "thread_id": thread_id,
+                "status": "success",
+                "ttft_ms": round(ttft_ms, 1),
+                "total_ms": round(total_ms, 1),
+            })
+        except Exception as e:
+            logger.exception(f"Error streaming message: {e}")
+            yield _sse("error", {"detail": f"Error: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @api.get("/health")
 async def health():
     """Health check endpoint."""
     return {"status": "healthy", "service": "E-commerce Agent API"}
 
 
+@api.get("/stats/latency")
+async def latency_metrics():
+    """p50/p95 of /chat total latency and /chat/stream time-to-first-token and total latency."""
+    return latency.stats()
+
+
+@api.get("/stats/checkpoints")
+async def checkpoint_metrics():
+    """Checkpoint retention (eviction runs, pruned checkpoints and threads), the
+    background writer (queue depth, writes per group commit, flush latency) and
+    thread leases (turns that waited for another worker)."""
+    stats = await asyncio.to_thread(checkpointer.retention_stats)
+    stats["writer"] = checkpointer.writer_stats()
+    stats["leases"] = checkpointer.lease_stats()
+    return stats
+
+
+@api.get("/stats/concurrency")
+async def concurrency_metrics():
+    """Per-thread serialization: turns, turns that waited, coalesced requests and lock wait p50/p95."""
+    stats = gate.stats()
+    stats["lock_wait_ms"] = latency.stats().get("thread_lock_wait")
+    return stats
+
+
+@api.get("/stats/context")
+async def context_metrics():
+    """Prompt token counts per LLM call (p50/p95/max) and rolling summary updates."""
+    from context import context_stats
+    return context_stats.stats()
+
+
+@api.get("/stats/mcp")
+async def mcp_client_stats():
+    """MCP session reuse: connects, reconnects and time saved per tool turn."""
+    from agent import tool_client
+    return tool_client.stats()
+
+
+@api.get("/stats/classifier")
+async def classifier_metrics():
+    """Share of turns classified without the LLM, and classify p50/p95 latency."""
+    from intent import classifier_stats
+    return classifier_stats.stats()
+
+
+@api.get("/stats/llm")
+async def llm_call_metrics():
+    """LLM calls per turn for single- and multi-request messages, and calls saved by answering together."""
+    from agent import turn_stats
+    return turn_stats.stats()
+
+
+@api.get("/stats/responses")
+async def response_cache_metrics():
+    """Response cache hit ratio and LLM calls saved."""
+    from response_cache import response_cache
+    return response_cache.stats()
+
+
 @api.delete("/thread/{thread_id}")
 async def clear_thread(thread_id: str):
-    """Clear conversation history for a thread."""
+    """Clear conversation history for a thread, once any turn running on it has finished."""
     try:
-        from memory import save_thread_messages
-        save_thread_messages(thread_id, [])
+        from memory import MEMORY_EXPORT, save_thread_messages
+        async with gate.hold(thread_id):
+            await checkpointer.adelete_thread(thread_id)
+            if MEMORY_EXPORT:
+                save_thread_messages(thread_id, [])
         logger.info(f"Cleared thread: {thread_id}")
         return {"status": "success", "message": f"Thread {thread_id} cleared"}
     except Exception as e:
@@ -108,10 +370,24 @@ async def clear_thread(thread_id: str):
 
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
+
+    parser = argparse.ArgumentParser(description="E-commerce Agent API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("API_WORKERS", "1")),
+        help="Worker processes; they share lg_checkpoint.db, memory.db and response_cache.db",
+    )
+    args = parser.parse_args()
     
     logger.info("Starting E-commerce Agent API")
     logger.info("Ensure MCP server is running on http://127.0.0.1:8000")
-    logger.info("Agent API listening at http://127.0.0.1:8001")
+    logger.info(f"Agent API listening at http://{args.host}:{args.port} ({args.workers} worker(s))")
     
-    uvicorn.run(api, host="127.0.0.1", port=8001)
+    if args.workers > 1:
+        # Each worker imports the app itself, so uvicorn needs the import string.
+        uvicorn.run("agent_api:api", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(api, host=args.host, port=args.port)
@@ -0,0 +1,573 @@
+"""Micro-benchmarks for the e-commerce assistant.
+
+Usage: python benchmark.py <benchmark> [options]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+
+def _best_of(fn: Callable[[], object], repeat: int) -> float:
+    """Best wall-clock time of `repeat` runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_prices(args: argparse.Namespace) -> None:
+    """Per-product mode price and description: groupby lambda / apply vs vectorized."""
+    import pandas as pd
+    from setup_db import TRAIN_DIR, derive_product_prices, describe_products
+
+    order_items_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_OrderItems.csv"))
+    products_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_Products.csv"))
+    print(f"{len(order_items_df)} order items, {order_items_df['product_id'].nunique()} products")
+
+    def lambda_prices():
+        return order_items_df.groupby('product_id')['price'].agg(
+            lambda x: x.mode().iloc[0] if not x.mode().empty else x.mean()
+        ).reset_index()
+
+    def vectorized_prices():
+        return derive_product_prices(order_items_df)
+
+    expected = lambda_prices().sort_values('product_id').reset_index(drop=True)
+    actual = vectorized_prices().sort_values('product_id').reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+    categories = products_df['product_category_name']
+    pd.testing.assert_series_equal(
+        categories.apply(lambda x: f"A high-quality product in the {x} category."),
+        describe_products(categories),
+        check_dtype=False,
+        check_names=False,
+    )
+    print("Results identical.")
+
+    for label, slow, fast in (
+        ("prices", lambda_prices, vectorized_prices),
+        ("description", lambda: categories.apply(lambda x: f"A high-quality product in the {x} category."),
+         lambda: describe_products(categories)),
+    ):
+        slow_s = _best_of(slow, args.repeat)
+        fast_s = _best_of(fast, args.repeat)
+        print(f"{label:12s} lambda {slow_s * 1000:9.1f} ms   vectorized {fast_s * 1000:8.1f} ms   {slow_s / fast_s:6.1f}x")
+
+
+def _percentiles(samples_ms: List[float]) -> str:
+    ordered = sorted(samples_ms)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50 {statistics.median(ordered):8.3f} ms   p95 {p95:8.3f} ms"
+
+
+def bench_recommend(args: argparse.Namespace) -> None:
+    """Recommendation latency and leave-last-order-out recall@k: NOT IN scan vs precomputed index."""
+    from db import DB_PATH
+    from setup_db import build_recommendation_index
+    from tools import _recommend
+
+    # The customer_history query of the time: the latest 100 order items.
+    history_query = """
+        SELECT oi.product_id
+        FROM orders o
+        JOIN order_items oi ON o.order_id = oi.order_id
+        WHERE o.customer_id = ?
+        ORDER BY o.order_purchase_timestamp DESC
+        LIMIT ?
+    """
+
+    def not_in_recommend(conn: sqlite3.Connection, customer_id: str, limit: int) -> List[str]:
+        """The original implementation: exclude history, take whatever rows come first."""
+        purchased = {row[0] for row in conn.execute(history_query, (customer_id, 100))}
+        rows = conn.execute(
+            "SELECT product_id FROM products WHERE product_id NOT IN ({}) LIMIT ?".format(
+                ",".join("?" for _ in purchased) if purchased else "''"
+            ),
+            tuple(purchased) + (limit,),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def index_recommend(conn: sqlite3.Connection, customer_id: str, limit: int) -> List[str]:
+        return [rec["product_id"] for rec in _recommend(conn, customer_id, limit)]
+
+    # Hold out each sampled customer's latest order and rebuild the index
+    # without it, so recall is measured on purchases the index never saw.
+    conn = sqlite3.connect(":memory:")
+    live = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    live.backup(conn)
+    live.close()
+
+    candidates = [row[0] for row in conn.execute(
+        "SELECT customer_id FROM orders GROUP BY customer_id HAVING COUNT(*) >= 2"
+    )]
+    random.seed(0)
+    sample = random.sample(candidates, min(args.customers, len(candidates)))
+    held_out = {}
+    for customer_id in sample:
+        order_id = conn.execute(
+            "SELECT order_id FROM orders WHERE customer_id = ? ORDER BY order_purchase_timestamp DESC LIMIT 1",
+            (customer_id,),
+        ).fetchone()[0]
+        held_out[customer_id] = {row[0] for row in conn.execute(
+            "SELECT product_id FROM order_items WHERE order_id = ?", (order_id,)
+        )}
+        conn.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
+        conn.execute("DELETE FROM orders WHERE order_id = ?", (order_id,))
+    conn.commit()
+    print(f"{len(sample)} customers with >= 2 orders; latest order held out. Rebuilding index:")
+    build_recommendation_index(conn)
+
+    for label, recommend in (("NOT IN scan", not_in_recommend), ("index", index_recommend)):
+        latencies, recalls = [], []
+        for customer_id in sample:
+            start = time.perf_counter()
+            recs = recommend(conn, customer_id, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            targets = held_out[customer_id]
+            if targets:
+                recalls.append(len(targets.intersection(recs)) / len(targets))
+        recall = sum(recalls) / len(recalls) if recalls else 0.0
+        print(f"{label:12s} {_percentiles(latencies)}   recall@{args.k} {recall:.4f}")
+
+
+def _wait_for_port(host: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Nothing listening on {host}:{port} after {timeout}s")
+
+
+def _start_mcp_server() -> Optional[subprocess.Popen]:
+    """Start mcp_server.py on :8000 unless one is already running; returns the process we started."""
+    try:
+        socket.create_connection(("127.0.0.1", 8000), timeout=0.5).close()
+        print("Using the MCP server already running on :8000")
+        return None
+    except OSError:
+        server = subprocess.Popen([sys.executable, "mcp_server.py"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _wait_for_port("127.0.0.1", 8000, timeout=30)
+        return server
+
+
+def bench_transport(args: argparse.Namespace) -> None:
+    """End-to-end tool call latency: MCP over SSE vs in-process (TOOL_TRANSPORT=local)."""
+    from db import DB_PATH
+    from tool_client import LocalToolClient, MCPToolClient, format_tool_output
+
+    # Per-call INFO logging would dominate the in-process timings.
+    for name in ("tool_client", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    product_id = conn.execute("SELECT product_id FROM products LIMIT 1").fetchone()[0]
+    order_id, customer_id = conn.execute("SELECT order_id, customer_id FROM orders LIMIT 1").fetchone()
+    conn.close()
+    calls = [
+        ("product_info", {"product_id": product_id}),
+        ("order_status", {"order_id": order_id}),
+        ("customer_history", {"customer_id": customer_id}),
+    ]
+
+    server = _start_mcp_server()
+
+    async def measure(client) -> None:
+        for name, tool_args in calls:
+            # Warm-up: connects the MCP session and the DB pool.
+            await client.call(name, tool_args)
+            latencies = []
+            for _ in range(args.calls):
+                start = time.perf_counter()
+                output, _ = await client.call(name, tool_args)
+                format_tool_output(output)
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(f"  {name:18s} {_percentiles(latencies)}")
+        await client.close()
+
+    try:
+        for label, client in (
+            ("mcp (SSE)", MCPToolClient({"transport": "sse", "url": "http://127.0.0.1:8000/sse"})),
+            ("local", LocalToolClient()),
+        ):
+            print(f"{label}:")
+            asyncio.run(measure(client))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def bench_concurrency(args: argparse.Namespace) -> None:
+    """Latency of quick MCP tool calls while other sessions run heavy batch lookups.
+
+    A server that runs tools on its event loop serves the quick calls only
+    between heavy ones (head-of-line blocking); with the async tools they
+    stay close to their idle latency.
+    """
+    from db import DB_PATH
+    from tool_client import MCPToolClient
+
+    for name in ("tool_client", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    products = [r[0] for r in conn.execute("SELECT product_id FROM products ORDER BY RANDOM() LIMIT ?", (2 * args.calls,))]
+    customers = [r[0] for r in conn.execute("SELECT customer_id FROM customers")]
+    conn.close()
+    url = {"transport": "sse", "url": "http://127.0.0.1:8000/sse"}
+    server = _start_mcp_server()
+
+    async def probe(client, ids: List[str]) -> List[float]:
+        # Distinct IDs, so every call misses the tool cache and queries.
+        latencies = []
+        for product_id in ids:
+            start = time.perf_counter()
+            await client.call("product_info", {"product_id": product_id})
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    async def heavy(client, seed: int, stop: asyncio.Event, durations: List[float]) -> None:
+        rng = random.Random(seed)
+        while not stop.is_set():
+            start = time.perf_counter()
+            await client.call("customers_history", {"customer_ids": rng.sample(customers, 1000)})
+            durations.append((time.perf_counter() - start) * 1000)
+
+    async def run() -> None:
+        clients = [MCPToolClient(url) for _ in range(args.sessions + 1)]
+        for client in clients:
+            await client.list_tools()
+        prober, loaders = clients[0], clients[1:]
+        idle = await probe(prober, products[:args.calls])
+
+        stop, durations = asyncio.Event(), []
+        tasks = [asyncio.create_task(heavy(client, i, stop, durations)) for i, client in enumerate(loaders)]
+        await asyncio.sleep(0.5)
+        loaded = await probe(prober, products[args.calls:])
+        stop.set()
+        await asyncio.gather(*tasks)
+        for client in clients:
+            await client.close()
+
+        print(f"product_info, idle                       {_percentiles(idle)}")
+        print(f"product_info, {args.sessions:2d} sessions running batches {_percentiles(loaded)}")
+        print(f"customers_history x1000 ({len(durations)} calls)   {_percentiles(durations)}")
+
+    try:
+        asyncio.run(run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+CLASSIFY_TEMPLATES = [
+    ("product", "product_inquiry", "What is the price of product {id}?"),
+    ("product", "product_inquiry", "Is {id} in stock?"),
+    ("product", "product_inquiry", "tell me about {id}"),
+    ("order", "order_status", "status of order {id}"),
+    ("order", "order_status", "Where is my order {id}? It hasn't arrived"),
+    ("order", "order_status", "{id}"),
+    ("order", "returns", "I want to return order {id}, it arrived damaged"),
+    ("order", "returns", "Can I get a refund for {id}?"),
+    ("customer", "customer_history", "Show the purchase history for customer {id}"),
+    ("customer", "customer_history", "what has {id} bought before?"),
+    (None, "general_chat", "Hello!"),
+    (None, "general_chat", "thanks, that's all"),
+    (None, None, "Can you check my order from last week?"),
+    (None, None, "What do you recommend for a birthday gift?"),
+]
+
+
+def bench_classify(args: argparse.Namespace) -> None:
+    """Rule-based intent classifier: share of turns that skip the LLM, accuracy and latency."""
+    from db import DB_PATH
+    from intent import RULE_CONFIDENCE_THRESHOLD, classify_rules
+    from tools import resolve_id
+
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    ids = {
+        "product": [r[0] for r in conn.execute("SELECT product_id FROM products ORDER BY RANDOM() LIMIT 50")],
+        "order": [r[0] for r in conn.execute("SELECT order_id FROM orders ORDER BY RANDOM() LIMIT 50")],
+        "customer": [r[0] for r in conn.execute("SELECT customer_id FROM customers ORDER BY RANDOM() LIMIT 50")],
+    }
+    conn.close()
+
+    async def resolve(entity_id: str) -> List[str]:
+        return resolve_id(entity_id).get("types", [])
+
+    async def run() -> None:
+        latencies, skipped, correct = [], 0, 0
+        random.seed(0)
+        for _ in range(args.calls):
+            id_type, expected, template = random.choice(CLASSIFY_TEMPLATES)
+            text = template.format(id=random.choice(ids[id_type])) if id_type else template
+            start = time.perf_counter()
+            rule = await classify_rules(text, resolve)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if rule and rule.confidence >= RULE_CONFIDENCE_THRESHOLD:
+                skipped += 1
+                correct += rule.intent == expected
+        print(f"{args.calls} messages, threshold {RULE_CONFIDENCE_THRESHOLD}")
+        print(f"skipped LLM  {skipped / args.calls:6.1%}   correct when skipped {correct / max(skipped, 1):6.1%}")
+        print(f"rule stage   {_percentiles(latencies)}")
+
+    asyncio.run(run())
+
+
+def _bytes_written() -> int:
+    """Bytes this process has passed to write() so far (Linux /proc/self/io)."""
+    with open("/proc/self/io") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("wchar:"))
+
+
+def bench_history(args: argparse.Namespace) -> None:
+    """Bytes written per turn: history rebuilt from memory.db vs kept in the checkpointer.
+
+    "before" is the old turn: load the last 20 messages, pass them all in,
+    then append_memory twice and save_thread_messages. "after" passes only
+    the new message and checkpoints once at the end of the run.
+    """
+    from typing import Annotated, List, TypedDict
+
+    if not os.path.exists("/proc/self/io"):
+        print("history needs /proc/self/io (Linux)")
+        return
+    workdir = tempfile.mkdtemp(prefix="bench_history_")
+    os.environ["MEMORY_DB"] = os.path.join(workdir, "memory.db")
+    from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage
+    from langgraph.graph import END, StateGraph
+    from langgraph.graph.message import add_messages
+    from context import messages_to_fold
+    from disk_checkpointer import DiskBackedSaver
+    from memory import append_memory, load_memory, save_thread_messages
+
+    answer = "Your order was shipped on 2018-03-02 and should arrive within five business days. " * 4
+
+    class BeforeState(TypedDict):
+        messages: Annotated[List[BaseMessage], "The conversation history"]
+
+    class AfterState(TypedDict):
+        messages: Annotated[List[BaseMessage], add_messages]
+
+    def build(state_type, saver, trim: bool):
+        def summarize(state):
+            # Same folding as the agent, minus the summary LLM call.
+            fold = messages_to_fold(state["messages"]) if trim else []
+            return {"messages": [RemoveMessage(id=m.id) for m in fold]} if fold else {}
+
+        builder = StateGraph(state_type)
+        builder.add_node("respond", lambda state: {"messages": [AIMessage(content=answer)]})
+        builder.add_node("summarize", summarize)
+        builder.set_entry_point("respond")
+        builder.add_edge("respond", "summarize")
+        builder.add_edge("summarize", END)
+        return builder.compile(checkpointer=saver)
+
+    async def before_turn(graph, cfg, thread_id: str, text: str) -> None:
+        messages = [
+            HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+            for m in load_memory(thread_id, limit=20)
+        ]
+        messages.append(HumanMessage(content=text))
+        await graph.ainvoke({"messages": messages}, cfg)
+        final = graph.get_state(cfg).values["messages"]
+        append_memory(thread_id, "user", text)
+        append_memory(thread_id, "assistant", final[-1].content)
+        save_thread_messages(thread_id, [
+            {"role": "assistant" if isinstance(m, AIMessage) else "user", "content": m.content} for m in final
+        ])
+
+    async def after_turn(graph, cfg, thread_id: str, text: str) -> None:
+        await graph.ainvoke({"messages": [HumanMessage(content=text)]}, cfg, durability="exit")
+        graph.get_state(cfg)
+
+    async def run(label: str, state_type, turn, trim: bool) -> None:
+        saver = DiskBackedSaver(os.path.join(workdir, f"{label}.db"), evict_interval=0)
+        graph = build(state_type, saver, trim)
+        thread_id = f"bench-{label}"
+        cfg = {"configurable": {"thread_id": thread_id}}
+        written, latencies = [], []
+        for i in range(args.calls):
+            before = _bytes_written()
+            start = time.perf_counter()
+            await turn(graph, cfg, thread_id, f"Where is my order {i:012d}?")
+            saver.flush()
+            latencies.append((time.perf_counter() - start) * 1000)
+            written.append(_bytes_written() - before)
+        saver.close()
+        last = written[-max(1, args.calls // 10):]
+        print(f"{label:7s} bytes/turn mean {statistics.mean(written):9.0f}   last 10% {statistics.mean(last):9.0f}   "
+              f"{_percentiles(latencies)}")
+
+    print(f"{args.calls} turns on one thread")
+    asyncio.run(run("before", BeforeState, before_turn, trim=False))
+    asyncio.run(run("after", AfterState, after_turn, trim=True))
+
+
+def bench_batch(args: argparse.Namespace) -> None:
+    """Per-ID cost of the batch tools vs one single-ID call per ID (query + json.dumps)."""
+    from db import DB_PATH
+    import tools
+
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    ids = {
+        "product": [r[0] for r in conn.execute("SELECT product_id FROM products ORDER BY RANDOM() LIMIT 1000")],
+        "order": [r[0] for r in conn.execute("SELECT order_id FROM orders ORDER BY RANDOM() LIMIT 1000")],
+        "customer": [r[0] for r in conn.execute("SELECT customer_id FROM customers ORDER BY RANDOM() LIMIT 1000")],
+    }
+    conn.close()
+    # (label, ID kind, single-ID tool, batch tool, single result -> per-ID value, batch result -> {ID: value})
+    cases = [
+        ("products", "product", tools.get_product_info, tools.get_products_info,
+         lambda r: r.get("product"), lambda r: r["products"]),
+        ("orders", "order", tools.check_order_status, tools.check_orders_status,
+         lambda r: r.get("order"), lambda r: r["orders"]),
+        ("histories", "customer", tools.get_customer_history, tools.get_customers_history,
+         lambda r: r["history"], lambda r: r["histories"]),
+    ]
+
+    print(f"{'tool':10s} {'ids':>5s} {'single us/id':>13s} {'batch us/id':>12s} {'speedup':>8s}")
+    for label, kind, single, batch, single_value, batch_values in cases:
+        # Both paths must give the same answer per ID for the costs to be comparable.
+        sample = ids[kind][:100]
+        by_id = batch_values(batch(sample))
+        mismatched = [i for i in sample if single_value(single(i)) != by_id.get(i)]
+        if mismatched:
+            print(f"{label:10s} batch and single results differ for {len(mismatched)} of {len(sample)} IDs")
+        for size in (1, 10, 100, 1000):
+            sample = ids[kind][:size]
+            single_s = _best_of(lambda: [json.dumps(single(i)) for i in sample], args.repeat)
+            batch_s = _best_of(lambda: json.dumps(batch(sample)), args.repeat)
+            print(f"{label:10s} {size:5d} {single_s / size * 1e6:13.1f} {batch_s / size * 1e6:12.1f} "
+                  f"{single_s / batch_s:7.1f}x")
+
+
+WORKER_THREADS = 20
+
+
+def _workers_process(db_path: str, index: int, workers: int, rounds: int, barrier, results) -> None:
+    """One API worker: runs its share of each round's turns against the shared store."""
+    from typing import Annotated, List, TypedDict
+    from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+    from langgraph.graph import END, StateGraph
+    from langgraph.graph.message import add_messages
+    from disk_checkpointer import DiskBackedSaver
+
+    class State(TypedDict):
+        messages: Annotated[List[BaseMessage], add_messages]
+
+    def respond(state):
+        # Stand-in for the agent's own CPU work per turn (prompt building, parsing).
+        payload = json.dumps([m.content for m in state["messages"]] * 20)
+        return {"messages": [AIMessage(content=f"Answer {len(state['messages'])} ({len(payload)} bytes of context)")]}
+
+    builder = StateGraph(State)
+    builder.add_node("respond", respond)
+    builder.set_entry_point("respond")
+    builder.add_edge("respond", END)
+    saver = DiskBackedSaver(db_path, evict_interval=0)
+    graph = builder.compile(checkpointer=saver)
+
+    async def run() -> float:
+        busy = 0.0
+        for r in range(rounds):
+            barrier.wait()
+            start = time.perf_counter()
+            # Each round moves every thread to the next worker, so no turn finds
+            # the previous one in its own process.
+            for t in range(WORKER_THREADS):
+                if (t + r) % workers == index:
+                    cfg = {"configurable": {"thread_id": f"thread-{t}"}}
+                    # As in agent_api: the thread lease serializes its turns across workers.
+                    async with saver.alease(f"thread-{t}"):
+                        await graph.ainvoke({"messages": [HumanMessage(content=f"turn {r}")]}, cfg, durability="exit")
+            busy += time.perf_counter() - start
+        return busy
+
+    busy = asyncio.run(run())
+    results.put((busy, saver.retention_stats()["reloads"]))
+    saver.close()
+
+
+def bench_workers(args: argparse.Namespace) -> None:
+    """Turns per second with 1..N worker processes sharing one checkpoint file."""
+    from disk_checkpointer import DiskBackedSaver
+
+    rounds = max(1, args.calls // WORKER_THREADS)
+    counts = [n for n in (1, 2, 4, 8, 16, 32) if n <= args.workers]
+    print(f"{os.cpu_count()} cores, {WORKER_THREADS} threads x {rounds} turns, threads move between workers every turn")
+    ctx = multiprocessing.get_context("spawn")
+    baseline = None
+    for workers in counts:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_workers_"), "checkpoints.db")
+        DiskBackedSaver(db_path, evict_interval=0).close()
+        barrier, results = ctx.Barrier(workers + 1), ctx.Queue()
+        procs = [
+            ctx.Process(target=_workers_process, args=(db_path, i, workers, rounds, barrier, results))
+            for i in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+        start = None
+        for _ in range(rounds):
+            barrier.wait()
+            start = start or time.perf_counter()
+        outcomes = [results.get() for _ in procs]
+        elapsed = time.perf_counter() - start
+        for proc in procs:
+            proc.join()
+
+        saver = DiskBackedSaver(db_path, evict_interval=0)
+        lengths = {
+            len(saver.get_tuple({"configurable": {"thread_id": f"thread-{t}", "checkpoint_ns": ""}})
+                .checkpoint["channel_values"]["messages"])
+            for t in range(WORKER_THREADS)
+        }
+        saver.close()
+        throughput = WORKER_THREADS * rounds / elapsed
+        baseline = baseline or throughput
+        consistent = "ok" if lengths == {2 * rounds} else f"LOST TURNS {sorted(lengths)}"
+        print(f"  {workers:2d} workers  {throughput:8.1f} turns/s  x{throughput / baseline:4.2f}   "
+              f"reloads {sum(reloads for _, reloads in outcomes):5d}   history {consistent}")
+
+
+BENCHMARKS = {
+    "batch": bench_batch,
+    "classify": bench_classify,
+    "concurrency": bench_concurrency,
+    "history": bench_history,
+    "prices": bench_prices,
+    "recommend": bench_recommend,
+    "transport": bench_transport,
+    "workers": bench_workers,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="E-commerce assistant benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    parser.add_argument("--customers", type=int, default=500, help="Customers sampled for recommend")
+    parser.add_argument("--calls", type=int, default=200, help="Calls per tool (transport), messages (classify) or turns (history)")
+    parser.add_argument("-k", type=int, default=10, help="Recommendations per customer for recall@k")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Most worker processes (workers)")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent MCP sessions running batches (concurrency)")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
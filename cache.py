@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from db import DB_PATH, GENERATION_CHECK_INTERVAL, database_generation
+
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "4096"))
+
+# Seconds a serialized tool result stays fresh. Order status moves fastest;
+# product attributes only change when setup_db reloads, which clears the cache.
+TOOL_TTLS: Dict[str, float] = {
+    "product_info": 300.0,
+    "product_dimensions": 3600.0,
+    "order_status": 30.0,
+    "payment_summary": 300.0,
+    "customer_history": 60.0,
+    "recommend": 300.0,
+    "resolve_entity": 3600.0,
+    # Batch tools follow their single-ID counterparts.
+    "products_info": 300.0,
+    "orders_status": 30.0,
+    "customers_history": 60.0,
+}
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache whose entries also expire after a TTL.
+
+    Values are stored as-is; the MCP server stores the serialized JSON so
+    hits skip both the query and `json.dumps`. The whole cache is dropped
+    when the database file is swapped (see `setup_db.py`).
+    """
+
+    def __init__(self, max_size: int = TOOL_CACHE_SIZE, path: str = DB_PATH):
+        self.max_size = max_size
+        self.path = path
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = database_generation(path)
+        self._generation_checked_at = time.monotonic()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    def _check_generation(self) -> None:
+        """Clear the cache if the database file has been swapped."""
+        now = time.monotonic()
+        if now - self._generation_checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self._generation_checked_at = now
+        generation = database_generation(self.path)
+        with self._lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._entries.clear()
+                self._stats["invalidations"] += 1
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value (marking it recently used), or None."""
+        self._check_generation()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._stats["misses"] += 1
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["max_size"] = self.max_size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+tool_cache = TTLCache()
+
+
+async def cached_call(tool: str, args: Tuple, call: Callable[[], Awaitable[Dict[str, Any]]]) -> str:
+    """Serve a tool's serialized result from `tool_cache`, awaiting `call` on a miss.
+
+    Entries use the tool's TTL. Timed-out calls are returned but not cached,
+    so the next call retries.
+    """
+    key = (tool,) + args
+    value = tool_cache.get(key)
+    if value is None:
+        result = await call()
+        value = json.dumps(result)
+        if result.get("code") != "timeout":
+            tool_cache.set(key, value, TOOL_TTLS[tool])
+    return value
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Tool result cache hit, miss and eviction counters for monitoring."""
+    return tool_cache.stats()
@@ -0,0 +1,122 @@
+import logging
+import os
+import statistics
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
+
+logger = logging.getLogger("context")
+
+# Tokens of verbatim messages a prompt may carry; older turns are folded into
+# the thread's rolling summary once the history grows past this.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Verbatim budget of the classifier prompt, which only needs the latest turns.
+CLASSIFY_TOKEN_BUDGET = int(os.getenv("CLASSIFY_TOKEN_BUDGET", "400"))
+# Messages kept in a thread's state before older ones are summarized; 0 for no limit.
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "20"))
+# Target length of the rolling summary.
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "150"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count (about four characters per token)."""
+    return count_tokens_approximately([text], extra_tokens_per_message=0)
+
+
+def _line(message: BaseMessage) -> str:
+    return f"{message.__class__.__name__.replace('Message', '')}: {message.content}"
+
+
+def recent_messages(messages: List[BaseMessage], budget: int) -> List[BaseMessage]:
+    """The newest messages that fit in `budget` tokens, starting on a user turn.
+
+    The last message is always included, even if it alone exceeds the budget.
+    """
+    tail = trim_messages(
+        messages, max_tokens=budget, strategy="last", token_counter=count_tokens_approximately, start_on="human"
+    )
+    return tail or messages[-1:]
+
+
+def render_context(summary: Optional[str], messages: List[BaseMessage], budget: int) -> str:
+    """Conversation block for a prompt: the rolling summary plus the verbatim tail."""
+    lines = [f"Summary of earlier conversation: {summary}"] if summary else []
+    lines.extend(_line(m) for m in recent_messages(messages, budget))
+    return "\n".join(lines)
+
+
+def messages_to_fold(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """Messages to move into the summary, or [] while the history is within limits.
+
+    Once the history exceeds CONTEXT_TOKEN_BUDGET or HISTORY_WINDOW, everything
+    but the newest half of each limit is folded, so the summary is rewritten
+    every few turns rather than on every turn.
+    """
+    over_tokens = count_tokens_approximately(messages) > CONTEXT_TOKEN_BUDGET
+    over_count = HISTORY_WINDOW > 0 and len(messages) > HISTORY_WINDOW
+    if not (over_tokens or over_count):
+        return []
+    keep = recent_messages(messages, CONTEXT_TOKEN_BUDGET // 2)
+    if HISTORY_WINDOW > 0:
+        keep = keep[-max(1, HISTORY_WINDOW // 2):]
+    kept = {m.id for m in keep}
+    return [m for m in messages if m.id not in kept]
+
+
+def summary_prompt(summary: Optional[str], messages: List[BaseMessage]) -> str:
+    previous = summary or "(none yet)"
+    conversation = "\n".join(_line(m) for m in messages)
+    return f"""Update the running summary of a customer support conversation.
+
+CURRENT SUMMARY:
+{previous}
+
+NEW MESSAGES:
+{conversation}
+
+Write the updated summary in at most {SUMMARY_MAX_WORDS} words. Keep every product, order and customer ID mentioned, what the customer asked about, and anything still unresolved. Return only the summary."""
+
+
+class ContextStats:
+    """Per-prompt token counts and summary updates."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Deque[int]] = {}
+        self._window = window
+        self._summaries = 0
+        self._messages_folded = 0
+
+    def record_prompt(self, kind: str, prompt: str) -> int:
+        tokens = estimate_tokens(prompt)
+        with self._lock:
+            self._tokens.setdefault(kind, deque(maxlen=self._window)).append(tokens)
+        logger.info(f"Prompt tokens ({kind}): ~{tokens}")
+        return tokens
+
+    def record_summary(self, folded: int) -> None:
+        with self._lock:
+            self._summaries += 1
+            self._messages_folded += folded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {kind: sorted(values) for kind, values in self._tokens.items()}
+            stats: Dict[str, Any] = {"summaries": self._summaries, "messages_folded": self._messages_folded}
+        stats["token_budget"] = CONTEXT_TOKEN_BUDGET
+        stats["prompt_tokens"] = {
+            kind: {
+                "count": len(ordered),
+                "p50": statistics.median(ordered),
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+            for kind, ordered in samples.items()
+        }
+        return stats
+
+
+context_stats = ContextStats()
@@ -0,0 +1,391 @@
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple, TypeVar
+
+DB_PATH = "ecommerce.db"
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+MMAP_SIZE = 256 * 1024 * 1024
+CACHED_STATEMENTS = 256
+# How often (seconds) the pool re-stats the database file to notice a swap.
+GENERATION_CHECK_INTERVAL = 1.0
+# Seconds a tool call's database work may take before its query is interrupted; 0 for no limit.
+QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "5"))
+# Threads running database work for async callers. No more than the pool, so work never queues for a connection.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(POOL_SIZE)))
+# SQLite VM instructions between deadline/cancellation checks.
+PROGRESS_INTERVAL = 1000
+
+T = TypeVar("T")
+
+
+def database_generation(path: str = DB_PATH) -> Optional[Tuple[int, int]]:
+    """Identify the current database file; changes when setup_db swaps in a new build."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection tagged with the database generation it was opened on."""
+
+    generation: Optional[Tuple[int, int]] = None
+
+
+class _Waiter:
+    __slots__ = ("event", "conn", "reopen")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.conn: Optional[PooledConnection] = None
+        self.reopen = False
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of read-only SQLite connections.
+
+    Connections are opened lazily up to `size`. Idle connections are reused
+    LIFO so the one with the warmest page cache goes out first, while
+    callers blocked on a full pool are served strictly FIFO and give up
+    after `timeout` seconds. When the database file is replaced (see
+    `setup_db.py`), connections to the old file are retired as they are
+    returned.
+    """
+
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle: Deque[PooledConnection] = deque()
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._generation = database_generation(path)
+        self._generation_checked_at = time.monotonic()
+        self._stats = {
+            "checkouts": 0,
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+            "reloads": 0,
+        }
+
+    def _open(self) -> PooledConnection:
+        # Never writes. setup_db only ever replaces the file, never changes it in
+        # place, so `immutable=1` is safe: readers take no locks and never create
+        # -wal/-shm files that a later swap could pair with the new file.
+        with self._lock:
+            generation = self._generation
+        uri = Path(self.path).resolve().as_uri() + "?mode=ro&immutable=1"
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+            factory=PooledConnection,
+        )
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA query_only=1")
+        conn.generation = generation
+        return conn
+
+    def _check_generation(self) -> None:
+        """Retire idle connections if the database file has been swapped."""
+        now = time.monotonic()
+        if now - self._generation_checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self._generation_checked_at = now
+        generation = database_generation(self.path)
+        stale = []
+        with self._lock:
+            if generation == self._generation:
+                return
+            self._generation = generation
+            self._stats["reloads"] += 1
+            stale, self._idle = list(self._idle), deque()
+            self._opened -= len(stale)
+        for conn in stale:
+            conn.close()
+
+    def _record(self, start: float, hit: bool, waited: bool) -> None:
+        wait_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["hits" if hit else "misses"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_ms_total"] += wait_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+
+    def _open_counted(self) -> PooledConnection:
+        """Open a connection for a slot already counted in `_opened`."""
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def acquire(self) -> PooledConnection:
+        """Check out a connection, opening a new one if the pool is not full."""
+        start = time.perf_counter()
+        self._check_generation()
+        waiter = None
+        with self._lock:
+            if self._idle and not self._waiters:
+                conn = self._idle.pop()
+            elif self._opened < self.size:
+                self._opened += 1
+                conn = None
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            waiter.event.wait(self.timeout)
+            with self._lock:
+                if waiter.conn is None and not waiter.reopen:
+                    self._waiters.remove(waiter)
+                    raise TimeoutError(f"No database connection available after {self.timeout}s")
+            if waiter.reopen:
+                conn = self._open_counted()
+                self._record(start, hit=False, waited=True)
+                return conn
+            self._record(start, hit=True, waited=True)
+            return waiter.conn
+
+        if conn is not None:
+            self._record(start, hit=True, waited=False)
+            return conn
+
+        conn = self._open_counted()
+        self._record(start, hit=False, waited=False)
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        """Return a connection, handing it straight to the oldest waiter if any."""
+        with self._lock:
+            stale = conn.generation != self._generation
+            if stale:
+                # The slot is handed on; the next owner opens against the new file.
+                self._opened -= 1
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                if stale:
+                    self._opened += 1
+                    waiter.reopen = True
+                else:
+                    waiter.conn = conn
+                waiter.event.set()
+            elif not stale:
+                self._idle.append(conn)
+        if stale:
+            conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self._opened -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._opened
+            stats["idle"] = len(self._idle)
+            stats["waiting"] = len(self._waiters)
+        checkouts = stats["checkouts"]
+        stats["hit_ratio"] = stats["hits"] / checkouts if checkouts else 0.0
+        stats["wait_ms_avg"] = stats["wait_ms_total"] / checkouts if checkouts else 0.0
+        return stats
+
+
+class QueryInterrupted(Exception):
+    """A query was stopped because its deadline passed or its caller was cancelled."""
+
+    def __init__(self, reason: str, timeout: float):
+        self.reason = reason
+        self.timeout = timeout
+        super().__init__(f"Query timed out after {timeout}s" if reason == "timeout" else "Query cancelled")
+
+
+class _Deadline:
+    """Deadline and cancellation flag of one async call, checked by SQLite's progress handler."""
+
+    __slots__ = ("timeout", "expires_at", "cancelled")
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout if timeout > 0 else None
+        self.cancelled = False
+
+    def reason(self) -> Optional[str]:
+        if self.cancelled:
+            return "cancelled"
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            return "timeout"
+        return None
+
+    def check(self) -> int:
+        # Non-zero aborts the running statement with OperationalError("interrupted").
+        return 1 if self.reason() else 0
+
+
+# Set by run_query for the work it runs; connection() installs it on the borrowed connection.
+_deadline: contextvars.ContextVar[Optional[_Deadline]] = contextvars.ContextVar("db_deadline", default=None)
+
+
+class QueryExecutor:
+    """Bounded thread pool that runs blocking database work for async callers.
+
+    Each call gets a deadline; a query that runs past it, or whose caller is
+    cancelled, is interrupted through `sqlite3.Connection.set_progress_handler`
+    and the worker is freed instead of finishing work nobody will read.
+    """
+
+    def __init__(self, max_workers: int = DB_EXECUTOR_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._stats = {"calls": 0, "errors": 0, "timeouts": 0, "cancelled": 0, "queued_ms_max": 0.0}
+
+    def _run(self, submitted: float, ctx: contextvars.Context, fn: Callable[..., T], args, kwargs) -> T:
+        queued_ms = (time.perf_counter() - submitted) * 1000
+        with self._lock:
+            self._active += 1
+            self._stats["queued_ms_max"] = max(self._stats["queued_ms_max"], queued_ms)
+        try:
+            return ctx.run(fn, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    async def run(self, fn: Callable[..., T], *args: Any, timeout: float = QUERY_TIMEOUT, **kwargs: Any) -> T:
+        """Run `fn(*args, **kwargs)` on the pool with a deadline of `timeout` seconds.
+
+        Raises QueryInterrupted if a query was stopped by the deadline.
+        """
+        deadline = _Deadline(timeout)
+        ctx = contextvars.copy_context()
+        ctx.run(_deadline.set, deadline)
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(self._run, time.perf_counter(), ctx, fn, args, kwargs)
+        )
+        try:
+            result = await future
+        except asyncio.CancelledError:
+            deadline.cancelled = True
+            with self._lock:
+                self._stats["cancelled"] += 1
+            raise
+        except QueryInterrupted:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        with self._lock:
+            self._stats["calls"] += 1
+        return result
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active"] = self._active
+        stats["workers"] = self.max_workers
+        stats["timeout_s"] = QUERY_TIMEOUT
+        return stats
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+_executor: Optional[QueryExecutor] = None
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool for DB_PATH, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def get_executor() -> QueryExecutor:
+    """Return the process-wide executor for async database work, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                _executor = QueryExecutor()
+    return _executor
+
+
+@contextmanager
+def connection() -> Iterator[PooledConnection]:
+    """Borrow a pooled read-only connection to the e-commerce database.
+
+    Inside `run_query`, statements on the connection are interrupted once
+    the call's deadline passes or its caller is cancelled.
+    """
+    deadline = _deadline.get()
+    with get_pool().connection() as conn:
+        if deadline is None:
+            yield conn
+            return
+        conn.set_progress_handler(deadline.check, PROGRESS_INTERVAL)
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            reason = deadline.reason()
+            if reason:
+                raise QueryInterrupted(reason, deadline.timeout) from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+
+async def run_query(fn: Callable[..., T], *args: Any, timeout: float = QUERY_TIMEOUT, **kwargs: Any) -> T:
+    """Run blocking database work `fn` on the shared executor with a deadline."""
+    return await get_executor().run(fn, *args, timeout=timeout, **kwargs)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Pool wait time and hit counts for monitoring."""
+    return get_pool().stats()
+
+
+def executor_stats() -> Dict[str, Any]:
+    """Async query executor counters: calls, timeouts, cancellations and active workers."""
+    return get_executor().stats()
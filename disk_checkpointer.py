@@ -1,98 +1,930 @@
+import argparse
+import asyncio
+import itertools
+import logging
 import os
 import pickle
 import json
-from typing import Any
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 from langgraph.checkpoint.memory import InMemorySaver
 
+logger = logging.getLogger("disk_checkpointer")
+
+# Writes between WAL checkpoints / free-page reclamation of the store.
+COMPACT_EVERY = 500
+
+# Retention policy; 0 disables a rule.
+# Checkpoints kept per thread and namespace (older ones are pruned).
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "20"))
+# Seconds without a write after which a whole thread is deleted.
+CHECKPOINT_THREAD_TTL = float(os.getenv("CHECKPOINT_THREAD_TTL", str(30 * 24 * 3600)))
+# Cap on stored checkpoint payload bytes; least recently used threads go first.
+CHECKPOINT_MAX_BYTES = int(os.getenv("CHECKPOINT_MAX_BYTES", str(512 * 1024 * 1024)))
+# Seconds between background eviction passes.
+CHECKPOINT_EVICT_INTERVAL = float(os.getenv("CHECKPOINT_EVICT_INTERVAL", "60"))
+
+# When put/aput return relative to the disk write:
+#   none      - immediately; rows are committed by the next flush (synchronous=OFF)
+#   batch     - after the group commit containing the write (synchronous=FULL)
+#   per-write - after the write's own commit (synchronous=FULL)
+CHECKPOINT_DURABILITY = os.getenv("CHECKPOINT_DURABILITY", "batch")
+# Seconds the writer waits to gather concurrent writes into one commit.
+CHECKPOINT_FLUSH_INTERVAL = float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "0.005"))
+DURABILITY_LEVELS = ("none", "batch", "per-write")
+
+# Seconds a thread lease lasts unless renewed; a crashed worker's lease lapses after this.
+# Holders renew it every third of that while the turn runs.
+CHECKPOINT_LEASE_TTL = float(os.getenv("CHECKPOINT_LEASE_TTL", "30"))
+# Longest pause (seconds) between attempts to take a busy lease; the first is 5 ms.
+LEASE_POLL_MAX = 0.1
+
+# `version` and `idx` are declared without a type so SQLite keeps the
+# Python value as-is (channel versions may be str, int or float).
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        checkpoint_type TEXT,
+        checkpoint BLOB,
+        metadata_type TEXT,
+        metadata BLOB,
+        parent_checkpoint_id TEXT,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS blobs (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        version NOT NULL,
+        type TEXT,
+        value BLOB,
+        PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS writes (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        task_id TEXT NOT NULL,
+        idx NOT NULL,
+        channel TEXT,
+        type TEXT,
+        value BLOB,
+        task_path TEXT,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS threads (
+        thread_id TEXT PRIMARY KEY,
+        last_access REAL NOT NULL,
+        version TEXT,
+        bytes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_threads_last_access ON threads(last_access);
+    CREATE TABLE IF NOT EXISTS leases (
+        thread_id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID;
+"""
+
+INSERT_CHECKPOINT = "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+INSERT_BLOB = "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_WRITE = "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+# `version` is a token unique to the write, so other processes sharing the
+# file can tell that their in-memory copy of the thread is out of date.
+# `bytes` is a running total of the thread's payload, adjusted by each write.
+TOUCH_THREAD = (
+    "INSERT INTO threads (thread_id, last_access, version, bytes) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(thread_id) DO UPDATE SET last_access = excluded.last_access, version = excluded.version, "
+    "bytes = MAX(0, bytes + excluded.bytes)"
+)
+THREAD_BYTES_QUERY = "SELECT thread_id, bytes FROM threads ORDER BY last_access"
+# Claim a thread's lease if it is free, expired or already ours; rowcount 1 on success.
+CLAIM_LEASE = (
+    "INSERT INTO leases (thread_id, owner, expires_at) VALUES (?1, ?2, ?3) "
+    "ON CONFLICT(thread_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+    "WHERE leases.expires_at <= ?4 OR leases.owner = excluded.owner"
+)
+# One-off recount for stores written before `bytes` was tracked.
+BACKFILL_THREAD_BYTES = """
+    UPDATE threads SET bytes =
+        (SELECT COALESCE(SUM(length(checkpoint) + length(metadata)), 0)
+         FROM checkpoints c WHERE c.thread_id = threads.thread_id)
+      + (SELECT COALESCE(SUM(length(value)), 0) FROM blobs b WHERE b.thread_id = threads.thread_id)
+      + (SELECT COALESCE(SUM(length(value)), 0) FROM writes w WHERE w.thread_id = threads.thread_id)
+"""
+
+
+def _size(*values) -> int:
+    return sum(len(v) for v in values if v is not None)
+
+
+def _checkpoint_row(thread_id, ns, cid, entry) -> Tuple:
+    (checkpoint_type, checkpoint_b), (metadata_type, metadata_b), parent = entry
+    return (thread_id, ns, cid, checkpoint_type, checkpoint_b, metadata_type, metadata_b, parent)
+
+
+def _write_row(outer_key, inner_key, entry) -> Tuple:
+    task_id, channel, (value_type, value_b), task_path = entry
+    return outer_key + (inner_key[0], inner_key[1], channel, value_type, value_b, task_path)
+
+
+class _WriteOp:
+    __slots__ = ("thread_id", "statements", "compact", "future")
+
+    def __init__(self, thread_id: Optional[str], statements, compact: bool = False):
+        self.thread_id = thread_id
+        self.statements = statements
+        self.compact = compact
+        self.future: Future = Future()
+
+
+class CheckpointWriter:
+    """Background thread that commits checkpoint rows in groups.
+
+    Writes from all threads are queued in order and applied on the
+    writer's own connection. In "batch" and "none" modes everything queued
+    within `flush_interval` goes into one transaction (one fsync); in
+    "per-write" mode each write is its own transaction. Each write's future
+    resolves once its rows are committed.
+    """
+
+    def __init__(self, filename: str, durability: str = CHECKPOINT_DURABILITY,
+                 flush_interval: float = CHECKPOINT_FLUSH_INTERVAL):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability {durability!r}; expected one of {DURABILITY_LEVELS}")
+        self.filename = filename
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self._queue: Deque[_WriteOp] = deque()
+        self._cond = threading.Condition()
+        self._pending: Dict[str, int] = {}
+        self._stopping = False
+        self._writes_since_compact = 0
+        self._stats = {
+            "queued": 0,
+            "committed": 0,
+            "flushes": 0,
+            "errors": 0,
+            "max_queue_depth": 0,
+            "flush_ms_last": 0.0,
+            "flush_ms_max": 0.0,
+            "flush_ms_total": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, thread_id: Optional[str], statements, compact: bool = False) -> Future:
+        op = _WriteOp(thread_id, statements, compact)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Checkpoint writer is closed")
+            self._queue.append(op)
+            if thread_id is not None:
+                self._pending[thread_id] = self._pending.get(thread_id, 0) + 1
+            self._stats["queued"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._queue))
+            self._cond.notify()
+        return op.future
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until everything queued so far is committed."""
+        self.submit(None, []).result(timeout)
+
+    def pending(self, thread_id: str) -> bool:
+        with self._cond:
+            return bool(self._pending.get(thread_id))
+
+    def wait_thread(self, thread_id: str) -> None:
+        """Block until no writes for `thread_id` are waiting to be committed."""
+        with self._cond:
+            while self._pending.get(thread_id):
+                self._cond.wait()
+
+    def _run(self) -> None:
+        conn = sqlite3.connect(self.filename, timeout=30)
+        conn.execute("PRAGMA synchronous=" + ("OFF" if self.durability == "none" else "FULL"))
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if not self._queue and self._stopping:
+                    break
+            if self.durability != "per-write" and self.flush_interval > 0 and not self._stopping:
+                time.sleep(self.flush_interval)
+            with self._cond:
+                batch = list(self._queue)
+                self._queue.clear()
+            groups = [[op] for op in batch] if self.durability == "per-write" else [batch]
+            for group in groups:
+                self._commit(conn, group)
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, group: List[_WriteOp]) -> None:
+        start = time.perf_counter()
+        error = None
+        try:
+            with conn:
+                for op in group:
+                    for sql, rows in op.statements:
+                        conn.executemany(sql, rows)
+        except Exception as e:
+            error = e
+            logger.warning(f"Checkpoint write failed: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        compact = any(op.compact for op in group)
+        self._writes_since_compact += len(group)
+        if compact or self._writes_since_compact >= COMPACT_EVERY:
+            # Fold the WAL into the database file and release free pages.
+            self._writes_since_compact = 0
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                conn.execute("PRAGMA incremental_vacuum")
+            except sqlite3.Error as e:
+                logger.warning(f"Checkpoint compaction failed: {e}")
+
+        with self._cond:
+            for op in group:
+                if op.thread_id is not None:
+                    remaining = self._pending.get(op.thread_id, 1) - 1
+                    if remaining:
+                        self._pending[op.thread_id] = remaining
+                    else:
+                        self._pending.pop(op.thread_id, None)
+            stats = self._stats
+            stats["flushes"] += 1
+            stats["committed"] += len(group)
+            stats["errors"] += len(group) if error else 0
+            stats["flush_ms_last"] = elapsed_ms
+            stats["flush_ms_max"] = max(stats["flush_ms_max"], elapsed_ms)
+            stats["flush_ms_total"] += elapsed_ms
+            self._cond.notify_all()
+        for op in group:
+            if error:
+                op.future.set_exception(error)
+            else:
+                op.future.set_result(None)
+
+    def close(self, timeout: Optional[float] = 10) -> None:
+        """Commit what is queued and stop the thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._queue)
+        stats["durability"] = self.durability
+        stats["flush_interval"] = self.flush_interval
+        stats["flush_ms_avg"] = stats["flush_ms_total"] / stats["flushes"] if stats["flushes"] else 0.0
+        stats["writes_per_flush"] = stats["committed"] / stats["flushes"] if stats["flushes"] else 0.0
+        return stats
+
 
 class DiskBackedSaver(InMemorySaver):
     """In-memory checkpointer that persists state to disk.
-    
-    Extends LangGraph's InMemorySaver to automatically save and restore
-    checkpoint state from a pickle file for durability across restarts.
+
+    Extends LangGraph's InMemorySaver and mirrors each change into a SQLite
+    file as rows keyed by thread/namespace/checkpoint, so a `put` or
+    `put_writes` writes only what it added instead of the whole state.
+    Threads are loaded from the file the first time they are accessed.
+    A background thread applies the retention policy (keep the last
+    `keep_last` checkpoints, delete threads idle for `thread_ttl` seconds,
+    cap stored bytes at `max_bytes`). A JSON snapshot for debugging is
+    produced on demand by `export_json`.
+
+    Several processes (API workers) may share one file. Each write stamps the
+    thread with a new version token; before using a loaded thread the saver
+    compares tokens and reloads the thread if another process wrote it.
+
+    Disk writes go through a CheckpointWriter: `put`/`put_writes` update
+    memory and queue their rows, and the writer commits queued rows from
+    all threads together. The async methods run their memory and file work
+    (including lazy loading) in a worker thread and await the commit, so
+    the event loop never waits on the disk or on the saver lock; with
+    durability "none" they do not wait for the commit.
+
+    Retention reads the file on its own connection and waits for the
+    writer without holding the saver lock, which it takes only to apply
+    its deletions.
+
+    Version tokens make a worker see another's finished turns, but two
+    turns of one thread running at once in different workers would each
+    build on the same checkpoint and the later one would drop the other's
+    messages. `lease`/`alease` serialize turns across processes: a turn
+    holds a row in `leases` for its thread, claimed with one conditional
+    upsert, renewed while the turn runs and released only after the turn's
+    writes are committed.
+
+    Pruning old checkpoints assumes the graph does not use DeltaChannel
+    (see the warning on BaseCheckpointSaver.prune); this agent's state uses
+    plain channels.
     """
 
-    def __init__(self, filename: str = "lg_checkpoint.pkl", *args: Any, **kwargs: Any):
+    def __init__(
+        self,
+        filename: str = "lg_checkpoint.db",
+        *args: Any,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        thread_ttl: float = CHECKPOINT_THREAD_TTL,
+        max_bytes: int = CHECKPOINT_MAX_BYTES,
+        evict_interval: float = CHECKPOINT_EVICT_INTERVAL,
+        durability: str = CHECKPOINT_DURABILITY,
+        flush_interval: float = CHECKPOINT_FLUSH_INTERVAL,
+        lease_ttl: float = CHECKPOINT_LEASE_TTL,
+        **kwargs: Any,
+    ):
         self.filename = filename
         super().__init__(*args, **kwargs)
-        
-        if os.path.exists(self.filename):
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        # Serializes retention passes and guards their read connection.
+        self._evict_lock = threading.Lock()
+        self._evict_conn: Optional[sqlite3.Connection] = None
+        # Guards the lease connection; lease rows are written directly, not via the writer.
+        self._lease_lock = threading.Lock()
+        self._lease_conn: Optional[sqlite3.Connection] = None
+        self.lease_ttl = lease_ttl
+        self._lease_stats = {"acquired": 0, "contended": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "lost": 0}
+        self._loaded = set()
+        # Version token of each loaded thread as this process last wrote or read it.
+        self._versions: Dict[str, Optional[str]] = {}
+        self._instance = uuid.uuid4().hex[:12]
+        self._counter = itertools.count(1)
+        self._reloads = 0
+        self._eviction_stats = {
+            "runs": 0,
+            "last_run_ms": 0.0,
+            "max_run_ms": 0.0,
+            "total_run_ms": 0.0,
+            "checkpoints_pruned": 0,
+            "threads_expired": 0,
+            "threads_evicted": 0,
+        }
+        self._conn = sqlite3.connect(self.filename, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(threads)")]
+        if "version" not in columns:
+            self._conn.execute("ALTER TABLE threads ADD COLUMN version TEXT")
+        recount = "bytes" not in columns
+        if recount:
+            self._conn.execute("ALTER TABLE threads ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0")
+        self._migrate_pickle()
+        with self._conn:
+            # Threads stored before access tracking start their idle clock now.
+            added = self._conn.execute(
+                "INSERT OR IGNORE INTO threads (thread_id, last_access) SELECT DISTINCT thread_id, ? FROM checkpoints",
+                (time.time(),),
+            ).rowcount
+            if recount or added:
+                self._conn.execute(BACKFILL_THREAD_BYTES)
+        # Reads use self._conn; all writes after startup go through the writer.
+        self._writer = CheckpointWriter(self.filename, durability, flush_interval)
+
+        self._stop = threading.Event()
+        self._evictor: Optional[threading.Thread] = None
+        if evict_interval > 0 and (keep_last > 0 or thread_ttl > 0 or max_bytes > 0):
+            self._evictor = threading.Thread(
+                target=self._evict_loop, args=(evict_interval,), name="checkpoint-evictor", daemon=True
+            )
+            self._evictor.start()
+
+    def _migrate_pickle(self) -> None:
+        """Import a legacy pickle snapshot (lg_checkpoint.pkl) into an empty store."""
+        legacy = os.path.splitext(self.filename)[0] + ".pkl"
+        if not os.path.exists(legacy):
+            return
+        if self._conn.execute("SELECT 1 FROM checkpoints LIMIT 1").fetchone():
+            return
+        try:
+            with open(legacy, "rb") as f:
+                state = pickle.load(f)
+        except Exception:
+            return
+        with self._conn:
+            self._conn.executemany(INSERT_CHECKPOINT, (
+                _checkpoint_row(thread_id, ns, cid, entry)
+                for thread_id, ns_map in state.get("storage", {}).items()
+                for ns, checkpoints in ns_map.items()
+                for cid, entry in checkpoints.items()
+            ))
+            self._conn.executemany(INSERT_BLOB, (
+                key + tuple(value) for key, value in state.get("blobs", {}).items()
+            ))
+            self._conn.executemany(INSERT_WRITE, (
+                _write_row(outer_key, inner_key, entry)
+                for outer_key, inner in state.get("writes", {}).items()
+                for inner_key, entry in inner.items()
+            ))
+        try:
+            os.replace(legacy, legacy + ".migrated")
+        except FileNotFoundError:
+            pass  # another worker process moved it first
+
+    def _stored_version(self, thread_id: str, conn: Optional[sqlite3.Connection] = None) -> Optional[str]:
+        conn = conn or self._conn
+        row = conn.execute("SELECT version FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        return row[0] if row else None
+
+    def _retention_conn(self) -> sqlite3.Connection:
+        """Read connection for retention passes; caller holds `_evict_lock`."""
+        if self._evict_conn is None:
+            self._evict_conn = sqlite3.connect(self.filename, check_same_thread=False, timeout=30)
+        return self._evict_conn
+
+    def _lease_execute(self, sql: str, params: Tuple) -> int:
+        with self._lease_lock:
+            if self._lease_conn is None:
+                self._lease_conn = sqlite3.connect(self.filename, check_same_thread=False, timeout=30)
+                self._lease_conn.execute("PRAGMA synchronous=NORMAL")
+            with self._lease_conn:
+                return self._lease_conn.execute(sql, params).rowcount
+
+    def _claim_lease(self, thread_id: str, owner: str) -> bool:
+        now = time.time()
+        return self._lease_execute(CLAIM_LEASE, (thread_id, owner, now + self.lease_ttl, now)) == 1
+
+    def _renew_lease(self, thread_id: str, owner: str) -> None:
+        renewed = self._lease_execute(
+            "UPDATE leases SET expires_at = ? WHERE thread_id = ? AND owner = ?",
+            (time.time() + self.lease_ttl, thread_id, owner),
+        )
+        if not renewed:
+            with self._lease_lock:
+                self._lease_stats["lost"] += 1
+            logger.warning(f"Lease on thread {thread_id} expired while its turn was running")
+
+    def _release_lease(self, thread_id: str, owner: str) -> None:
+        # The next holder must find this turn's checkpoints in the file.
+        self._writer.wait_thread(thread_id)
+        self._lease_execute("DELETE FROM leases WHERE thread_id = ? AND owner = ?", (thread_id, owner))
+
+    def _record_lease_wait(self, start: float, attempts: int) -> None:
+        wait_ms = (time.perf_counter() - start) * 1000
+        with self._lease_lock:
+            stats = self._lease_stats
+            stats["acquired"] += 1
+            stats["contended"] += int(attempts > 1)
+            stats["wait_ms_total"] += wait_ms
+            stats["wait_ms_max"] = max(stats["wait_ms_max"], wait_ms)
+
+    @contextmanager
+    def lease(self, thread_id: str) -> Iterator[None]:
+        """Hold `thread_id` exclusively across every process sharing the file.
+
+        Blocks until the lease is free. Wrap a whole turn (read, run, write)
+        in it; it is not reentrant.
+        """
+        owner = f"{self._instance}:{next(self._counter)}"
+        start, attempts, delay = time.perf_counter(), 1, 0.005
+        while not self._claim_lease(thread_id, owner):
+            time.sleep(delay)
+            attempts, delay = attempts + 1, min(delay * 2, LEASE_POLL_MAX)
+        self._record_lease_wait(start, attempts)
+        done = threading.Event()
+
+        def renew() -> None:
+            while not done.wait(self.lease_ttl / 3):
+                self._renew_lease(thread_id, owner)
+
+        renewer = threading.Thread(target=renew, name="checkpoint-lease", daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            done.set()
+            renewer.join()
+            self._release_lease(thread_id, owner)
+
+    @asynccontextmanager
+    async def alease(self, thread_id: str) -> AsyncIterator[None]:
+        """`lease` for event-loop callers: waits with asyncio.sleep and touches
+        the file only from worker threads."""
+        owner = f"{self._instance}:{next(self._counter)}"
+        start, attempts, delay = time.perf_counter(), 1, 0.005
+        while not await asyncio.to_thread(self._claim_lease, thread_id, owner):
+            await asyncio.sleep(delay)
+            attempts, delay = attempts + 1, min(delay * 2, LEASE_POLL_MAX)
+        self._record_lease_wait(start, attempts)
+
+        async def renew() -> None:
+            while True:
+                await asyncio.sleep(self.lease_ttl / 3)
+                await asyncio.to_thread(self._renew_lease, thread_id, owner)
+
+        renewer = asyncio.create_task(renew())
+        try:
+            yield
+        finally:
+            renewer.cancel()
             try:
-                with open(self.filename, "rb") as f:
-                    state = pickle.load(f)
-                self.storage = state.get("storage", self.storage)
-                self.writes = state.get("writes", self.writes)
-                self.blobs = state.get("blobs", self.blobs)
-            except Exception:
+                await renewer
+            except asyncio.CancelledError:
                 pass
+            await asyncio.shield(asyncio.to_thread(self._release_lease, thread_id, owner))
 
-    def _persist(self) -> None:
-        """Save checkpoint state to disk."""
-        try:
-            state = {"storage": self.storage, "writes": self.writes, "blobs": self.blobs}
-            with open(self.filename + ".tmp", "wb") as f:
-                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
-            os.replace(self.filename + ".tmp", self.filename)
-            
+    def lease_stats(self) -> Dict[str, Any]:
+        """Thread leases taken, how many had to wait for another holder, and wait times."""
+        with self._lease_lock:
+            stats: Dict[str, Any] = dict(self._lease_stats)
+        stats["wait_ms_avg"] = stats["wait_ms_total"] / stats["acquired"] if stats["acquired"] else 0.0
+        stats["ttl"] = self.lease_ttl
+        return stats
+
+    def _ensure_loaded(self, thread_id: str) -> None:
+        """Read a thread's rows into memory on first access, or again if another
+        process has written it since."""
+        if thread_id in self._loaded:
+            # With writes still queued here, memory is newer than the file.
+            if self._writer.pending(thread_id) or self._stored_version(thread_id) == self._versions.get(thread_id):
+                return
+            InMemorySaver.delete_thread(self, thread_id)
+            self._loaded.discard(thread_id)
+            self._reloads += 1
+        # A delete of this thread may still be queued.
+        self._writer.wait_thread(thread_id)
+        self._versions[thread_id] = self._stored_version(thread_id)
+        for ns, cid, c_type, c_b, m_type, m_b, parent in self._conn.execute(
+            "SELECT checkpoint_ns, checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata, "
+            "parent_checkpoint_id FROM checkpoints WHERE thread_id = ?",
+            (thread_id,),
+        ):
+            self.storage[thread_id][ns][cid] = ((c_type, c_b), (m_type, m_b), parent)
+        for ns, channel, version, value_type, value_b in self._conn.execute(
+            "SELECT checkpoint_ns, channel, version, type, value FROM blobs WHERE thread_id = ?", (thread_id,)
+        ):
+            self.blobs[(thread_id, ns, channel, version)] = (value_type, value_b)
+        for ns, cid, task_id, idx, channel, value_type, value_b, task_path in self._conn.execute(
+            "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path "
+            "FROM writes WHERE thread_id = ?",
+            (thread_id,),
+        ):
+            self.writes[(thread_id, ns, cid)][(task_id, idx)] = (task_id, channel, (value_type, value_b), task_path)
+        self._loaded.add(thread_id)
+
+    def _load_all(self) -> None:
+        for (thread_id,) in self._conn.execute("SELECT DISTINCT thread_id FROM checkpoints").fetchall():
+            self._ensure_loaded(thread_id)
+
+    def _append(self, thread_id: str, statements: List[Tuple[str, Iterable[Tuple]]], size: int) -> Future:
+        """Queue new rows (and the thread's access time, version and `size` more bytes) for the writer."""
+        version = f"{self._instance}:{next(self._counter)}"
+        self._versions[thread_id] = version
+        return self._writer.submit(
+            thread_id, statements + [(TOUCH_THREAD, [(thread_id, time.time(), version, size)])]
+        )
+
+    def _wait(self, future: Future) -> None:
+        if self._writer.durability != "none":
+            future.result()
+
+    def compact(self) -> None:
+        """Fold the WAL into the database file and release free pages."""
+        self._writer.submit(None, [], compact=True).result()
+
+    def flush(self) -> None:
+        """Block until every queued write is committed."""
+        self._writer.flush()
+
+    def export_json(self, path: Optional[str] = None) -> str:
+        """Save a human-readable JSON snapshot of checkpoint state; returns its path."""
+        path = path or os.path.splitext(self.filename)[0] + ".json"
+
+        def _safe(o):
             try:
-                self._persist_json()
+                json.dumps(o)
+                return o
             except Exception:
-                pass
-        except Exception:
-            pass
+                return str(o)
 
-    def _persist_json(self) -> None:
-        """Save a human-readable JSON snapshot of checkpoint state."""
-        summary = {}
-        try:
-            for thread_id, ns_map in self.storage.items():
-                summary.setdefault(thread_id, {})
-                for ns, checkpoints in ns_map.items():
-                    summary[thread_id].setdefault(ns, {})
-                    for cid, (checkpoint_b, metadata_b, parent) in checkpoints.items():
-                        try:
-                            chk = self.serde.loads_typed(checkpoint_b)
-                        except Exception:
-                            try:
-                                chk = checkpoint_b
-                            except Exception:
-                                chk = str(checkpoint_b)
-
-                        try:
-                            meta = self.serde.loads_typed(metadata_b)
-                        except Exception:
-                            meta = str(metadata_b)
-
-                        def _safe(o):
-                            try:
-                                json.dumps(o)
-                                return o
-                            except Exception:
-                                return str(o)
-
-                        summary[thread_id][ns][cid] = {
-                            "checkpoint": _safe(chk),
-                            "metadata": _safe(meta),
-                            "parent": parent
-                        }
-
-            with open(os.path.splitext(self.filename)[0] + ".json.tmp", "w", encoding="utf-8") as f:
-                json.dump(summary, f, indent=2, ensure_ascii=False)
-            os.replace(os.path.splitext(self.filename)[0] + ".json.tmp", os.path.splitext(self.filename)[0] + ".json")
-        except Exception:
-            pass
+        with self._lock:
+            self._load_all()
+        summary: Dict[str, Any] = {}
+        for thread_id, ns_map in list(self.storage.items()):
+            summary.setdefault(thread_id, {})
+            for ns, checkpoints in list(ns_map.items()):
+                summary[thread_id].setdefault(ns, {})
+                for cid, (checkpoint_b, metadata_b, parent) in list(checkpoints.items()):
+                    try:
+                        chk = self.serde.loads_typed(checkpoint_b)
+                    except Exception:
+                        chk = str(checkpoint_b)
+                    try:
+                        meta = self.serde.loads_typed(metadata_b)
+                    except Exception:
+                        meta = str(metadata_b)
+                    summary[thread_id][ns][cid] = {
+                        "checkpoint": _safe(chk),
+                        "metadata": _safe(meta),
+                        "parent": parent
+                    }
+
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._ensure_loaded(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            if config:
+                self._ensure_loaded(config["configurable"]["thread_id"])
+            else:
+                self._load_all()
+            items = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from items
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    def _put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            self._ensure_loaded(thread_id)
+            res = super().put(config, checkpoint, metadata, new_versions)
+            entry = self.storage[thread_id][ns][checkpoint["id"]]
+            blobs = [
+                (thread_id, ns, channel, version) + tuple(self.blobs[(thread_id, ns, channel, version)])
+                for channel, version in new_versions.items()
+            ]
+            size = _size(entry[0][1], entry[1][1], *(row[5] for row in blobs))
+            future = self._append(thread_id, [
+                (INSERT_CHECKPOINT, [_checkpoint_row(thread_id, ns, checkpoint["id"], entry)]),
+                (INSERT_BLOB, blobs),
+            ], size)
+        return res, future
 
     def put(self, config, checkpoint, metadata, new_versions):
-        res = super().put(config, checkpoint, metadata, new_versions)
-        self._persist()
+        res, future = self._put(config, checkpoint, metadata, new_versions)
+        self._wait(future)
         return res
 
-    def put_writes(self, config, writes, task_id: str, task_path: str = ""):
-        res = super().put_writes(config, writes, task_id, task_path)
-        self._persist()
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        res, future = await asyncio.to_thread(self._put, config, checkpoint, metadata, new_versions)
+        if self._writer.durability != "none":
+            await asyncio.wrap_future(future)
         return res
 
+    def _put_writes(self, config, writes, task_id: str, task_path: str = "") -> Optional[Future]:
+        outer_key = (
+            config["configurable"]["thread_id"],
+            config["configurable"].get("checkpoint_ns", ""),
+            config["configurable"]["checkpoint_id"],
+        )
+        with self._lock:
+            self._ensure_loaded(outer_key[0])
+            before = dict(self.writes.get(outer_key, {}))
+            super().put_writes(config, writes, task_id, task_path)
+            current = self.writes.get(outer_key, {})
+            changed = [inner_key for inner_key, entry in current.items() if before.get(inner_key) is not entry]
+            if changed:
+                # Replaced writes swap their old value's bytes for the new one's.
+                size = sum(
+                    _size(current[k][2][1]) - (_size(before[k][2][1]) if k in before else 0) for k in changed
+                )
+                added = [_write_row(outer_key, k, current[k]) for k in changed]
+                return self._append(outer_key[0], [(INSERT_WRITE, added)], size)
+        return None
+
+    def put_writes(self, config, writes, task_id: str, task_path: str = "") -> None:
+        future = self._put_writes(config, writes, task_id, task_path)
+        if future is not None:
+            self._wait(future)
+
+    async def aput_writes(self, config, writes, task_id: str, task_path: str = "") -> None:
+        future = await asyncio.to_thread(self._put_writes, config, writes, task_id, task_path)
+        if future is not None and self._writer.durability != "none":
+            await asyncio.wrap_future(future)
+
+    def _delete_thread(self, thread_id: str) -> Future:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._loaded.discard(thread_id)
+            self._versions.pop(thread_id, None)
+            return self._writer.submit(thread_id, [
+                (f"DELETE FROM {table} WHERE thread_id = ?", [(thread_id,)])
+                for table in ("checkpoints", "blobs", "writes", "threads")
+            ])
+
     def delete_thread(self, thread_id: str) -> None:
-        res = super().delete_thread(thread_id)
-        self._persist()
-        return res
+        self._wait(self._delete_thread(thread_id))
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        future = await asyncio.to_thread(self._delete_thread, thread_id)
+        if self._writer.durability != "none":
+            await asyncio.wrap_future(future)
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        """Keep only the latest checkpoint per namespace ("keep_latest"), or delete ("delete")."""
+        for thread_id in thread_ids:
+            if strategy == "delete":
+                self.delete_thread(thread_id)
+            elif strategy == "keep_latest":
+                self._writer.wait_thread(thread_id)
+                with self._evict_lock:
+                    namespaces = [row[0] for row in self._retention_conn().execute(
+                        "SELECT DISTINCT checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,)
+                    )]
+                for ns in namespaces:
+                    self._keep_last(thread_id, ns, 1)
+            else:
+                raise ValueError(f"Unknown prune strategy {strategy!r}")
+
+    def _keep_last(self, thread_id: str, ns: str, n: int) -> int:
+        """Delete all but the newest `n` checkpoints of a namespace, their writes
+        and the channel values only they referenced. Returns checkpoints deleted.
+
+        The file is read without the saver lock. If the thread is written
+        in the meantime the deletions are skipped; the next pass retries.
+        """
+        # Let queued puts land so the file shows the whole thread.
+        self._writer.wait_thread(thread_id)
+        with self._evict_lock:
+            conn = self._retention_conn()
+            version = self._stored_version(thread_id, conn)
+            rows = conn.execute(
+                "SELECT checkpoint_id, checkpoint_type, checkpoint, length(checkpoint) + length(metadata) "
+                "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC",
+                (thread_id, ns),
+            ).fetchall()
+            kept, old = rows[:n], [row[0] for row in rows[n:]]
+            if not old:
+                return 0
+            freed = sum(row[3] or 0 for row in rows[n:])
+            referenced = set()
+            for _, c_type, c_b, _ in kept:
+                referenced.update(self.serde.loads_typed((c_type, c_b))["channel_versions"].items())
+            unreferenced = []
+            for channel, channel_version, size in conn.execute(
+                "SELECT channel, version, length(value) FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, ns),
+            ):
+                if (channel, channel_version) not in referenced:
+                    unreferenced.append((channel, channel_version))
+                    freed += size or 0
+            freed += sum(
+                conn.execute(
+                    "SELECT COALESCE(SUM(length(value)), 0) FROM writes "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, ns, cid),
+                ).fetchone()[0]
+                for cid in old
+            )
+
+        with self._lock:
+            if self._writer.pending(thread_id) or self._stored_version(thread_id) != version:
+                return 0
+            self._writer.submit(thread_id, [
+                ("UPDATE threads SET bytes = MAX(0, bytes - ?) WHERE thread_id = ?", [(freed, thread_id)]),
+                ("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                 [(thread_id, ns, cid) for cid in old]),
+                ("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                 [(thread_id, ns, cid) for cid in old]),
+                ("DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                 [(thread_id, ns, channel, channel_version) for channel, channel_version in unreferenced]),
+            ])
+            if thread_id in self._loaded:
+                for cid in old:
+                    self.storage[thread_id][ns].pop(cid, None)
+                    self.writes.pop((thread_id, ns, cid), None)
+                for channel, channel_version in unreferenced:
+                    self.blobs.pop((thread_id, ns, channel, channel_version), None)
+        return len(old)
+
+    def evict(self) -> Dict[str, Any]:
+        """Apply the retention policy once; returns what was removed and how long it took."""
+        start = time.perf_counter()
+        pruned = expired = evicted = 0
+        # Decisions below read the file; make it current first.
+        self._writer.flush()
+
+        if self.thread_ttl > 0:
+            with self._evict_lock:
+                stale: List[str] = [row[0] for row in self._retention_conn().execute(
+                    "SELECT thread_id FROM threads WHERE last_access < ?", (time.time() - self.thread_ttl,)
+                )]
+            for thread_id in stale:
+                self.delete_thread(thread_id)
+            expired = len(stale)
+
+        if self.keep_last > 0:
+            with self._evict_lock:
+                over = self._retention_conn().execute(
+                    "SELECT thread_id, checkpoint_ns FROM checkpoints "
+                    "GROUP BY thread_id, checkpoint_ns HAVING COUNT(*) > ?",
+                    (self.keep_last,),
+                ).fetchall()
+            for thread_id, ns in over:
+                pruned += self._keep_last(thread_id, ns, self.keep_last)
+
+        if self.max_bytes > 0:
+            with self._evict_lock:
+                sizes = self._retention_conn().execute(THREAD_BYTES_QUERY).fetchall()
+            total = sum(size for _, size in sizes)
+            for thread_id, size in sizes:
+                if total <= self.max_bytes:
+                    break
+                self.delete_thread(thread_id)
+                total -= size
+                evicted += 1
+
+        if pruned or expired or evicted:
+            self.compact()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            stats = self._eviction_stats
+            stats["runs"] += 1
+            stats["last_run_ms"] = elapsed_ms
+            stats["max_run_ms"] = max(stats["max_run_ms"], elapsed_ms)
+            stats["total_run_ms"] += elapsed_ms
+            stats["checkpoints_pruned"] += pruned
+            stats["threads_expired"] += expired
+            stats["threads_evicted"] += evicted
+        if pruned or expired or evicted:
+            logger.info(
+                f"Checkpoint eviction: {pruned} checkpoints pruned, {expired} idle threads, "
+                f"{evicted} threads over the size cap, {elapsed_ms:.1f} ms"
+            )
+        return {"checkpoints_pruned": pruned, "threads_expired": expired, "threads_evicted": evicted,
+                "ms": elapsed_ms}
+
+    def _evict_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.evict()
+            except Exception as e:
+                logger.warning(f"Checkpoint eviction failed: {e}")
+
+    def retention_stats(self) -> Dict[str, Any]:
+        """Eviction counters and timings, plus loaded vs stored threads."""
+        with self._lock:
+            stats = dict(self._eviction_stats)
+            stats["loaded_threads"] = len(self._loaded)
+            stats["reloads"] = self._reloads
+            stats["stored_threads"] = self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+        stats["keep_last"] = self.keep_last
+        stats["thread_ttl"] = self.thread_ttl
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def writer_stats(self) -> Dict[str, Any]:
+        """Write queue depth, group commit sizes and flush latency."""
+        return self._writer.stats()
+
+    def close(self) -> None:
+        """Stop the background evictor and commit queued writes."""
+        self._stop.set()
+        if self._evictor is not None:
+            self._evictor.join(timeout=5)
+        self._writer.close()
+        with self._evict_lock:
+            if self._evict_conn is not None:
+                self._evict_conn.close()
+                self._evict_conn = None
+        with self._lease_lock:
+            if self._lease_conn is not None:
+                self._lease_conn.close()
+                self._lease_conn = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the LangGraph checkpoint store")
+    parser.add_argument("--db", default="lg_checkpoint.db", help="Checkpoint database")
+    parser.add_argument("--export", metavar="PATH", nargs="?", const="", help="Write a JSON snapshot")
+    parser.add_argument("--compact", action="store_true", help="Checkpoint the WAL and free unused pages")
+    parser.add_argument("--evict", action="store_true", help="Apply the retention policy now")
+    args = parser.parse_args()
+
+    saver = DiskBackedSaver(filename=args.db, evict_interval=0)
+    if args.evict:
+        print(saver.evict())
+    if args.compact:
+        saver.compact()
+        print(f"Compacted {args.db}")
+    if args.export is not None:
+        print(f"Wrote {saver.export_json(args.export or None)}")
+    saver.close()
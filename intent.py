@@ -0,0 +1,170 @@
+import os
+import re
+import statistics
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+# Rule results at or above this confidence skip the LLM classifier.
+RULE_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_RULE_THRESHOLD", "0.75"))
+
+# Product, order and customer IDs in our data are 12 alphanumeric characters.
+ID_PATTERN = re.compile(r"\b[A-Za-z0-9]{12}\b")
+
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    "product_inquiry": [
+        "product", "item", "price", "cost", "how much", "stock", "available", "availability",
+        "describe", "description", "details", "tell me about",
+    ],
+    "order_status": [
+        "status", "track", "tracking", "shipped", "shipping", "delivered", "delivery",
+        "where is my", "arrive", "when will", "order",
+    ],
+    "returns": [
+        "return", "refund", "send back", "send it back", "exchange", "broken", "damaged",
+        "defective", "wrong item", "money back",
+    ],
+    "customer_history": [
+        "history", "previous orders", "past orders", "purchase history", "bought",
+        "purchased", "my orders", "order history",
+    ],
+    "general_chat": [
+        "hi", "hello", "hey", "thanks", "thank you", "bye", "goodbye", "good morning",
+        "good evening", "who are you", "what can you do",
+    ],
+}
+
+# The intent an ID's table implies when the message has no stronger hint.
+TYPE_INTENTS = {"product": "product_inquiry", "order": "order_status", "customer": "customer_history"}
+# Intents each ID type can serve (e.g. an order ID goes with a status or a return).
+TYPE_COMPATIBLE = {
+    "product": {"product_inquiry"},
+    "order": {"order_status", "returns"},
+    "customer": {"customer_history"},
+}
+
+_KEYWORD_PATTERNS = {
+    intent: [re.compile(r"\b" + re.escape(word) + r"s?\b") for word in words]
+    for intent, words in INTENT_KEYWORDS.items()
+}
+
+
+@dataclass
+class RuleClassification:
+    intent: str
+    extracted_id: Optional[str]
+    confidence: float
+    id_type: Optional[str] = None
+
+
+def extract_ids(text: str) -> List[str]:
+    """12-character alphanumeric tokens that look like IDs rather than words.
+
+    A token must contain a digit, or an uppercase letter after its first
+    character; plain 12-letter words ("availability") are ignored.
+    """
+    ids = []
+    for token in ID_PATTERN.findall(text):
+        if any(c.isdigit() for c in token) or (
+            any(c.islower() for c in token) and any(c.isupper() for c in token[1:])
+        ):
+            if token not in ids:
+                ids.append(token)
+    return ids
+
+
+def keyword_scores(text: str) -> Dict[str, int]:
+    """Number of keyword hits per intent."""
+    lowered = text.lower()
+    return {
+        intent: sum(1 for pattern in patterns if pattern.search(lowered))
+        for intent, patterns in _KEYWORD_PATTERNS.items()
+    }
+
+
+async def classify_rules(
+    text: str, resolve: Callable[[str], Awaitable[List[str]]]
+) -> Optional[RuleClassification]:
+    """Classify a message with regexes and keywords; None if there is nothing to go on.
+
+    `resolve` maps an ID to the tables it exists in ("product", "order",
+    "customer"). Confidence is high only when an ID resolves to exactly one
+    table and the keywords agree with (or do not contradict) that table.
+    """
+    scores = keyword_scores(text)
+    ids = extract_ids(text)
+
+    if not ids:
+        # Without an ID only small talk is safe to answer locally; anything
+        # else may refer to an ID earlier in the conversation.
+        task_hits = sum(score for intent, score in scores.items() if intent != "general_chat")
+        if scores["general_chat"] and not task_hits and len(text.split()) <= 8:
+            return RuleClassification("general_chat", None, 0.9)
+        if task_hits:
+            best = max((i for i in scores if i != "general_chat"), key=lambda i: scores[i])
+            return RuleClassification(best, None, 0.3)
+        return None
+
+    if len(ids) > 1:
+        best = max(scores, key=lambda i: scores[i])
+        return RuleClassification(best, ids[0], 0.3)
+
+    entity_id = ids[0]
+    types = await resolve(entity_id)
+    task_scores = {i: s for i, s in scores.items() if i != "general_chat"}
+    keyword_intent = max(task_scores, key=lambda i: task_scores[i]) if any(task_scores.values()) else None
+
+    if len(types) != 1:
+        # Unknown (or ambiguous) ID: keywords alone decide, below the threshold.
+        return RuleClassification(keyword_intent or "general_chat", entity_id, 0.5)
+
+    id_type = types[0]
+    if id_type == "order" and scores["returns"]:
+        return RuleClassification("returns", entity_id, 0.95, id_type)
+    if keyword_intent is None:
+        return RuleClassification(TYPE_INTENTS[id_type], entity_id, 0.8, id_type)
+    best_compatible = max(sorted(TYPE_COMPATIBLE[id_type]), key=lambda i: task_scores[i])
+    if not task_scores[best_compatible]:
+        # The keywords point at an intent this ID cannot serve.
+        return RuleClassification(TYPE_INTENTS[id_type], entity_id, 0.5, id_type)
+    conflict = max(score for i, score in task_scores.items() if i not in TYPE_COMPATIBLE[id_type])
+    if conflict >= task_scores[best_compatible]:
+        # As many hints for an intent this ID cannot serve ("return product X"): let the LLM decide.
+        return RuleClassification(best_compatible, entity_id, 0.5, id_type)
+    return RuleClassification(best_compatible, entity_id, 0.95, id_type)
+
+
+class ClassifierStats:
+    """Share of turns answered by the rule classifier and classify latency."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._latencies_ms: Deque[float] = deque(maxlen=window)
+        self._turns = 0
+        self._rule_turns = 0
+
+    def record(self, elapsed_ms: float, skipped_llm: bool) -> None:
+        with self._lock:
+            self._turns += 1
+            self._rule_turns += int(skipped_llm)
+            self._latencies_ms.append(elapsed_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._latencies_ms)
+            turns, rule_turns = self._turns, self._rule_turns
+        stats: Dict[str, Any] = {
+            "turns": turns,
+            "rule_turns": rule_turns,
+            "llm_turns": turns - rule_turns,
+            "llm_skip_ratio": rule_turns / turns if turns else 0.0,
+            "threshold": RULE_CONFIDENCE_THRESHOLD,
+        }
+        if ordered:
+            stats["latency_ms_p50"] = statistics.median(ordered)
+            stats["latency_ms_p95"] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return stats
+
+
+classifier_stats = ClassifierStats()
@@ -1,11 +1,21 @@
+from typing import List, Optional
+
 from mcp.server.fastmcp import FastMCP
 from tools import (
-    get_product_info,
-    check_order_status,
-    process_return_request,
-    get_customer_history,
-    recommend_products,
+    aget_product_info,
+    acheck_order_status,
+    aprocess_return_request,
+    aget_customer_history,
+    arecommend_products,
+    aget_payment_summary,
+    aget_product_dimensions,
+    aresolve_id,
+    aget_products_info,
+    acheck_orders_status,
+    aget_customers_history,
 )
+from db import executor_stats, pool_stats
+from cache import cache_stats, cached_call
 import logging
 import sys
 import json
@@ -18,45 +28,115 @@ logger = logging.getLogger("mcp_server")
 
 mcp = FastMCP("E-commerce Assistant")
 
+# Tools are async: FastMCP calls sync tools directly on the event loop, so one
+# slow query would stall every other session. The SQLite work runs on db's
+# bounded executor instead, with a per-call deadline (DB_QUERY_TIMEOUT).
+
 
 @mcp.tool()
-def product_info(product_id: str) -> str:
+async def product_info(product_id: str) -> str:
     """Get product details: name, price, stock status, and description."""
     logger.info(f"product_info: {product_id}")
-    result = get_product_info(product_id)
-    return json.dumps(result)
+    return await cached_call("product_info", (product_id,), lambda: aget_product_info(product_id))
 
 
 @mcp.tool()
-def order_status(order_id: str) -> str:
+async def order_status(order_id: str) -> str:
     """Check the status of an order (pending, shipped, delivered, cancelled)."""
     logger.info(f"order_status: {order_id}")
-    result = check_order_status(order_id)
-    return json.dumps(result)
+    return await cached_call("order_status", (order_id,), lambda: acheck_order_status(order_id))
 
 
 @mcp.tool()
-def return_request(order_id: str, reason: str) -> str:
+async def return_request(order_id: str, reason: str) -> str:
     """Process a return request. Checks if order is within the 30-day return window."""
     logger.info(f"return_request: {order_id}")
-    result = process_return_request(order_id, reason)
+    result = await aprocess_return_request(order_id, reason)
     return json.dumps(result)
 
 
 @mcp.tool()
-def customer_history(customer_id: str) -> str:
-    """Get a customer's purchase history and previous orders."""
+async def customer_history(customer_id: str, limit: int = 50, cursor: Optional[str] = None, summary: bool = False) -> str:
+    """Get a customer's previous orders, newest first, `limit` orders (max 200) per page.
+
+    Pass the returned next_cursor as `cursor` for the next page (null on the last page). With
+    summary=true, returns order counts by status, total spend and top categories instead.
+    """
     logger.info(f"customer_history: {customer_id}")
-    result = get_customer_history(customer_id)
-    return json.dumps(result)
+    return await cached_call(
+        "customer_history",
+        (customer_id, limit, cursor, summary),
+        lambda: aget_customer_history(customer_id, limit=limit, cursor=cursor, summary=summary),
+    )
 
 
 @mcp.tool()
-def recommend(customer_id: str, limit: int = 5) -> str:
+async def recommend(customer_id: str, limit: int = 5) -> str:
     """Recommend products for a customer based on purchase history."""
     logger.info(f"recommend: {customer_id}")
-    result = recommend_products(customer_id, limit=limit)
-    return json.dumps(result)
+    return await cached_call("recommend", (customer_id, limit), lambda: arecommend_products(customer_id, limit=limit))
+
+
+@mcp.tool()
+async def payment_summary(order_id: str) -> str:
+    """Get how an order was paid: total value, installments and payment methods."""
+    logger.info(f"payment_summary: {order_id}")
+    return await cached_call("payment_summary", (order_id,), lambda: aget_payment_summary(order_id))
+
+
+@mcp.tool()
+async def product_dimensions(product_id: str) -> str:
+    """Get a product's shipping weight (g) and package dimensions (cm)."""
+    logger.info(f"product_dimensions: {product_id}")
+    return await cached_call("product_dimensions", (product_id,), lambda: aget_product_dimensions(product_id))
+
+
+@mcp.tool()
+async def resolve_entity(entity_id: str) -> str:
+    """Tell whether an ID is a product, order or customer ID."""
+    logger.info(f"resolve_entity: {entity_id}")
+    return await cached_call("resolve_entity", (entity_id,), lambda: aresolve_id(entity_id))
+
+
+@mcp.tool()
+async def products_info(product_ids: List[str]) -> str:
+    """Get details for up to 1000 products at once, keyed by product ID; unknown IDs are listed in not_found."""
+    logger.info(f"products_info: {len(product_ids)} ids")
+    return await cached_call("products_info", (tuple(product_ids),), lambda: aget_products_info(product_ids))
+
+
+@mcp.tool()
+async def orders_status(order_ids: List[str]) -> str:
+    """Check the status of up to 1000 orders at once, keyed by order ID; unknown IDs are listed in not_found."""
+    logger.info(f"orders_status: {len(order_ids)} ids")
+    return await cached_call("orders_status", (tuple(order_ids),), lambda: acheck_orders_status(order_ids))
+
+
+@mcp.tool()
+async def customers_history(customer_ids: List[str]) -> str:
+    """Get the latest 50 orders of up to 1000 customers at once, keyed by customer ID."""
+    logger.info(f"customers_history: {len(customer_ids)} ids")
+    return await cached_call(
+        "customers_history", (tuple(customer_ids),), lambda: aget_customers_history(customer_ids)
+    )
+
+
+@mcp.resource("stats://pool")
+def pool_metrics() -> str:
+    """Database connection pool wait time and hit counts."""
+    return json.dumps(pool_stats())
+
+
+@mcp.resource("stats://queries")
+def query_metrics() -> str:
+    """Async query executor calls, timeouts, cancellations and active workers."""
+    return json.dumps(executor_stats())
+
+
+@mcp.resource("stats://cache")
+def cache_metrics() -> str:
+    """Tool result cache hit, miss and eviction counts."""
+    return json.dumps(cache_stats())
 
 
 if __name__ == "__main__":
@@ -1,62 +1,133 @@
 import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
 
+# The agent's conversation history lives in its checkpointer. MEMORY_DB is an
+# optional export: with MEMORY_EXPORT=1 each finished turn is also recorded here.
+MEMORY_EXPORT = os.getenv("MEMORY_EXPORT", "0") == "1"
+MEMORY_DB = os.getenv("MEMORY_DB", "memory.db")
+# Legacy store; imported once into MEMORY_DB, then renamed to *.migrated.
 MEMORY_FILE = "memory.json"
 
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        thread_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        ts TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_messages_thread_ts ON messages(thread_id, ts);
+    CREATE TABLE IF NOT EXISTS migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TEXT NOT NULL
+    ) WITHOUT ROWID;
+"""
 
-def load_memory(thread_id: str, limit: int = 20):
-    """Load the last `limit` messages for a thread from disk."""
+_conn = None
+_lock = threading.Lock()
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _migrate_json(conn: sqlite3.Connection) -> None:
+    """Import memory.json into an empty store, then move the file aside.
+
+    Several API workers may start at once. The check and the import run in
+    one BEGIN IMMEDIATE transaction that also records a marker row, so only
+    the first worker imports; the others find the marker and skip.
+    """
     if not os.path.exists(MEMORY_FILE):
-        return []
+        return
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except Exception:
-        return []
-    items = data.get(thread_id, [])
-    return items[-limit:]
+        done = conn.execute("SELECT 1 FROM migrations WHERE name = 'memory.json'").fetchone()
+        if not done and not conn.execute("SELECT 1 FROM messages LIMIT 1").fetchone():
+            try:
+                with open(MEMORY_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                # Unreadable or already moved aside; leave the store as it is.
+                conn.rollback()
+                return
+            conn.executemany(
+                "INSERT INTO messages (thread_id, role, content, ts) VALUES (?, ?, ?, ?)",
+                [
+                    (thread_id, m.get("role", "user"), m.get("content", ""), m.get("ts") or _now())
+                    for thread_id, items in data.items()
+                    for m in items
+                ],
+            )
+        conn.execute("INSERT OR IGNORE INTO migrations (name, applied_at) VALUES ('memory.json', ?)", (_now(),))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    try:
+        os.replace(MEMORY_FILE, MEMORY_FILE + ".migrated")
+    except FileNotFoundError:
+        pass  # another worker process moved it first
 
 
-def append_memory(thread_id: str, role: str, content: str):
-    """Append a message to thread memory on disk."""
-    data = {}
-    if os.path.exists(MEMORY_FILE):
-        try:
-            with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            data = {}
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(MEMORY_DB, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _migrate_json(conn)
+        _conn = conn
+    return _conn
 
-    data.setdefault(thread_id, []).append({
-        "role": role,
-        "content": content,
-        "ts": datetime.utcnow().isoformat()
-    })
 
-    with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def load_memory(thread_id: str, limit: int = 20):
+    """Load the last `limit` messages for a thread from disk."""
+    with _lock:
+        rows = _connection().execute(
+            "SELECT role, content, ts FROM messages WHERE thread_id = ? ORDER BY ts DESC, id DESC LIMIT ?",
+            (thread_id, limit),
+        ).fetchall()
+    return [{"role": role, "content": content, "ts": ts} for role, content, ts in reversed(rows)]
+
+
+def append_memory(thread_id: str, role: str, content: str):
+    """Append a message to thread memory on disk."""
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO messages (thread_id, role, content, ts) VALUES (?, ?, ?, ?)",
+                (thread_id, role, content, _now()),
+            )
 
 
 def save_thread_messages(thread_id: str, messages: list):
     """Overwrite stored messages for a thread with the provided list."""
-    data = {}
-    if os.path.exists(MEMORY_FILE):
-        try:
-            with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception:
-            data = {}
-
-    normalized = []
-    for m in messages:
-        normalized.append({
-            "role": m.get("role", "user"),
-            "content": m.get("content", ""),
-            "ts": m.get("ts") or datetime.utcnow().isoformat()
-        })
-
-    data[thread_id] = normalized
-
-    with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    rows = [
+        (thread_id, m.get("role", "user"), m.get("content", ""), m.get("ts") or _now())
+        for m in messages
+    ]
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+            conn.executemany("INSERT INTO messages (thread_id, role, content, ts) VALUES (?, ?, ?, ?)", rows)
+
+
+def export_turn(thread_id: str, user_message: str, assistant_message: str) -> None:
+    """Record a finished turn in MEMORY_DB if MEMORY_EXPORT is enabled."""
+    if not MEMORY_EXPORT:
+        return
+    now = _now()
+    with _lock:
+        conn = _connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO messages (thread_id, role, content, ts) VALUES (?, ?, ?, ?)",
+                [(thread_id, "user", user_message, now), (thread_id, "assistant", assistant_message, now)],
+            )
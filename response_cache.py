@@ -0,0 +1,178 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from db import database_generation
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+# Include a hash of the recent conversation in the key, so an answer written
+# from one conversation is only reused in an identical one. With "0" answers
+# are shared across threads, and the agent writes them without the conversation.
+RESPONSE_CACHE_USE_CONTEXT = os.getenv("RESPONSE_CACHE_USE_CONTEXT", "1") == "1"
+# Hits whose LRU timestamps are buffered before they are written.
+TOUCH_BATCH = 256
+# Share of max_size freed below the cap when the cache is trimmed, so a full
+# cache is trimmed once every that many stores rather than on each one.
+TRIM_SLACK = 0.1
+
+# Seconds a generated answer stays valid, per intent. These follow the tool
+# result TTLs in cache.py; answers are also dropped when setup_db swaps in a
+# new database, since the payload they were written from may have changed.
+RESPONSE_TTLS: Dict[str, float] = {
+    "product_inquiry": 3600.0,
+    "order_status": 300.0,
+    "returns": 300.0,
+    "customer_history": 600.0,
+}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        intent TEXT NOT NULL,
+        entity_id TEXT,
+        response TEXT NOT NULL,
+        generation TEXT,
+        expires_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache(last_used);
+"""
+
+
+def _normalize(value: Optional[str]) -> str:
+    return " ".join((value or "").split()).lower()
+
+
+class ResponseCache:
+    """Persistent cache of final answers keyed on (intent, ID, tool payload, conversation).
+
+    A hit means the same question about the same data was already answered,
+    so `generate_final_response` returns it without calling the LLM. Stored
+    in a local SQLite file; the least recently used answers are evicted once
+    the cache holds more than `max_size`. Lookups only read: hit timestamps
+    are buffered and written with the next store (or every TOUCH_BATCH hits),
+    and expired rows are overwritten or purged rather than deleted on lookup.
+
+    The row count is read once and then tracked per store. Past `max_size`,
+    one DELETE keeps only the newest `max_size * (1 - TRIM_SLACK)` answers,
+    so stores never count the table. Calls block on SQLite; async callers
+    run them in a worker thread.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_size: int = RESPONSE_CACHE_SIZE,
+                 use_context: bool = RESPONSE_CACHE_USE_CONTEXT):
+        self.path = path
+        self.max_size = max_size
+        self.use_context = use_context
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}
+        # Rows in the table as of the last count or trim, plus this process's new keys since.
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._size = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def make_key(self, intent: str, entity_id: Optional[str], payload: str, context: str = "") -> str:
+        parts = [_normalize(intent), (entity_id or "").strip(), hashlib.sha256(payload.encode("utf-8")).hexdigest()]
+        if self.use_context:
+            parts.append(hashlib.sha256(_normalize(context).encode("utf-8")).hexdigest())
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def cacheable(self, intent: Optional[str]) -> bool:
+        return intent in RESPONSE_TTLS
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a fresh cached answer (refreshing its LRU position), or None."""
+        now = time.time()
+        generation = str(database_generation())
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT response, generation, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            response, stored_generation, expires_at = row
+            if expires_at <= now or stored_generation != generation:
+                self._stats["misses"] += 1
+                self._stats["expired"] += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= TOUCH_BATCH:
+                self._flush_touched(conn)
+                conn.commit()
+            self._stats["hits"] += 1
+            return response
+
+    def _flush_touched(self, conn: sqlite3.Connection) -> None:
+        """Write buffered hit timestamps; caller holds the lock and commits."""
+        if self._touched:
+            conn.executemany(
+                "UPDATE response_cache SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def put(self, key: str, intent: str, entity_id: Optional[str], response: str) -> None:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            self._flush_touched(conn)
+            exists = conn.execute("SELECT 1 FROM response_cache WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache "
+                "(key, intent, entity_id, response, generation, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, intent, entity_id, response, str(database_generation()), now + RESPONSE_TTLS[intent], now),
+            )
+            self._stats["stores"] += 1
+            self._size += 0 if exists else 1
+            if self._size > self.max_size:
+                keep = max(1, int(self.max_size * (1 - TRIM_SLACK)))
+                evicted = conn.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (keep,),
+                ).rowcount
+                self._stats["evictions"] += evicted
+                self._size = keep
+            conn.commit()
+
+    def purge_expired(self) -> int:
+        """Delete expired answers; returns how many were removed."""
+        with self._lock:
+            conn = self._connection()
+            self._flush_touched(conn)
+            removed = conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            conn.commit()
+            self._size = max(0, self._size - removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            # Tracked, not counted; approximate while other processes also store.
+            stats["size"] = self._size
+        stats["max_size"] = self.max_size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        # Every hit is a generate_final_response turn that skipped llm.ainvoke.
+        stats["llm_calls_saved"] = stats["hits"]
+        return stats
+
+
+response_cache = ResponseCache()
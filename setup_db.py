@@ -1,55 +1,694 @@
 import pandas as pd
 import sqlite3
 import os
+import time
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Dict
 
 TRAIN_DIR = r"train"
 DB_PATH = "ecommerce.db"
+# Builds happen here and are swapped over DB_PATH only once complete.
+SHADOW_PATH = DB_PATH + ".shadow"
+CHUNK_SIZE = 50_000
 
+TABLES = """
+CREATE TABLE products (
+    product_id TEXT PRIMARY KEY,
+    name TEXT,
+    price REAL,
+    stock_status TEXT,
+    description TEXT,
+    product_weight_g REAL,
+    product_length_cm REAL,
+    product_height_cm REAL,
+    product_width_cm REAL
+) WITHOUT ROWID;
 
-def setup_database():
-    """Create and populate the e-commerce database from CSV files."""
+CREATE TABLE orders (
+    order_id TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    order_status TEXT,
+    order_purchase_timestamp TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE order_items (
+    order_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    price REAL
+);
+
+CREATE TABLE customers (
+    customer_id TEXT PRIMARY KEY,
+    customer_zip_code_prefix TEXT,
+    customer_city TEXT,
+    customer_state TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE payments (
+    order_id TEXT NOT NULL,
+    payment_sequential INTEGER NOT NULL,
+    payment_type TEXT,
+    payment_installments INTEGER,
+    payment_value REAL,
+    PRIMARY KEY (order_id, payment_sequential)
+) WITHOUT ROWID;
+"""
+
+# Per-file content hash of the last CSV loaded into each table.
+LOAD_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS load_state (
+    filename TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    loaded_at TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Created after the bulk load so rows are not indexed one at a time.
+INDEXES = """
+CREATE INDEX idx_orders_customer_ts
+    ON orders(customer_id, order_purchase_timestamp, order_id, order_status);
+CREATE INDEX idx_order_items_order
+    ON order_items(order_id, product_id, price);
+"""
+
+
+# Most common order-line price per product (ties go to the lowest price),
+# matching Series.mode().iloc[0] in the pandas build.
+PRODUCT_PRICES = """
+CREATE TEMP TABLE product_prices AS
+WITH counts AS (
+    SELECT product_id, price, COUNT(*) AS n
+    FROM order_items
+    WHERE price IS NOT NULL {scope}
+    GROUP BY product_id, price
+), ranked AS (
+    SELECT product_id, price,
+           ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY n DESC, price ASC) AS rn
+    FROM counts
+)
+SELECT product_id, price FROM ranked WHERE rn = 1;
+
+CREATE UNIQUE INDEX temp.idx_product_prices ON product_prices(product_id);
+
+UPDATE products
+SET price = (SELECT pp.price FROM temp.product_prices pp WHERE pp.product_id = products.product_id)
+WHERE true {scope};
+
+DROP TABLE temp.product_prices;
+"""
+
+REC_NEIGHBOURS = 20
+REC_CATEGORY_TOP = 50
+
+# Offline recommendation index, rebuilt from scratch after every load.
+# rec_copurchase holds, per product, the top products bought by the same
+# customers; rec_category_top holds the most popular products per category
+# (and overall, under category '*'). Both are keyed for prefix lookups.
+RECOMMENDATION_INDEX = f"""
+DROP TABLE IF EXISTS rec_copurchase;
+DROP TABLE IF EXISTS rec_category_top;
+
+CREATE TABLE rec_copurchase (
+    product_id TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    rec_product_id TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (product_id, rank)
+) WITHOUT ROWID;
+
+CREATE TABLE rec_category_top (
+    category TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (category, rank)
+) WITHOUT ROWID;
+
+CREATE TEMP TABLE baskets AS
+SELECT DISTINCT o.customer_id, oi.product_id
+FROM order_items oi
+JOIN orders o ON o.order_id = oi.order_id;
+CREATE INDEX temp.idx_baskets_customer ON baskets(customer_id, product_id);
+
+INSERT INTO rec_copurchase
+WITH pairs AS (
+    SELECT a.product_id, b.product_id AS rec_product_id, COUNT(*) AS score
+    FROM temp.baskets a
+    JOIN temp.baskets b ON b.customer_id = a.customer_id AND b.product_id <> a.product_id
+    GROUP BY a.product_id, b.product_id
+), ranked AS (
+    SELECT product_id, rec_product_id, score,
+           ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY score DESC, rec_product_id) AS rank
+    FROM pairs
+)
+SELECT product_id, rank, rec_product_id, score FROM ranked WHERE rank <= {REC_NEIGHBOURS};
+
+INSERT INTO rec_category_top
+WITH popularity AS (
+    SELECT b.product_id, COALESCE(p.name, '') AS category, COUNT(*) AS score
+    FROM temp.baskets b
+    JOIN products p ON p.product_id = b.product_id
+    GROUP BY b.product_id
+), ranked AS (
+    SELECT category, product_id, score,
+           ROW_NUMBER() OVER (PARTITION BY category ORDER BY score DESC, product_id) AS rank
+    FROM popularity
+    UNION ALL
+    SELECT '*', product_id, score, ROW_NUMBER() OVER (ORDER BY score DESC, product_id)
+    FROM popularity
+)
+SELECT category, rank, product_id, score FROM ranked WHERE rank <= {REC_CATEGORY_TOP};
+
+DROP TABLE temp.baskets;
+"""
+
+# Limits PRODUCT_PRICES to products touched by an incremental load.
+AFFECTED_SCOPE = "AND product_id IN (SELECT product_id FROM temp.affected_products)"
+
+# table -> (CSV file, {CSV column: dtype}, insert verb). Columns are read in
+# the order of the target table's columns. A repeated key keeps the last row
+# for orders and payments, as the incremental UPSERTS do; order items have no
+# key, so every line is kept.
+STREAM_SOURCES = {
+    "products": (
+        "df_Products.csv",
+        {
+            "product_id": str,
+            "product_category_name": str,
+            "product_weight_g": "float64",
+            "product_length_cm": "float64",
+            "product_height_cm": "float64",
+            "product_width_cm": "float64",
+        },
+        "INSERT OR IGNORE",
+    ),
+    "orders": (
+        "df_Orders.csv",
+        {"order_id": str, "customer_id": str, "order_status": str, "order_purchase_timestamp": str},
+        "INSERT OR REPLACE",
+    ),
+    "order_items": (
+        "df_OrderItems.csv",
+        {"order_id": str, "product_id": str, "price": "float64"},
+        "INSERT",
+    ),
+    "customers": (
+        "df_Customers.csv",
+        {"customer_id": str, "customer_zip_code_prefix": str, "customer_city": str, "customer_state": str},
+        "INSERT OR IGNORE",
+    ),
+    "payments": (
+        "df_Payments.csv",
+        {
+            "order_id": str,
+            "payment_sequential": "int64",
+            "payment_type": str,
+            "payment_installments": "int64",
+            "payment_value": "float64",
+        },
+        "INSERT OR REPLACE",
+    ),
+}
+
+PRODUCT_DIMENSIONS = ["product_weight_g", "product_length_cm", "product_height_cm", "product_width_cm"]
+
+
+def describe_products(category: pd.Series) -> pd.Series:
+    """Product description for a series of category names.
+
+    Formats each distinct category once and broadcasts by factorized code,
+    instead of running an f-string per row.
+    """
+    codes, uniques = pd.factorize(category, use_na_sentinel=False)
+    texts = pd.Series([f"A high-quality product in the {x} category." for x in uniques], dtype=object)
+    return texts.take(codes).set_axis(category.index)
+
+
+def derive_product_prices(order_items_df: pd.DataFrame) -> pd.DataFrame:
+    """Most common price per product, lowest price on ties.
+
+    Vectorized equivalent of `groupby('product_id')['price'].agg(lambda x:
+    x.mode().iloc[0] ...)`: count each (product, price) pair once, sort by
+    count and price, and keep the first row per product. Products whose
+    prices are all missing get NaN, as the mean() fallback did.
+    """
+    counts = order_items_df.groupby(['product_id', 'price']).size().reset_index(name='n')
+    counts = counts.sort_values(['product_id', 'n', 'price'], ascending=[True, False, True])
+    prices = counts.drop_duplicates('product_id')[['product_id', 'price']]
+    product_ids = pd.DataFrame({'product_id': order_items_df['product_id'].dropna().unique()})
+    return product_ids.merge(prices, on='product_id', how='left')
+
+
+def _product_rows(chunk: pd.DataFrame) -> pd.DataFrame:
+    category = chunk["product_category_name"]
+    return pd.DataFrame({
+        "product_id": chunk["product_id"],
+        "name": category,
+        "price": None,
+        "stock_status": "In Stock",
+        "description": describe_products(category),
+        **{column: chunk[column] for column in PRODUCT_DIMENSIONS},
+    })
+
+
+# Incremental loads stage each changed CSV in temp.stage, then apply only new
+# or changed rows. Order items have no key of their own, so the items of an
+# order are replaced as a whole when the staged set for that order differs.
+# Products that are new or changed, and the products of changed orders, are
+# recorded in temp.affected_products for PRODUCT_PRICES.
+UPSERTS = {
+    "products": """
+        INSERT INTO affected_products
+        SELECT DISTINCT product_id FROM (
+            SELECT product_id, name, stock_status,
+                   product_weight_g, product_length_cm, product_height_cm, product_width_cm
+            FROM temp.stage
+            EXCEPT
+            SELECT product_id, name, stock_status,
+                   product_weight_g, product_length_cm, product_height_cm, product_width_cm
+            FROM products
+        );
+        INSERT INTO products
+        SELECT product_id, name, NULL, stock_status, description,
+               product_weight_g, product_length_cm, product_height_cm, product_width_cm
+        FROM temp.stage WHERE true
+        ON CONFLICT(product_id) DO UPDATE SET
+            name = excluded.name,
+            stock_status = excluded.stock_status,
+            description = excluded.description,
+            product_weight_g = excluded.product_weight_g,
+            product_length_cm = excluded.product_length_cm,
+            product_height_cm = excluded.product_height_cm,
+            product_width_cm = excluded.product_width_cm
+        WHERE products.name IS NOT excluded.name
+           OR products.stock_status IS NOT excluded.stock_status
+           OR products.product_weight_g IS NOT excluded.product_weight_g
+           OR products.product_length_cm IS NOT excluded.product_length_cm
+           OR products.product_height_cm IS NOT excluded.product_height_cm
+           OR products.product_width_cm IS NOT excluded.product_width_cm;
+    """,
+    "orders": """
+        INSERT INTO orders (order_id, customer_id, order_status, order_purchase_timestamp)
+        SELECT order_id, customer_id, order_status, order_purchase_timestamp FROM temp.stage WHERE true
+        ON CONFLICT(order_id) DO UPDATE SET
+            customer_id = excluded.customer_id,
+            order_status = excluded.order_status,
+            order_purchase_timestamp = excluded.order_purchase_timestamp
+        WHERE orders.customer_id IS NOT excluded.customer_id
+           OR orders.order_status IS NOT excluded.order_status
+           OR orders.order_purchase_timestamp IS NOT excluded.order_purchase_timestamp;
+    """,
+    "order_items": """
+        CREATE INDEX temp.idx_stage_order ON stage(order_id);
+        CREATE TEMP TABLE changed_orders AS
+        WITH staged AS (
+            SELECT order_id, product_id, price FROM temp.stage
+        ), existing AS (
+            SELECT order_id, product_id, price FROM order_items
+            WHERE order_id IN (SELECT order_id FROM staged)
+        )
+        SELECT order_id FROM (SELECT * FROM staged EXCEPT SELECT * FROM existing)
+        UNION SELECT order_id FROM (SELECT * FROM existing EXCEPT SELECT * FROM staged)
+        UNION SELECT order_id FROM (
+            SELECT order_id, COUNT(*) FROM staged GROUP BY order_id
+            EXCEPT SELECT order_id, COUNT(*) FROM existing GROUP BY order_id
+        );
+        INSERT INTO affected_products
+            SELECT product_id FROM order_items WHERE order_id IN (SELECT order_id FROM temp.changed_orders)
+            UNION SELECT product_id FROM temp.stage WHERE order_id IN (SELECT order_id FROM temp.changed_orders);
+        DELETE FROM order_items WHERE order_id IN (SELECT order_id FROM temp.changed_orders);
+        INSERT INTO order_items (order_id, product_id, price)
+            SELECT order_id, product_id, price FROM temp.stage
+            WHERE order_id IN (SELECT order_id FROM temp.changed_orders);
+        DROP TABLE temp.changed_orders;
+    """,
+    "customers": """
+        INSERT INTO customers (customer_id, customer_zip_code_prefix, customer_city, customer_state)
+        SELECT customer_id, customer_zip_code_prefix, customer_city, customer_state FROM temp.stage WHERE true
+        ON CONFLICT(customer_id) DO UPDATE SET
+            customer_zip_code_prefix = excluded.customer_zip_code_prefix,
+            customer_city = excluded.customer_city,
+            customer_state = excluded.customer_state
+        WHERE customers.customer_zip_code_prefix IS NOT excluded.customer_zip_code_prefix
+           OR customers.customer_city IS NOT excluded.customer_city
+           OR customers.customer_state IS NOT excluded.customer_state;
+    """,
+    "payments": """
+        INSERT INTO payments (order_id, payment_sequential, payment_type, payment_installments, payment_value)
+        SELECT order_id, payment_sequential, payment_type, payment_installments, payment_value
+        FROM temp.stage WHERE true
+        ON CONFLICT(order_id, payment_sequential) DO UPDATE SET
+            payment_type = excluded.payment_type,
+            payment_installments = excluded.payment_installments,
+            payment_value = excluded.payment_value
+        WHERE payments.payment_type IS NOT excluded.payment_type
+           OR payments.payment_installments IS NOT excluded.payment_installments
+           OR payments.payment_value IS NOT excluded.payment_value;
+    """,
+}
+
+
+def _stream_table(conn: sqlite3.Connection, table: str, source_dir: str = TRAIN_DIR, into: str = None) -> None:
+    """Bulk-insert one CSV in chunks inside a single transaction.
+
+    Rows go to `table` unless `into` names a staging table with the same
+    columns and key, where repeated keys resolve the same way.
+    """
+    filename, dtypes, verb = STREAM_SOURCES[table]
+    transform = _product_rows if table == "products" else None
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    sql = f"{verb} INTO {into or table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    start = time.perf_counter()
+    rows = 0
+    conn.execute("BEGIN")
+    reader = pd.read_csv(
+        os.path.join(source_dir, filename), usecols=list(dtypes), dtype=dtypes, chunksize=CHUNK_SIZE
+    )
+    for chunk in reader:
+        if transform is not None:
+            chunk = transform(chunk)
+        conn.executemany(sql, chunk[columns].itertuples(index=False, name=None))
+        rows += len(chunk)
+    conn.execute("COMMIT")
+    elapsed = time.perf_counter() - start
+    print(f"  {table}: {rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s)")
+
+
+def _file_hashes(source_dir: str = TRAIN_DIR) -> Dict[str, str]:
+    """SHA-256 of every source CSV present, used as the per-file load watermark."""
+    hashes = {}
+    for filename, _, _ in STREAM_SOURCES.values():
+        if not os.path.exists(os.path.join(source_dir, filename)):
+            continue
+        digest = hashlib.sha256()
+        with open(os.path.join(source_dir, filename), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        hashes[filename] = digest.hexdigest()
+    return hashes
+
+
+def _loaded_hashes() -> Dict[str, str]:
+    """Watermarks recorded in the live database, empty if there is none."""
+    if not os.path.exists(DB_PATH):
+        return {}
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT filename, sha256 FROM load_state"))
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+
+def _schema_is_current() -> bool:
+    """Whether the live database has every table and column in TABLES."""
+    def columns(conn: sqlite3.Connection) -> Dict[str, list]:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {t: [row[1] for row in conn.execute(f"PRAGMA table_info({t})")] for t in tables}
+
+    expected = sqlite3.connect(":memory:")
+    expected.executescript(TABLES)
+    live = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    try:
+        current = columns(live)
+        return all(current.get(t) == cols for t, cols in columns(expected).items())
+    finally:
+        expected.close()
+        live.close()
+
+
+def _record_load_state(conn: sqlite3.Connection, hashes: Dict[str, str]) -> None:
+    loaded_at = datetime.now().isoformat(timespec="seconds")
+    conn.executemany(
+        "INSERT OR REPLACE INTO load_state (filename, sha256, loaded_at) VALUES (?, ?, ?)",
+        [(filename, sha, loaded_at) for filename, sha in hashes.items()],
+    )
+    conn.commit()
+
+
+def _remove_sidecars(path: str) -> None:
+    """Delete the rollback journal and WAL files of database `path`, if any."""
+    for suffix in ("-journal", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _open_shadow() -> sqlite3.Connection:
+    """Start a fresh shadow build, discarding any leftover from a failed run."""
+    if os.path.exists(SHADOW_PATH):
+        os.remove(SHADOW_PATH)
+    _remove_sidecars(SHADOW_PATH)
+    return sqlite3.connect(SHADOW_PATH)
+
+
+def _checkpoint(path: str) -> None:
+    """Fold database `path`'s WAL into the main file and truncate the WAL."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def _swap_in() -> None:
+    """Atomically replace DB_PATH with the finished shadow build.
+
+    A database file must never be paired with another file's -wal/-shm. The
+    shadow is fully checkpointed and its sidecars removed before the rename.
+    The live file's sidecars are not deleted: pooled readers open it with
+    `immutable=1` and never create them, and checkpointing the live file on
+    its last connection folds and removes any left by another writer.
+    Readers holding the old file keep a consistent view through their open
+    handles until the pool in db.py notices the new file and reconnects.
+    """
+    conn = sqlite3.connect(SHADOW_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    _remove_sidecars(SHADOW_PATH)
     if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
+        _checkpoint(DB_PATH)
+    os.replace(SHADOW_PATH, DB_PATH)
+
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def build_recommendation_index(conn: sqlite3.Connection) -> None:
+    """(Re)build the co-purchase and category-popularity recommendation tables."""
+    start = time.perf_counter()
+    conn.executescript(RECOMMENDATION_INDEX)
+    conn.commit()
+    pairs = conn.execute("SELECT COUNT(*) FROM rec_copurchase").fetchone()[0]
+    print(f"  {pairs} co-purchase neighbours in {time.perf_counter() - start:.2f}s")
+
+
+def _finalize(conn: sqlite3.Connection, build_indexes: bool = True) -> None:
+    if build_indexes:
+        print("Building indexes...")
+        conn.executescript(INDEXES)
+    print("Building recommendation index...")
+    build_recommendation_index(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+    print("Checking query plans...")
+    if not check_query_plans(conn):
+        print("WARNING: some tool queries do not seek on an index")
+
+
+def check_query_plans(conn: sqlite3.Connection) -> bool:
+    """Confirm with EXPLAIN QUERY PLAN that every tool query is index-driven.
+
+    A plan step of the form `SCAN <table>` without `USING ... INDEX` is a
+    full table scan and fails the check. Scans of subqueries and CTEs the
+    plan materializes are fine: their rows come from index searches. A
+    query listed with a search term (such as a keyset range) also fails
+    unless some plan step contains it, since an index search on a prefix
+    alone would still walk every row before the page.
+    """
+    from tools import TOOL_QUERIES
+
+    ok = True
+    for name, (sql, params, *required) in TOOL_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        derived = {step.split()[1] for step in plan if step.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+        scans = [
+            step for step in plan
+            if step.startswith("SCAN ") and "INDEX" not in step
+            and not step.split()[1].startswith("(") and step.split()[1] not in derived
+        ]
+        missing = [term for term in required if not any(term in step for step in plan)]
+        ok = ok and not scans and not missing
+        verdict = "FULL SCAN" if scans else "NO RANGE" if missing else "ok"
+        print(f"  [{verdict}] {name}: {'; '.join(plan)}")
+    return ok
+
+
+def setup_database():
+    """Create and populate the e-commerce database from CSV files."""
+    hashes = _file_hashes()
+    conn = _open_shadow()
+    conn.executescript(TABLES + LOAD_STATE_TABLE)
 
     print("Loading datasets...")
     products_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_Products.csv"))
     orders_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_Orders.csv"))
     order_items_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_OrderItems.csv"))
-    customers_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_Customers.csv"))
+    customers_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_Customers.csv"), dtype={"customer_zip_code_prefix": str})
+    payments_df = pd.read_csv(os.path.join(TRAIN_DIR, "df_Payments.csv"))
 
     print("Processing products...")
-    product_prices = order_items_df.groupby('product_id')['price'].agg(
-        lambda x: x.mode().iloc[0] if not x.mode().empty else x.mean()
-    ).reset_index()
-    unique_products = products_df[['product_id', 'product_category_name']]
+    product_prices = derive_product_prices(order_items_df)
+    # The export repeats a product row for every order line it appears in.
+    unique_products = products_df[['product_id', 'product_category_name'] + PRODUCT_DIMENSIONS].drop_duplicates('product_id')
     unique_products = unique_products.merge(product_prices, on='product_id', how='left')
-    
+
     unique_products['stock_status'] = 'In Stock'
-    unique_products['description'] = unique_products['product_category_name'].apply(
-        lambda x: f"A high-quality product in the {x} category."
-    )
+    unique_products['description'] = describe_products(unique_products['product_category_name'])
     unique_products.rename(columns={'product_category_name': 'name'}, inplace=True)
-    
-    unique_products.to_sql('products', conn, index=False)
+    unique_products = unique_products[['product_id', 'name', 'price', 'stock_status', 'description'] + PRODUCT_DIMENSIONS]
+
+    unique_products.to_sql('products', conn, if_exists='append', index=False)
 
     print("Processing orders...")
-    orders_needed = orders_df[['order_id', 'customer_id', 'order_status', 'order_purchase_timestamp']]
-    orders_needed.to_sql('orders', conn, index=False)
+    orders_needed = orders_df[
+        ['order_id', 'customer_id', 'order_status', 'order_purchase_timestamp']
+    ].drop_duplicates('order_id', keep='last')
+    orders_needed.to_sql('orders', conn, if_exists='append', index=False)
 
     print("Processing order items...")
     order_items_needed = order_items_df[['order_id', 'product_id', 'price']]
-    order_items_needed.to_sql('order_items', conn, index=False)
+    order_items_needed.to_sql('order_items', conn, if_exists='append', index=False)
 
     print("Processing customers...")
-    customers_needed = customers_df[['customer_id']]
-    customers_needed.to_sql('customers', conn, index=False)
+    customers_needed = customers_df[
+        ['customer_id', 'customer_zip_code_prefix', 'customer_city', 'customer_state']
+    ].drop_duplicates('customer_id')
+    customers_needed.to_sql('customers', conn, if_exists='append', index=False)
+
+    print("Processing payments...")
+    payments_needed = payments_df[
+        ['order_id', 'payment_sequential', 'payment_type', 'payment_installments', 'payment_value']
+    ].drop_duplicates(['order_id', 'payment_sequential'], keep='last')
+    payments_needed.to_sql('payments', conn, if_exists='append', index=False)
+
+    _finalize(conn)
+    _record_load_state(conn, hashes)
+    conn.close()
+    _swap_in()
+    print(f"Database setup complete: {DB_PATH}")
+
+
+def setup_database_streaming(source_dir: str = TRAIN_DIR):
+    """Build the database by streaming CSVs in chunks, keeping memory bounded.
+
+    Each table is loaded with executemany inside one transaction while
+    journaling and fsync are off; product prices are derived in SQL once
+    order items are loaded, so no CSV is ever held in memory whole.
+    """
+    hashes = _file_hashes(source_dir)
+    conn = _open_shadow()
+    conn.isolation_level = None
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(TABLES + LOAD_STATE_TABLE)
+
+    print(f"Streaming datasets in chunks of {CHUNK_SIZE} rows...")
+    for table in STREAM_SOURCES:
+        _stream_table(conn, table, source_dir)
+
+    print("Deriving product prices...")
+    conn.executescript(PRODUCT_PRICES.format(scope=""))
 
+    _finalize(conn)
+    _record_load_state(conn, hashes)
     conn.close()
+    _swap_in()
     print(f"Database setup complete: {DB_PATH}")
 
 
+def setup_database_incremental(source_dir: str = TRAIN_DIR):
+    """Apply only new or changed rows from `source_dir` to a copy of the live database.
+
+    Each CSV's SHA-256 is compared with the watermark stored in `load_state`;
+    unchanged files are skipped. Changed files are staged and upserted on
+    their keys (`product_id`, `order_id`, `customer_id`, and
+    `(order_id, payment_sequential)` for payments) into a shadow copy, which is
+    swapped in atomically so readers never see a half-applied load.
+    """
+    if not os.path.exists(DB_PATH) or not _schema_is_current():
+        reason = "No existing database" if not os.path.exists(DB_PATH) else "Existing database predates the current schema"
+        missing = [f for f, _, _ in STREAM_SOURCES.values() if not os.path.exists(os.path.join(source_dir, f))]
+        if missing:
+            raise SystemExit(f"{reason} and {source_dir} is a partial export; run a full build first.")
+        print(f"{reason}, running a full streaming build...")
+        setup_database_streaming(source_dir)
+        return
+
+    hashes = _file_hashes(source_dir)
+    loaded = _loaded_hashes()
+    changed = [
+        table for table, (filename, _, _) in STREAM_SOURCES.items()
+        if filename in hashes and loaded.get(filename) != hashes[filename]
+    ]
+    if not changed:
+        print("All source files unchanged, nothing to load.")
+        return
+
+    conn = _open_shadow()
+    live = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    live.backup(conn)
+    live.close()
+
+    conn.isolation_level = None
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(LOAD_STATE_TABLE)
+    conn.execute("CREATE TEMP TABLE affected_products (product_id TEXT)")
+
+    print(f"Applying changes from {', '.join(STREAM_SOURCES[t][0] for t in changed)}...")
+    for table in changed:
+        # Same key as the live table, so a repeated key in the CSV stages one row, as in a full build.
+        create = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        conn.execute(create.fetchone()[0].replace(f"CREATE TABLE {table}", "CREATE TEMP TABLE stage", 1))
+        _stream_table(conn, table, source_dir, into="temp.stage")
+        marked = conn.execute("SELECT COUNT(*) FROM temp.affected_products").fetchone()[0]
+        before = conn.total_changes
+        conn.executescript(f"BEGIN; {UPSERTS[table]} COMMIT;")
+        conn.execute("DROP TABLE temp.stage")
+        # total_changes also counts the rows added to temp.affected_products.
+        marked = conn.execute("SELECT COUNT(*) FROM temp.affected_products").fetchone()[0] - marked
+        print(f"  {table}: {conn.total_changes - before - marked} row changes applied")
+
+    print("Re-deriving prices for affected products...")
+    conn.execute("CREATE INDEX temp.idx_affected_products ON affected_products(product_id)")
+    conn.executescript(PRODUCT_PRICES.format(scope=AFFECTED_SCOPE))
+
+    _finalize(conn, build_indexes=False)
+    _record_load_state(conn, {STREAM_SOURCES[t][0]: hashes[STREAM_SOURCES[t][0]] for t in changed})
+    conn.close()
+    _swap_in()
+    print(f"Incremental load complete: {DB_PATH}")
+
+
 if __name__ == "__main__":
-    setup_database()
+    parser = argparse.ArgumentParser(description="Build the e-commerce SQLite database")
+    parser.add_argument("--stream", action="store_true", help="Stream CSVs in chunks (bounded memory)")
+    parser.add_argument("--incremental", action="store_true", help="Upsert only changed files/rows into the live DB")
+    parser.add_argument("--source", default=TRAIN_DIR, help="Directory holding the CSV export")
+    parser.add_argument("--check", action="store_true", help="Only verify tool query plans")
+    args = parser.parse_args()
+
+    if args.check:
+        conn = sqlite3.connect(DB_PATH)
+        ok = check_query_plans(conn)
+        conn.close()
+        raise SystemExit(0 if ok else 1)
+    if args.incremental:
+        setup_database_incremental(args.source)
+    elif args.stream:
+        setup_database_streaming(args.source)
+    else:
+        setup_database()
@@ -34,6 +34,7 @@ st.markdown("""
 # Configuration
 API_URL = "http://127.0.0.1:8001"
 CHAT_ENDPOINT = f"{API_URL}/chat"
+STREAM_ENDPOINT = f"{API_URL}/chat/stream"
 HEALTH_ENDPOINT = f"{API_URL}/health"
 
 # Sidebar
@@ -46,6 +47,12 @@ with st.sidebar:
         help="Unique identifier for maintaining conversation history"
     )
     
+    stream_responses = st.toggle(
+        "Stream responses",
+        value=True,
+        help="Show the answer as it is generated (uses /chat/stream)"
+    )
+    
     st.divider()
     
     # Server status
@@ -91,6 +98,60 @@ with st.sidebar:
     """)
 
 
+NODE_LABELS = {
+    "initial": "Reading your message...",
+    "classify": "Understanding the request...",
+    "tool_exec": "Looking up store data...",
+    "ask_info": "Checking details...",
+    "respond": "Writing the answer...",
+}
+
+
+def iter_sse(response):
+    """Yield (event, data) pairs from a server-sent events response."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+
+def stream_reply(prompt: str) -> str:
+    """Render the assistant's answer token by token; returns the full text."""
+    with st.chat_message("assistant"):
+        status = st.empty()
+        placeholder = st.empty()
+        text = ""
+        with requests.post(
+            STREAM_ENDPOINT,
+            json={"message": prompt, "thread_id": thread_id},
+            stream=True,
+            timeout=30
+        ) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"API Error {response.status_code}: {response.text}")
+            for event, data in iter_sse(response):
+                if event == "node":
+                    status.caption(NODE_LABELS.get(data.get("node"), ""))
+                elif event == "token":
+                    text += data.get("text", "")
+                    placeholder.markdown(text + "▌")
+                elif event == "done":
+                    text = data.get("response") or text
+                    status.caption(f"First token {data.get('ttft_ms', 0):.0f} ms · total {data.get('total_ms', 0):.0f} ms")
+                elif event == "error":
+                    raise RuntimeError(data.get("detail", "Unknown error"))
+        placeholder.markdown(text)
+    return text
+
+
 # Main content
 st.title("🛒 E-commerce Customer Support")
 st.markdown("Powered by LangGraph + MCP Server")
@@ -116,59 +177,61 @@ if prompt := st.chat_input("Ask about products, orders, returns, or recommendati
         st.markdown(prompt)
     
     # Send to API and get response
-    with st.spinner("🔄 Getting response..."):
-        try:
-            response = requests.post(
-                CHAT_ENDPOINT,
-                json={
-                    "message": prompt,
-                    "thread_id": thread_id
-                },
-                timeout=30
-            )
+    try:
+        if stream_responses:
+            assistant_message = stream_reply(prompt)
+        else:
+            with st.spinner("🔄 Getting response..."):
+                response = requests.post(
+                    CHAT_ENDPOINT,
+                    json={
+                        "message": prompt,
+                        "thread_id": thread_id
+                    },
+                    timeout=30
+                )
+            if response.status_code != 200:
+                raise RuntimeError(f"API Error {response.status_code}: {response.text}")
+            data = response.json()
+            assistant_message = data.get("response", "No response received")
             
-            if response.status_code == 200:
-                data = response.json()
-                assistant_message = data.get("response", "No response received")
-                
-                # Add to session state
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": assistant_message
-                })
-                
-                # Display assistant response
-                with st.chat_message("assistant"):
-                    st.markdown(assistant_message)
-            else:
-                error_msg = f"API Error {response.status_code}: {response.text}"
-                st.error(error_msg)
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": f"❌ {error_msg}"
-                })
-                
-        except requests.exceptions.ConnectionError:
-            error = "Cannot connect to Agent API. Make sure it's running on port 8001."
-            st.error(f"❌ {error}")
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": f"❌ Connection Error: {error}"
-            })
-        except requests.exceptions.Timeout:
-            error = "Request timed out. The agent may be processing a complex query."
-            st.warning(f"⏱️ {error}")
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": f"⏱️ {error}"
-            })
-        except Exception as e:
-            error = f"Unexpected error: {str(e)}"
-            st.error(f"❌ {error}")
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": f"❌ {error}"
-            })
+            # Display assistant response
+            with st.chat_message("assistant"):
+                st.markdown(assistant_message)
+        
+        # Add to session state
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+            
+    except requests.exceptions.ConnectionError:
+        error = "Cannot connect to Agent API. Make sure it's running on port 8001."
+        st.error(f"❌ {error}")
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": f"❌ Connection Error: {error}"
+        })
+    except requests.exceptions.Timeout:
+        error = "Request timed out. The agent may be processing a complex query."
+        st.warning(f"⏱️ {error}")
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": f"⏱️ {error}"
+        })
+    except RuntimeError as e:
+        st.error(str(e))
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": f"❌ {e}"
+        })
+    except Exception as e:
+        error = f"Unexpected error: {str(e)}"
+        st.error(f"❌ {error}")
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": f"❌ {error}"
+        })
 
 # Footer
 st.divider()
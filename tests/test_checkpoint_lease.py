@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+from disk_checkpointer import DiskBackedSaver
+
+THREAD_ID = "shared-thread"
+TURNS_PER_WORKER = 15
+
+
+def _worker(db_path, barrier, index):
+    """One API worker: runs turns of the shared thread while the other worker does too."""
+    import operator
+    from typing import Annotated, List, TypedDict
+
+    from langgraph.graph import END, StateGraph
+
+    class State(TypedDict):
+        turns: Annotated[List[str], operator.add]
+
+    async def respond(state):
+        # Long enough for the other worker's turn to start in the meantime.
+        await asyncio.sleep(0.01)
+        return {"turns": [f"answer {len(state['turns'])}"]}
+
+    builder = StateGraph(State)
+    builder.add_node("respond", respond)
+    builder.set_entry_point("respond")
+    builder.add_edge("respond", END)
+    saver = DiskBackedSaver(db_path, evict_interval=0)
+    graph = builder.compile(checkpointer=saver)
+
+    async def run():
+        cfg = {"configurable": {"thread_id": THREAD_ID}}
+        for turn in range(TURNS_PER_WORKER):
+            async with saver.alease(THREAD_ID):
+                await graph.ainvoke({"turns": [f"worker {index} turn {turn}"]}, cfg, durability="exit")
+
+    barrier.wait()
+    asyncio.run(run())
+    saver.close()
+
+
+def test_concurrent_turns_of_one_thread_in_two_workers_keep_every_message(tmp_path):
+    db_path = str(tmp_path / "checkpoints.db")
+    DiskBackedSaver(db_path, evict_interval=0).close()
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(2)
+    workers = [ctx.Process(target=_worker, args=(db_path, barrier, i)) for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=120)
+        assert worker.exitcode == 0
+
+    saver = DiskBackedSaver(db_path, evict_interval=0)
+    checkpoint = saver.get_tuple({"configurable": {"thread_id": THREAD_ID, "checkpoint_ns": ""}}).checkpoint
+    saver.close()
+    # Each turn adds the user's message and an answer; a lost update would drop a pair.
+    assert len(checkpoint["channel_values"]["turns"]) == 2 * 2 * TURNS_PER_WORKER
+
+
+def test_lease_waits_for_the_holder_and_expires_after_a_crash(tmp_path):
+    db_path = str(tmp_path / "checkpoints.db")
+    first = DiskBackedSaver(db_path, evict_interval=0, lease_ttl=0.5)
+    second = DiskBackedSaver(db_path, evict_interval=0, lease_ttl=0.5)
+    order = []
+
+    async def hold(saver, name, delay):
+        await asyncio.sleep(delay)
+        async with saver.alease(THREAD_ID):
+            order.append(f"{name} in")
+            await asyncio.sleep(0.05)
+            order.append(f"{name} out")
+
+    async def run():
+        await asyncio.gather(hold(first, "first", 0), hold(second, "second", 0.01))
+
+    asyncio.run(run())
+    assert order == ["first in", "first out", "second in", "second out"]
+    assert second.lease_stats()["contended"] == 1
+
+    # A worker that died holding the lease blocks the thread only until it expires.
+    assert first._claim_lease(THREAD_ID, "crashed-worker")
+    with second.lease(THREAD_ID):
+        pass
+    assert second.lease_stats()["acquired"] == 2
+    first.close()
+    second.close()
@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("pandas")
+
+import db
+import tools
+from setup_db import INDEXES, TABLES
+
+CUSTOMER_ID = "cust-1"
+# (order_id, purchase timestamp); the NULL ones sort after every dated order.
+ORDERS = [
+    ("o1", "2026-01-01 10:00:00"),
+    ("o2", None),
+    ("o3", "2026-03-01 09:30:00"),
+    ("o4", "2026-03-01 09:30:00"),
+    ("o5", None),
+    ("o6", "2025-12-24 18:00:00"),
+]
+
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "ecommerce.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(TABLES + INDEXES)
+    conn.executemany(
+        "INSERT INTO orders VALUES (?, ?, 'delivered', ?)",
+        [(order_id, CUSTOMER_ID, ts) for order_id, ts in ORDERS] + [("no-items", CUSTOMER_ID, None)],
+    )
+    conn.executemany("INSERT INTO order_items VALUES (?, 'p1', 9.5)", [(order_id,) for order_id, _ in ORDERS])
+    conn.commit()
+    conn.close()
+    pool = db.ConnectionPool(path)
+    monkeypatch.setattr(db, "_pool", pool)
+    yield path
+    pool.close()
+
+
+def _page_through(limit):
+    seen, cursor = [], None
+    while True:
+        page = tools.get_customer_history(CUSTOMER_ID, limit=limit, cursor=cursor)
+        assert page["status"] == "ok", page
+        seen.extend(entry["order_id"] for entry in page["history"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+        assert tools.decode_cursor(cursor) is not None
+
+
+@pytest.mark.parametrize("limit", [1, 2, 4])
+def test_pages_past_orders_without_timestamp(history_db, limit):
+    assert _page_through(limit) == ["o4", "o3", "o1", "o6", "o5", "o2"]
+
+
+def test_cursor_after_undated_order(history_db):
+    first = tools.get_customer_history(CUSTOMER_ID, limit=5)
+    assert first["history"][-1]["order_id"] == "o5"
+    assert tools.decode_cursor(first["next_cursor"]) == (None, "o5")
+
+    rest = tools.get_customer_history(CUSTOMER_ID, limit=5, cursor=first["next_cursor"])
+    assert [entry["order_id"] for entry in rest["history"]] == ["o2"]
+    assert rest["next_cursor"] is None
+
+
+@pytest.mark.parametrize("name", ["get_customer_history (next page)", "get_customer_history (past undated order)"])
+def test_next_page_seeks_past_cursor(history_db, name):
+    sql, params, term = tools.TOOL_QUERIES[name]
+    with sqlite3.connect(history_db) as conn:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    assert any(term in step for step in plan), plan
@@ -0,0 +1,46 @@
+import asyncio
+
+from intent import RULE_CONFIDENCE_THRESHOLD, classify_rules
+
+PRODUCT_ID = "90K0C1fIyQUf"
+ORDER_ID = "Axfy13Hk4PIk"
+CUSTOMER_ID = "hCT0x9JiGXBQ"
+TYPES = {PRODUCT_ID: ["product"], ORDER_ID: ["order"], CUSTOMER_ID: ["customer"]}
+
+
+async def resolve(entity_id):
+    return TYPES.get(entity_id, [])
+
+
+def classify(text):
+    return asyncio.run(classify_rules(text, resolve))
+
+
+def test_matching_keywords_and_id_skip_the_llm():
+    rule = classify(f"status of order {ORDER_ID}")
+    assert rule.intent == "order_status"
+    assert rule.confidence >= RULE_CONFIDENCE_THRESHOLD
+
+
+def test_return_of_an_order_skips_the_llm():
+    rule = classify(f"I want to return order {ORDER_ID}")
+    assert rule.intent == "returns"
+    assert rule.confidence >= RULE_CONFIDENCE_THRESHOLD
+
+
+def test_return_keywords_with_a_product_id_go_to_the_llm():
+    # A product ID cannot serve a return; the keywords and the ID disagree.
+    rule = classify(f"return product {PRODUCT_ID}")
+    assert rule.extracted_id == PRODUCT_ID
+    assert rule.confidence < RULE_CONFIDENCE_THRESHOLD
+
+
+def test_order_history_of_a_customer_skips_the_llm():
+    rule = classify(f"Show the order history for customer {CUSTOMER_ID}")
+    assert rule.intent == "customer_history"
+    assert rule.confidence >= RULE_CONFIDENCE_THRESHOLD
+
+
+def test_unknown_id_goes_to_the_llm():
+    rule = classify("what is the price of Zz9Zz9Zz9Zz9")
+    assert rule.confidence < RULE_CONFIDENCE_THRESHOLD
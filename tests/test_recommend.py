@@ -0,0 +1,13 @@
+import pytest
+
+import tools
+
+
+@pytest.mark.parametrize("limit", [-1, 0, tools.MAX_RECOMMENDATIONS + 1, "5", None])
+def test_rejects_out_of_range_limit(limit):
+    result = tools.recommend_products("cust-1", limit=limit)
+    assert result == {
+        "status": "error",
+        "code": "invalid_input",
+        "message": f"limit must be between 1 and {tools.MAX_RECOMMENDATIONS}",
+    }
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.tools import BaseTool
+from langchain_mcp_adapters.sessions import create_session
+from langchain_mcp_adapters.tools import load_mcp_tools
+from mcp import ClientSession
+
+import tools
+
+logger = logging.getLogger("tool_client")
+
+# Seconds between re-listing the server's tools to notice added/changed tools.
+TOOL_REFRESH_INTERVAL = float(os.getenv("MCP_TOOL_REFRESH_INTERVAL", "60"))
+
+# MCP tool name -> async tools.py function, for the in-process transport.
+# Argument names match the MCP tools in mcp_server.py.
+LOCAL_TOOLS: Dict[str, Callable[..., Awaitable[Dict[str, Any]]]] = {
+    "product_info": tools.aget_product_info,
+    "order_status": tools.acheck_order_status,
+    "return_request": tools.aprocess_return_request,
+    "customer_history": tools.aget_customer_history,
+    "recommend": tools.arecommend_products,
+    "payment_summary": tools.aget_payment_summary,
+    "product_dimensions": tools.aget_product_dimensions,
+    "resolve_entity": tools.aresolve_id,
+    "products_info": tools.aget_products_info,
+    "orders_status": tools.acheck_orders_status,
+    "customers_history": tools.aget_customers_history,
+}
+
+
+def format_tool_output(output: Any) -> Tuple[str, Any]:
+    """Turn a tool call's output into (text for the prompt, raw result).
+
+    MCP tools return a list of content blocks (or a (content, artifact)
+    tuple); local tools return the result dict itself.
+    """
+    if isinstance(output, tuple) and len(output) == 2:
+        result, _artifact = output
+    else:
+        result = output
+
+    formatted_result = ""
+    if isinstance(result, dict):
+        try:
+            formatted_result = json.dumps(result)
+        except Exception:
+            formatted_result = str(result)
+    elif isinstance(result, list):
+        for block in result:
+            if isinstance(block, dict) and block.get("type") == "text":
+                formatted_result += block.get("text", "")
+            else:
+                formatted_result += str(block)
+    else:
+        formatted_result = str(result)
+    return formatted_result, result
+
+
+def _tool_signature(listed) -> str:
+    """Stable fingerprint of a tool listing (names, descriptions, input schemas)."""
+    return json.dumps(
+        sorted((t.name, t.description or "", t.inputSchema) for t in listed),
+        sort_keys=True,
+        default=str,
+    )
+
+
+class MCPToolClient:
+    """Long-lived MCP client session with a cached name -> tool map.
+
+    `load_mcp_tools(None, connection=...)` opens a new session and lists the
+    tools on every call. This client connects once per event loop and
+    reuses the session and tool objects for every graph run. The session is
+    owned by a background task (the transport's task groups must be exited
+    by the task that entered them). On a failed call the session is torn
+    down and the call retried once on a fresh one; the tool listing is
+    re-checked every `refresh_interval` seconds and the map rebuilt if it
+    changed.
+    """
+
+    def __init__(self, connection: Dict[str, Any], refresh_interval: float = TOOL_REFRESH_INTERVAL):
+        self.connection = connection
+        self.refresh_interval = refresh_interval
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[ClientSession] = None
+        self._tools: Dict[str, BaseTool] = {}
+        self._signature: Optional[str] = None
+        self._refreshed_at = 0.0
+        self._closed: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        # Cost of the connect + list round-trip a reused session avoids.
+        self._setup_ms = 0.0
+        self._stats = {
+            "calls": 0,
+            "connects": 0,
+            "reconnects": 0,
+            "reused": 0,
+            "refreshes": 0,
+            "tool_list_changes": 0,
+            "saved_ms_total": 0.0,
+        }
+
+    async def _run_session(self, ready: "asyncio.Future[ClientSession]", closed: asyncio.Event) -> None:
+        try:
+            async with create_session(self.connection) as session:
+                await session.initialize()
+                ready.set_result(session)
+                await closed.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif not isinstance(e, asyncio.CancelledError):
+                logger.warning(f"MCP session closed: {e}")
+
+    async def _connect(self) -> None:
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        ready: "asyncio.Future[ClientSession]" = loop.create_future()
+        self._closed = asyncio.Event()
+        self._runner = loop.create_task(self._run_session(ready, self._closed))
+        self._session = await ready
+        self._tools = {t.name: t for t in await load_mcp_tools(self._session)}
+        self._signature = _tool_signature((await self._session.list_tools()).tools)
+        self._refreshed_at = time.monotonic()
+        self._setup_ms = (time.perf_counter() - start) * 1000
+        self._stats["connects"] += 1
+        logger.info(f"MCP session opened: {len(self._tools)} tools in {self._setup_ms:.1f} ms")
+
+    async def _disconnect(self) -> None:
+        if self._closed is not None:
+            self._closed.set()
+        if self._runner is not None and self._runner.get_loop() is asyncio.get_running_loop():
+            try:
+                await asyncio.wait_for(self._runner, timeout=5)
+            except (asyncio.TimeoutError, Exception):
+                self._runner.cancel()
+        self._session, self._tools, self._signature = None, {}, None
+        self._runner, self._closed = None, None
+
+    async def _refresh(self) -> None:
+        """Re-list tools and rebuild the map if the server's tools changed."""
+        self._refreshed_at = time.monotonic()
+        self._stats["refreshes"] += 1
+        signature = _tool_signature((await self._session.list_tools()).tools)
+        if signature != self._signature:
+            self._tools = {t.name: t for t in await load_mcp_tools(self._session)}
+            self._signature = signature
+            self._stats["tool_list_changes"] += 1
+            logger.info(f"MCP tool list changed: {sorted(self._tools)}")
+
+    async def _ensure(self) -> bool:
+        """Make sure a session exists on the running loop; True if one was reused."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Sessions and locks are bound to the loop that created them.
+            self._loop, self._lock = loop, asyncio.Lock()
+            self._session, self._tools, self._runner, self._closed = None, {}, None, None
+        async with self._lock:
+            if self._session is None:
+                await self._connect()
+                return False
+            if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                try:
+                    await self._refresh()
+                except Exception as e:
+                    logger.warning(f"MCP tool refresh failed, reconnecting: {e}")
+                    await self._disconnect()
+                    self._stats["reconnects"] += 1
+                    await self._connect()
+                    return False
+            return True
+
+    async def _reset(self) -> None:
+        async with self._lock:
+            await self._disconnect()
+            self._stats["reconnects"] += 1
+
+    async def list_tools(self) -> List[BaseTool]:
+        await self._ensure()
+        return list(self._tools.values())
+
+    async def call(self, name: str, args: Dict[str, Any]) -> Tuple[Any, Optional[BaseTool]]:
+        """Invoke tool `name`, retrying once on a fresh session if the call fails.
+
+        Returns (tool output, tool), or (None, None) if the server has no such tool.
+        """
+        start = time.perf_counter()
+        for attempt in range(2):
+            reused = await self._ensure()
+            tool = self._tools.get(name)
+            if tool is None:
+                return None, None
+            try:
+                output = await tool.ainvoke(args)
+                break
+            except Exception as e:
+                if attempt:
+                    raise
+                logger.warning(f"MCP call {name} failed, reconnecting: {e}")
+                await self._reset()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats["calls"] += 1
+        if reused:
+            self._stats["reused"] += 1
+            self._stats["saved_ms_total"] += self._setup_ms
+            logger.info(f"MCP {name}: {elapsed_ms:.1f} ms (session reused, saved ~{self._setup_ms:.1f} ms)")
+        else:
+            logger.info(f"MCP {name}: {elapsed_ms:.1f} ms (new session, {self._setup_ms:.1f} ms setup)")
+        return output, tool
+
+    async def close(self) -> None:
+        if self._lock is not None and self._loop is asyncio.get_running_loop():
+            async with self._lock:
+                await self._disconnect()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["transport"] = "mcp"
+        stats["tools"] = sorted(self._tools)
+        stats["setup_ms"] = self._setup_ms
+        stats["saved_ms_avg"] = stats["saved_ms_total"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+class LocalToolClient:
+    """In-process transport: calls the async tools.py functions directly.
+
+    Same `call` interface as MCPToolClient, but skips SSE and JSON entirely;
+    results are the tool's dicts, passed through unchanged. Use it when the
+    agent and the database live on the same host. Queries run on db's
+    shared executor with the same deadline as on the MCP server, and a
+    cancelled turn interrupts its query.
+    """
+
+    def __init__(self):
+        self._stats = {"calls": 0, "errors": 0, "call_ms_total": 0.0}
+
+    async def list_tools(self) -> List[str]:
+        return list(LOCAL_TOOLS)
+
+    async def call(
+        self, name: str, args: Dict[str, Any]
+    ) -> Tuple[Any, Optional[Callable[..., Awaitable[Dict[str, Any]]]]]:
+        """Run tool `name`. Returns (result dict, function), or (None, None)."""
+        fn = LOCAL_TOOLS.get(name)
+        if fn is None:
+            return None, None
+        start = time.perf_counter()
+        try:
+            result = await fn(**args)
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats["calls"] += 1
+        self._stats["call_ms_total"] += elapsed_ms
+        logger.info(f"local {name}: {elapsed_ms:.2f} ms")
+        return result, fn
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["transport"] = "local"
+        stats["call_ms_avg"] = stats["call_ms_total"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+def make_tool_client(transport: str, connection: Dict[str, Any]):
+    """Build the client for TOOL_TRANSPORT: "mcp" (SSE to mcp_server.py) or "local"."""
+    if transport == "local":
+        return LocalToolClient()
+    if transport == "mcp":
+        return MCPToolClient(connection)
+    raise ValueError(f"Unknown TOOL_TRANSPORT {transport!r}; expected 'mcp' or 'local'")
@@ -1,8 +1,161 @@
-import sqlite3
+import base64
+import binascii
+import json
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
-
-DB_PATH = "ecommerce.db"
+from functools import wraps
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+
+from db import QueryInterrupted, connection, run_query
+
+PRODUCT_QUERY = "SELECT product_id, name, price, stock_status, description FROM products WHERE product_id = ?"
+ORDER_STATUS_QUERY = "SELECT order_status, order_purchase_timestamp FROM orders WHERE order_id = ?"
+ORDER_TIMESTAMP_QUERY = "SELECT order_purchase_timestamp FROM orders WHERE order_id = ?"
+# One page of a customer's orders, newest first, with their items. Keyset
+# pagination: ?2/?3 are the (timestamp, order_id) of the previous page's
+# last order, and ?4 is one more than the page size, to tell whether another
+# page follows. Orders without a timestamp sort last, as in
+# idx_orders_customer_ts. Each page query has a single seekable filter, so a
+# page is a range seek on the index however deep it is: the first page has
+# none, a page after a dated order compares (timestamp, order_id) and appends
+# the undated tail, and a page after an undated order seeks within that tail.
+_HISTORY_ORDERS = """
+        SELECT o.order_id, o.order_status, o.order_purchase_timestamp
+        FROM orders o
+        WHERE o.customer_id = ?1{after}
+          AND EXISTS (SELECT 1 FROM order_items oi WHERE oi.order_id = o.order_id)
+        ORDER BY o.order_purchase_timestamp DESC, o.order_id DESC
+        LIMIT ?4
+"""
+_HISTORY_PAGE = """
+    WITH page AS ({orders})
+    SELECT page.order_id, page.order_status, page.order_purchase_timestamp, oi.product_id, oi.price
+    FROM page
+    JOIN order_items oi ON page.order_id = oi.order_id
+    ORDER BY page.order_purchase_timestamp DESC, page.order_id DESC
+"""
+CUSTOMER_HISTORY_QUERY = _HISTORY_PAGE.format(orders=_HISTORY_ORDERS.format(after=""))
+CUSTOMER_HISTORY_AFTER_QUERY = _HISTORY_PAGE.format(orders=f"""
+        SELECT * FROM ({_HISTORY_ORDERS.format(
+            after=" AND (o.order_purchase_timestamp, o.order_id) < (?2, ?3)")})
+        UNION ALL
+        SELECT * FROM ({_HISTORY_ORDERS.format(after=" AND o.order_purchase_timestamp IS NULL")})
+        ORDER BY 3 DESC, 1 DESC
+        LIMIT ?4
+""")
+CUSTOMER_HISTORY_UNDATED_QUERY = _HISTORY_PAGE.format(orders=_HISTORY_ORDERS.format(
+    after=" AND o.order_purchase_timestamp IS NULL AND o.order_id < ?3"))
+CUSTOMER_ORDERS_SUMMARY_QUERY = """
+    SELECT order_status, COUNT(*), MIN(order_purchase_timestamp), MAX(order_purchase_timestamp)
+    FROM orders
+    WHERE customer_id = ?
+    GROUP BY order_status
+"""
+# Top categories by items bought; the window sums run before LIMIT, so they cover every category.
+CUSTOMER_CATEGORIES_QUERY = """
+    SELECT category, items, spend, SUM(items) OVER (), SUM(spend) OVER ()
+    FROM (
+        SELECT COALESCE(p.name, 'unknown') AS category, COUNT(*) AS items, SUM(oi.price) AS spend
+        FROM orders o
+        JOIN order_items oi ON o.order_id = oi.order_id
+        LEFT JOIN products p ON p.product_id = oi.product_id
+        WHERE o.customer_id = ?
+        GROUP BY category
+    )
+    ORDER BY items DESC, spend DESC, category
+    LIMIT ?
+"""
+PAYMENTS_QUERY = """
+    SELECT payment_sequential, payment_type, payment_installments, payment_value
+    FROM payments
+    WHERE order_id = ?
+    ORDER BY payment_sequential
+"""
+PRODUCT_DIMENSIONS_QUERY = """
+    SELECT product_id, name, product_weight_g, product_length_cm, product_height_cm, product_width_cm
+    FROM products
+    WHERE product_id = ?
+"""
+PURCHASED_QUERY = """
+    SELECT DISTINCT oi.product_id, COALESCE(p.name, '')
+    FROM orders o
+    JOIN order_items oi ON o.order_id = oi.order_id
+    JOIN products p ON p.product_id = oi.product_id
+    WHERE o.customer_id = ?
+"""
+CO_PURCHASE_QUERY = "SELECT rec_product_id, score FROM rec_copurchase WHERE product_id = ?"
+CATEGORY_TOP_QUERY = "SELECT product_id FROM rec_category_top WHERE category = ? ORDER BY rank LIMIT ?"
+# Batch variants: one query for a JSON array of IDs, bound as a single parameter.
+PRODUCTS_BATCH_QUERY = """
+    SELECT product_id, name, price, stock_status, description
+    FROM products
+    WHERE product_id IN (SELECT value FROM json_each(?))
+"""
+ORDERS_STATUS_BATCH_QUERY = """
+    SELECT order_id, order_status, order_purchase_timestamp
+    FROM orders
+    WHERE order_id IN (SELECT value FROM json_each(?))
+"""
+# The latest ?2 orders of each customer, ranked the way CUSTOMER_HISTORY_QUERY
+# pages them (only orders with items, ties broken by order_id), then their items.
+CUSTOMERS_HISTORY_BATCH_QUERY = """
+    WITH ranked AS (
+        SELECT o.customer_id, o.order_id, o.order_status, o.order_purchase_timestamp,
+               ROW_NUMBER() OVER (
+                   PARTITION BY o.customer_id
+                   ORDER BY o.order_purchase_timestamp DESC, o.order_id DESC
+               ) AS rn
+        FROM orders o
+        WHERE o.customer_id IN (SELECT value FROM json_each(?1))
+          AND EXISTS (SELECT 1 FROM order_items oi WHERE oi.order_id = o.order_id)
+    )
+    SELECT ranked.customer_id, ranked.order_id, ranked.order_status, ranked.order_purchase_timestamp,
+           oi.product_id, oi.price
+    FROM ranked
+    JOIN order_items oi ON ranked.order_id = oi.order_id
+    WHERE ranked.rn <= ?2
+    ORDER BY ranked.customer_id, ranked.order_purchase_timestamp DESC, ranked.order_id DESC
+"""
+RESOLVE_ID_QUERY = """
+    SELECT 'product' FROM products WHERE product_id = ?
+    UNION ALL SELECT 'order' FROM orders WHERE order_id = ?
+    UNION ALL SELECT 'customer' FROM customers WHERE customer_id = ?
+"""
+
+# Keyed lookups issued by the tools, with sample parameters for EXPLAIN QUERY PLAN
+# and, optionally, a search term the plan must contain.
+TOOL_QUERIES = {
+    "get_product_info": (PRODUCT_QUERY, ("",)),
+    "check_order_status": (ORDER_STATUS_QUERY, ("",)),
+    "process_return_request": (ORDER_TIMESTAMP_QUERY, ("",)),
+    "get_customer_history": (CUSTOMER_HISTORY_QUERY, ("", None, None, 51)),
+    "get_customer_history (next page)": (
+        CUSTOMER_HISTORY_AFTER_QUERY, ("", "", "", 51),
+        "(customer_id=? AND (order_purchase_timestamp,order_id)<(?,?))",
+    ),
+    "get_customer_history (past undated order)": (
+        CUSTOMER_HISTORY_UNDATED_QUERY, ("", None, "", 51),
+        "(customer_id=? AND order_purchase_timestamp=? AND order_id<?)",
+    ),
+    "get_customer_summary (orders)": (CUSTOMER_ORDERS_SUMMARY_QUERY, ("",)),
+    "get_customer_summary (categories)": (CUSTOMER_CATEGORIES_QUERY, ("", 5)),
+    "get_payment_summary": (PAYMENTS_QUERY, ("",)),
+    "get_product_dimensions": (PRODUCT_DIMENSIONS_QUERY, ("",)),
+    "resolve_id": (RESOLVE_ID_QUERY, ("", "", "")),
+    "get_products_info": (PRODUCTS_BATCH_QUERY, ('[""]',)),
+    "check_orders_status": (ORDERS_STATUS_BATCH_QUERY, ('[""]',)),
+    "get_customers_history": (CUSTOMERS_HISTORY_BATCH_QUERY, ('[""]', 50)),
+    "recommend_products (purchases)": (PURCHASED_QUERY, ("",)),
+    "recommend_products (co-purchase)": (CO_PURCHASE_QUERY, ("",)),
+    "recommend_products (category top)": (CATEGORY_TOP_QUERY, ("", 5)),
+}
+
+
+# Most IDs a batch tool accepts per call.
+MAX_BATCH_IDS = 1000
+# Most orders per customer_history page.
+MAX_HISTORY_PAGE = 200
+# Most products recommend_products returns per call.
+MAX_RECOMMENDATIONS = 20
 
 
 def _validate_id(value: str) -> bool:
@@ -10,9 +163,35 @@ def _validate_id(value: str) -> bool:
     return isinstance(value, str) and bool(value.strip())
 
 
-def _connect():
-    """Get a connection to the e-commerce database."""
-    return sqlite3.connect(DB_PATH)
+def _validate_ids(values: List[str], name: str) -> Optional[Dict[str, Any]]:
+    """Error payload for an unusable ID list, or None if it is valid."""
+    if not isinstance(values, list) or not values:
+        return {"status": "error", "code": "invalid_input", "message": f"{name} must be a non-empty list"}
+    if len(values) > MAX_BATCH_IDS:
+        return {"status": "error", "code": "invalid_input", "message": f"At most {MAX_BATCH_IDS} {name} per call"}
+    if not all(_validate_id(v) for v in values):
+        return {"status": "error", "code": "invalid_input", "message": f"Every entry of {name} must be an ID"}
+    return None
+
+
+def _product(row) -> Dict[str, Any]:
+    return {
+        "product_id": row[0],
+        "name": row[1],
+        "price": float(row[2]) if row[2] is not None else None,
+        "stock_status": row[3],
+        "description": row[4],
+    }
+
+
+def _history_entry(row) -> Dict[str, Any]:
+    return {
+        "order_id": row[0],
+        "status": row[1],
+        "timestamp": row[2],
+        "product_id": row[3],
+        "price": float(row[4]) if row[4] is not None else None,
+    }
 
 
 def get_product_info(product_id: str) -> Dict[str, Any]:
@@ -23,28 +202,27 @@ def get_product_info(product_id: str) -> Dict[str, Any]:
     if not _validate_id(product_id):
         return {"status": "error", "code": "invalid_input", "message": "product_id is required"}
 
-    conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT product_id, name, price, stock_status, description FROM products WHERE product_id = ?",
-        (product_id,),
-    )
-    row = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(PRODUCT_QUERY, (product_id,)).fetchone()
 
     if not row:
         return {"status": "error", "code": "not_found", "message": "Product not found", "product_id": product_id}
 
-    return {
-        "status": "ok",
-        "product": {
-            "product_id": row[0],
-            "name": row[1],
-            "price": float(row[2]) if row[2] is not None else None,
-            "stock_status": row[3],
-            "description": row[4],
-        },
-    }
+    return {"status": "ok", "product": _product(row)}
+
+
+def get_products_info(product_ids: List[str]) -> Dict[str, Any]:
+    """Fetch details for many products in one query, keyed by product_id."""
+    error = _validate_ids(product_ids, "product_ids")
+    if error:
+        return error
+
+    ids = list(dict.fromkeys(product_ids))
+    with connection() as conn:
+        rows = conn.execute(PRODUCTS_BATCH_QUERY, (json.dumps(ids),)).fetchall()
+
+    products = {row[0]: _product(row) for row in rows}
+    return {"status": "ok", "products": products, "not_found": [i for i in ids if i not in products]}
 
 
 def check_order_status(order_id: str) -> Dict[str, Any]:
@@ -52,11 +230,8 @@ def check_order_status(order_id: str) -> Dict[str, Any]:
     if not _validate_id(order_id):
         return {"status": "error", "code": "invalid_input", "message": "order_id is required"}
 
-    conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute("SELECT order_status, order_purchase_timestamp FROM orders WHERE order_id = ?", (order_id,))
-    row = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(ORDER_STATUS_QUERY, (order_id,)).fetchone()
 
     if not row:
         return {"status": "error", "code": "not_found", "message": "Order not found", "order_id": order_id}
@@ -64,16 +239,27 @@ def check_order_status(order_id: str) -> Dict[str, Any]:
     return {"status": "ok", "order": {"order_id": order_id, "status": row[0], "purchase_timestamp": row[1]}}
 
 
+def check_orders_status(order_ids: List[str]) -> Dict[str, Any]:
+    """Fetch status and purchase timestamp for many orders in one query, keyed by order_id."""
+    error = _validate_ids(order_ids, "order_ids")
+    if error:
+        return error
+
+    ids = list(dict.fromkeys(order_ids))
+    with connection() as conn:
+        rows = conn.execute(ORDERS_STATUS_BATCH_QUERY, (json.dumps(ids),)).fetchall()
+
+    orders = {row[0]: {"order_id": row[0], "status": row[1], "purchase_timestamp": row[2]} for row in rows}
+    return {"status": "ok", "orders": orders, "not_found": [i for i in ids if i not in orders]}
+
+
 def process_return_request(order_id: str, reason: str) -> Dict[str, Any]:
     """Process a return request. Checks eligibility within 30-day return window."""
     if not _validate_id(order_id):
         return {"status": "error", "code": "invalid_input", "message": "order_id is required"}
 
-    conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute("SELECT order_purchase_timestamp FROM orders WHERE order_id = ?", (order_id,))
-    row = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        row = conn.execute(ORDER_TIMESTAMP_QUERY, (order_id,)).fetchone()
 
     if not row:
         return {"status": "error", "code": "not_found", "message": "Order not found", "order_id": order_id}
@@ -101,67 +287,281 @@ def process_return_request(order_id: str, reason: str) -> Dict[str, Any]:
         return {"status": "ok", "order_id": order_id, "eligible": False, "message": "Order is outside the 30-day return window."}
 
 
-def get_customer_history(customer_id: str, limit: int = 50) -> Dict[str, Any]:
-    """Fetch purchase history for a customer with their orders and products."""
+def encode_cursor(timestamp: Optional[str], order_id: str) -> str:
+    """Opaque page token for the order after which the next page starts."""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, order_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[Optional[str], str]]:
+    """(timestamp, order_id) from a page token, or None if it is malformed.
+
+    The timestamp is None when the page ended on an order without one.
+    """
+    try:
+        timestamp, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        return None
+    if not (timestamp is None or isinstance(timestamp, str)) or not isinstance(order_id, str):
+        return None
+    return timestamp, order_id
+
+
+def get_customer_history(
+    customer_id: str, limit: int = 50, cursor: Optional[str] = None, summary: bool = False
+) -> Dict[str, Any]:
+    """Fetch one page of a customer's orders (newest first) with their products.
+
+    `limit` is the number of orders per page. Pass the returned `next_cursor`
+    back as `cursor` for the following page; it is None on the last page.
+    With `summary=True`, returns `get_customer_summary` instead.
+    """
     if not _validate_id(customer_id):
         return {"status": "error", "code": "invalid_input", "message": "customer_id is required"}
+    if summary:
+        return get_customer_summary(customer_id)
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_HISTORY_PAGE:
+        return {"status": "error", "code": "invalid_input", "message": f"limit must be between 1 and {MAX_HISTORY_PAGE}"}
+    after: Tuple[Optional[str], Optional[str]] = (None, None)
+    if cursor:
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            return {"status": "error", "code": "invalid_input", "message": "cursor is not a valid page token"}
+        after = decoded
+
+    if after[1] is None:
+        query = CUSTOMER_HISTORY_QUERY
+    elif after[0] is None:
+        query = CUSTOMER_HISTORY_UNDATED_QUERY
+    else:
+        query = CUSTOMER_HISTORY_AFTER_QUERY
+    with connection() as conn:
+        rows = conn.execute(query, (customer_id, *after, limit + 1)).fetchall()
 
-    conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT o.order_id, o.order_status, o.order_purchase_timestamp, oi.product_id, oi.price
-        FROM orders o
-        JOIN order_items oi ON o.order_id = oi.order_id
-        WHERE o.customer_id = ?
-        ORDER BY o.order_purchase_timestamp DESC
-        LIMIT ?
-    """,
-        (customer_id, limit),
-    )
-    rows = cursor.fetchall()
-    conn.close()
-
+    # Rows arrive grouped by order; the (limit + 1)-th order only signals another page.
     history: List[Dict[str, Any]] = []
+    orders: List[Tuple[Optional[str], str]] = []
     for row in rows:
-        history.append({
-            "order_id": row[0],
-            "status": row[1],
-            "timestamp": row[2],
-            "product_id": row[3],
-            "price": float(row[4]) if row[4] is not None else None,
-        })
+        if not orders or orders[-1][1] != row[0]:
+            if len(orders) == limit:
+                break
+            orders.append((row[2], row[0]))
+        history.append(_history_entry(row))
+    more = len({row[0] for row in rows}) > limit
 
-    return {"status": "ok", "customer_id": customer_id, "history": history}
+    return {
+        "status": "ok",
+        "customer_id": customer_id,
+        "history": history,
+        "next_cursor": encode_cursor(*orders[-1]) if more else None,
+    }
 
 
-def recommend_products(customer_id: str, limit: int = 5) -> Dict[str, Any]:
-    """Simple recommendation: recommend frequently bought product categories excluding already-bought items."""
-    hist = get_customer_history(customer_id, limit=100)
-    if hist.get("status") != "ok":
-        return {"status": "error", "code": "no_history", "message": "No customer history available"}
-
-    purchased = {h["product_id"] for h in hist.get("history", [])}
-
-    conn = _connect()
-    cursor = conn.cursor()
-    # Find products not yet purchased; prefer ones with a price and in-stock
-    cursor.execute(
-        "SELECT product_id, name, price, stock_status, description FROM products WHERE product_id NOT IN ({}) LIMIT ?".format(
-            ",".join(["?" for _ in purchased]) if purchased else "''"
-        ),
-        tuple(purchased) + (limit,) if purchased else (limit,),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+def get_customer_summary(customer_id: str, top_categories: int = 5) -> Dict[str, Any]:
+    """Aggregate a customer's purchases in SQL: orders by status, spend and top categories."""
+    if not _validate_id(customer_id):
+        return {"status": "error", "code": "invalid_input", "message": "customer_id is required"}
 
-    recs = []
+    with connection() as conn:
+        statuses = conn.execute(CUSTOMER_ORDERS_SUMMARY_QUERY, (customer_id,)).fetchall()
+        categories = conn.execute(CUSTOMER_CATEGORIES_QUERY, (customer_id, top_categories)).fetchall()
+
+    first = [row[2] for row in statuses if row[2] is not None]
+    last = [row[3] for row in statuses if row[3] is not None]
+    return {
+        "status": "ok",
+        "customer_id": customer_id,
+        "summary": {
+            "orders": sum(row[1] for row in statuses),
+            "orders_by_status": {row[0]: row[1] for row in statuses},
+            "first_order": min(first) if first else None,
+            "last_order": max(last) if last else None,
+            "items": categories[0][3] if categories else 0,
+            "spend_total": round(categories[0][4] or 0.0, 2) if categories else 0.0,
+            "top_categories": [
+                {"category": row[0], "items": row[1], "spend": round(row[2] or 0.0, 2)} for row in categories
+            ],
+        },
+    }
+
+
+def get_customers_history(customer_ids: List[str], limit: int = 50) -> Dict[str, Any]:
+    """Fetch the latest `limit` orders of many customers, with their products, in one query.
+
+    Keyed by customer_id; each history matches the first page of `get_customer_history`.
+    """
+    error = _validate_ids(customer_ids, "customer_ids")
+    if error:
+        return error
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_HISTORY_PAGE:
+        return {"status": "error", "code": "invalid_input", "message": f"limit must be between 1 and {MAX_HISTORY_PAGE}"}
+
+    ids = list(dict.fromkeys(customer_ids))
+    with connection() as conn:
+        rows = conn.execute(CUSTOMERS_HISTORY_BATCH_QUERY, (json.dumps(ids), limit)).fetchall()
+
+    histories: Dict[str, List[Dict[str, Any]]] = {customer_id: [] for customer_id in ids}
     for row in rows:
-        recs.append({
+        histories[row[0]].append(_history_entry(row[1:]))
+    return {"status": "ok", "histories": histories}
+
+
+def get_payment_summary(order_id: str) -> Dict[str, Any]:
+    """Summarize how an order was paid: total, installments and payment methods."""
+    if not _validate_id(order_id):
+        return {"status": "error", "code": "invalid_input", "message": "order_id is required"}
+
+    with connection() as conn:
+        rows = conn.execute(PAYMENTS_QUERY, (order_id,)).fetchall()
+
+    if not rows:
+        return {"status": "error", "code": "not_found", "message": "No payments found for order", "order_id": order_id}
+
+    payments = [
+        {
+            "sequential": row[0],
+            "type": row[1],
+            "installments": row[2],
+            "value": float(row[3]) if row[3] is not None else None,
+        }
+        for row in rows
+    ]
+    return {
+        "status": "ok",
+        "order_id": order_id,
+        "payment": {
+            "total_value": round(sum(p["value"] or 0.0 for p in payments), 2),
+            "max_installments": max((p["installments"] or 0) for p in payments),
+            "payment_types": sorted({p["type"] for p in payments if p["type"]}),
+            "payments": payments,
+        },
+    }
+
+
+def get_product_dimensions(product_id: str) -> Dict[str, Any]:
+    """Fetch shipping weight (g) and package dimensions (cm) for a product."""
+    if not _validate_id(product_id):
+        return {"status": "error", "code": "invalid_input", "message": "product_id is required"}
+
+    with connection() as conn:
+        row = conn.execute(PRODUCT_DIMENSIONS_QUERY, (product_id,)).fetchone()
+
+    if not row:
+        return {"status": "error", "code": "not_found", "message": "Product not found", "product_id": product_id}
+
+    length, height, width = row[3], row[4], row[5]
+    volume = length * height * width if None not in (length, height, width) else None
+    return {
+        "status": "ok",
+        "product": {
             "product_id": row[0],
             "name": row[1],
-            "price": float(row[2]) if row[2] is not None else None,
-            "stock_status": row[3],
-        })
+            "weight_g": row[2],
+            "length_cm": length,
+            "height_cm": height,
+            "width_cm": width,
+            "volume_cm3": volume,
+        },
+    }
+
+
+def resolve_id(entity_id: str) -> Dict[str, Any]:
+    """Find which of products, orders and customers an ID belongs to."""
+    if not _validate_id(entity_id):
+        return {"status": "error", "code": "invalid_input", "message": "entity_id is required"}
+
+    with connection() as conn:
+        rows = conn.execute(RESOLVE_ID_QUERY, (entity_id,) * 3).fetchall()
+
+    return {"status": "ok", "entity_id": entity_id, "types": [row[0] for row in rows]}
+
+
+def _recommend(conn, customer_id: str, limit: int) -> List[Dict[str, Any]]:
+    """Rank recommendations for a customer using the precomputed index tables.
+
+    Products co-purchased with the customer's items come first (summed
+    co-purchase score), then the most popular products of the customer's
+    categories, then the most popular products overall. Every step is a
+    primary-key prefix lookup.
+    """
+    bought = conn.execute(PURCHASED_QUERY, (customer_id,)).fetchall()
+    purchased = {row[0] for row in bought}
+    categories: Dict[str, int] = {}
+    for _, category in bought:
+        categories[category] = categories.get(category, 0) + 1
+
+    scores: Dict[str, float] = {}
+    for product_id in purchased:
+        for rec_id, score in conn.execute(CO_PURCHASE_QUERY, (product_id,)):
+            if rec_id not in purchased:
+                scores[rec_id] = scores.get(rec_id, 0.0) + score
+    ranked = sorted(scores, key=lambda pid: (-scores[pid], pid))[:limit]
+    reasons = {pid: "bought_together" for pid in ranked}
+
+    fallbacks = [(c, "category") for c in sorted(categories, key=lambda c: -categories[c])] + [("*", "popular")]
+    for category, reason in fallbacks:
+        if len(ranked) >= limit:
+            break
+        for (product_id,) in conn.execute(CATEGORY_TOP_QUERY, (category, limit + len(purchased))):
+            if product_id not in purchased and product_id not in reasons:
+                ranked.append(product_id)
+                reasons[product_id] = reason
+                if len(ranked) >= limit:
+                    break
+
+    recs = []
+    for product_id in ranked:
+        row = conn.execute(PRODUCT_QUERY, (product_id,)).fetchone()
+        if row:
+            recs.append({
+                "product_id": row[0],
+                "name": row[1],
+                "price": float(row[2]) if row[2] is not None else None,
+                "stock_status": row[3],
+                "reason": reasons[product_id],
+            })
+    return recs
+
+
+def recommend_products(customer_id: str, limit: int = 5) -> Dict[str, Any]:
+    """Recommend products a customer has not bought, ranked by co-purchases and category popularity."""
+    if not _validate_id(customer_id):
+        return {"status": "error", "code": "invalid_input", "message": "customer_id is required"}
+    if not isinstance(limit, int) or not 1 <= limit <= MAX_RECOMMENDATIONS:
+        return {"status": "error", "code": "invalid_input", "message": f"limit must be between 1 and {MAX_RECOMMENDATIONS}"}
+
+    with connection() as conn:
+        recs = _recommend(conn, customer_id, limit)
 
     return {"status": "ok", "recommendations": recs}
+
+
+# --- Async variants ---
+# Same tools for event-loop callers (the MCP server, the local tool client):
+# the blocking SQLite work runs on db's bounded executor with a per-call
+# deadline, and a query still running at the deadline or when the caller is
+# cancelled is interrupted.
+
+
+def _async_tool(fn: Callable[..., Dict[str, Any]]) -> Callable[..., Awaitable[Dict[str, Any]]]:
+    @wraps(fn)
+    async def tool(*args: Any, **kwargs: Any) -> Dict[str, Any]:
+        try:
+            return await run_query(fn, *args, **kwargs)
+        except QueryInterrupted as e:
+            return {"status": "error", "code": "timeout", "message": str(e)}
+
+    return tool
+
+
+aget_product_info = _async_tool(get_product_info)
+aget_products_info = _async_tool(get_products_info)
+acheck_order_status = _async_tool(check_order_status)
+acheck_orders_status = _async_tool(check_orders_status)
+aprocess_return_request = _async_tool(process_return_request)
+aget_customer_history = _async_tool(get_customer_history)
+aget_customer_summary = _async_tool(get_customer_summary)
+aget_customers_history = _async_tool(get_customers_history)
+aget_payment_summary = _async_tool(get_payment_summary)
+aget_product_dimensions = _async_tool(get_product_dimensions)
+aresolve_id = _async_tool(resolve_id)
+arecommend_products = _async_tool(recommend_products)